@@ -9,17 +9,30 @@
 #   POST   /api/v1/admin/users               -> create_user_admin
 #   PUT    /api/v1/admin/users/{user_id}     -> update_user_admin
 #   DELETE /api/v1/admin/users/{user_id}     -> delete_user_admin
+#   POST   /api/v1/admin/users/import        -> import_users_admin (CSV / NDJSON)
 #
 # ⚠️ Todas requieren actor_id=... (SUPERUSER o ADMIN)
 
-from typing import List, Optional, Literal
+import codecs
+import csv
+import json
+from typing import Dict, List, Optional, Literal
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from pydantic import BaseModel, EmailStr, Field
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, EmailStr, Field, ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from app.core.database import get_db
+from app.core.database import begin_for_savepoints, get_db
+from app.core.cache import invalidate_user
+from app.core.activity import rename_activity_user
+from app.core.ledger import post_entry
+from app.core.hierarchy import link_new_users, move_subtree, unlink_user
 from app import models
+from app.core.security import hash_passwords_bulk
+from app.api.auth import invalidate_root_user_cache
 
 router = APIRouter()
 
@@ -96,6 +109,7 @@ class AdminUserCreate(BaseModel):
     role: AllowedRole = "CLIENT"
     is_superuser: bool = False
     balance: float = 0.0
+    parent_id: Optional[int] = None
 
 
 class AdminUserUpdate(BaseModel):
@@ -105,9 +119,41 @@ class AdminUserUpdate(BaseModel):
     password: Optional[str] = Field(None, min_length=4)
     role: Optional[AllowedRole] = None
     is_superuser: Optional[bool] = None
+    parent_id: Optional[int] = None  # re-parent: mueve al usuario con toda su red
     balance: Optional[float] = None
 
 
+# Fila de importación masiva. El padre puede venir por username (otra fila del
+# mismo archivo o un usuario existente) o por id de un usuario existente.
+class AdminUserImportRow(BaseModel):
+    name: str
+    email: EmailStr
+    username: str = Field(..., min_length=1)
+    password: str = Field(..., min_length=4)
+    role: Literal["ADMIN", "DISTRIBUTOR", "RESELLER", "TAQUILLA", "CLIENT"] = "CLIENT"
+    parent_username: Optional[str] = None
+    parent_id: Optional[int] = None
+    full_name: Optional[str] = None
+    cedula: Optional[str] = None
+    telefono: Optional[str] = None
+
+
+class ImportRowResult(BaseModel):
+    row: int
+    username: Optional[str] = None
+    status: str  # CREATED / ERROR
+    id: Optional[int] = None
+    parent_id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class ImportReport(BaseModel):
+    total: int
+    created: int
+    failed: int
+    results: List[ImportRowResult]
+
+
 # -------- Endpoints -------- #
 
 @router.get("", response_model=List[AdminUserRead])
@@ -160,6 +206,9 @@ def create_user_admin(
     if db.query(models.User).filter(models.User.username == data.username).first():
         raise HTTPException(400, "El username ya está en uso")
 
+    if data.parent_id is not None and not db.get(models.User, data.parent_id):
+        raise HTTPException(404, "Padre no encontrado")
+
     user = models.User(
         name=data.name,
         email=data.email,
@@ -167,10 +216,21 @@ def create_user_admin(
         password=data.password,
         role=require_valid_role(data.role),
         is_superuser=data.is_superuser,
-        balance=data.balance,
+        balance=0.0,
+        parent_id=data.parent_id,
     )
 
     db.add(user)
+    db.flush()
+    link_new_users(db, [user.id])
+
+    # Saldo inicial vía ledger para que quede en el historial (mismo commit)
+    if data.balance:
+        post_entry(
+            db, user.id, data.balance, "ADJUSTMENT", f"Saldo inicial (admin #{actor.id})",
+            commit=False, allow_negative=True,
+        )
+
     db.commit()
     db.refresh(user)
     return user
@@ -206,10 +266,35 @@ def update_user_admin(
     if "role" in update and update["role"]:
         update["role"] = require_valid_role(update["role"])
 
+    # Re-parent: la closure table se actualiza en la misma transacción
+    if "parent_id" in update and update["parent_id"] != user.parent_id:
+        new_parent_id = update["parent_id"]
+        if new_parent_id is not None and not db.get(models.User, new_parent_id):
+            raise HTTPException(404, "Padre no encontrado")
+        move_subtree(db, user.id, new_parent_id)
+
+    # El saldo no se escribe directo: la diferencia va por el ledger como ADJUSTMENT
+    new_balance = update.pop("balance", None)
+
+    # El feed de actividad guarda una copia del username
+    if "username" in update and update["username"] != user.username:
+        rename_activity_user(db, user.id, update["username"])
+
     for field, value in update.items():
         setattr(user, field, value)
 
+    if new_balance is not None:
+        delta = float(new_balance) - float(user.balance or 0.0)
+        if delta:
+            post_entry(
+                db, user.id, delta, "ADJUSTMENT", f"Ajuste de saldo (admin #{actor.id})",
+                commit=False, allow_negative=True,
+            )
+
     db.commit()
+    invalidate_user(user.id)
+    if "role" in update or "is_superuser" in update:
+        invalidate_root_user_cache()
     db.refresh(user)
     return user
 
@@ -227,7 +312,326 @@ def delete_user_admin(
     if not user:
         raise HTTPException(404, "Usuario no encontrado")
 
+    unlink_user(db, user.id)
     db.delete(user)
     db.commit()
+    invalidate_user(user_id)
+    invalidate_root_user_cache()
     return {"message": "Usuario eliminado correctamente"}
 
+
+# -------- Importación masiva -------- #
+
+IMPORT_MAX_ROWS = 5000
+IMPORT_MAX_BYTES = 8 * 1024 * 1024  # ~1.6 KB por fila con IMPORT_MAX_ROWS filas
+IMPORT_CHUNK_SIZE = 500   # filas por INSERT multi-fila
+
+
+async def _iter_body_lines(request: Request):
+    """
+    Lee el body por chunks y va entregando líneas (corta con 413 al pasar IMPORT_MAX_BYTES).
+    Las filas parseadas sí se juntan en memoria para validarlas y resolver padres: lo que
+    está acotado es la entrada (IMPORT_MAX_BYTES / IMPORT_MAX_ROWS), no el uso de memoria.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > IMPORT_MAX_BYTES:
+            raise HTTPException(413, f"Archivo demasiado grande (máximo {IMPORT_MAX_BYTES // (1024 * 1024)} MB)")
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+async def _read_import_rows(request: Request, fmt: str) -> List[dict]:
+    rows: List[dict] = []
+    header: Optional[List[str]] = None
+    pending = ""
+
+    async for line in _iter_body_lines(request):
+        if fmt == "ndjson":
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = None
+            if not isinstance(item, dict):
+                item = {"__error__": "Línea NDJSON inválida"}
+        else:
+            # Un campo entre comillas puede traer saltos de línea: acumulamos hasta cerrar comillas
+            pending = f"{pending}\n{line}" if pending else line
+            if pending.count('"') % 2:
+                continue
+            values = next(csv.reader([pending]), [])
+            pending = ""
+            if not any(v.strip() for v in values):
+                continue
+            if header is None:
+                header = [h.strip().lower() for h in values]
+                continue
+            item = {k: v.strip() for k, v in zip(header, values) if v.strip() != ""}
+
+        rows.append(item)
+        if len(rows) > IMPORT_MAX_ROWS:
+            raise HTTPException(413, f"Máximo {IMPORT_MAX_ROWS} usuarios por importación")
+
+    return rows
+
+
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _plan_import(
+    db: Session,
+    raw_rows: List[dict],
+    default_parent_id: Optional[int],
+) -> tuple[Dict[int, ImportRowResult], Dict[int, AdminUserImportRow], Dict[int, Optional[int]], Dict[int, int]]:
+    """
+    Valida las filas y resuelve jerarquía SIN escribir nada.
+    Devuelve (resultados, filas válidas, padre existente por fila, padre dentro del lote por fila).
+    El actor ya fue autorizado antes de leer el body (ver import_users_admin).
+    """
+    results: Dict[int, ImportRowResult] = {}
+    valid: Dict[int, AdminUserImportRow] = {}
+
+    def fail(i: int, error: str):
+        valid.pop(i, None)
+        results[i] = ImportRowResult(row=i, username=results[i].username, status="ERROR", error=error)
+
+    # 1. Validación de esquema + duplicados dentro del archivo
+    seen_emails: Dict[str, int] = {}
+    seen_usernames: Dict[str, int] = {}
+    for i, item in enumerate(raw_rows, start=1):
+        results[i] = ImportRowResult(row=i, username=item.get("username"), status="PENDING")
+        if "__error__" in item:
+            fail(i, item["__error__"])
+            continue
+        if item.get("role"):
+            item = {**item, "role": normalize_role(str(item["role"]))}
+        try:
+            row = AdminUserImportRow.model_validate(item)
+        except ValidationError as e:
+            err = e.errors()[0]
+            fail(i, f"{'.'.join(str(x) for x in err['loc'])}: {err['msg']}")
+            continue
+        row.email = row.email.lower()
+        if row.email in seen_emails:
+            fail(i, f"Email duplicado en el archivo (fila {seen_emails[row.email]})")
+            continue
+        if row.username in seen_usernames:
+            fail(i, f"Username duplicado en el archivo (fila {seen_usernames[row.username]})")
+            continue
+        seen_emails[row.email] = i
+        seen_usernames[row.username] = i
+        valid[i] = row
+
+    # 2. Conflictos con usuarios existentes (una consulta IN por chunk)
+    for chunk in _chunks(list(valid.items()), IMPORT_CHUNK_SIZE):
+        emails = {row.email for _, row in chunk}
+        usernames = {row.username for _, row in chunk}
+        taken_emails = {
+            e for (e,) in db.query(models.User.email).filter(models.User.email.in_(emails))
+        }
+        taken_usernames = {
+            u for (u,) in db.query(models.User.username).filter(models.User.username.in_(usernames))
+        }
+        for i, row in chunk:
+            if row.email in taken_emails:
+                fail(i, "El correo ya está en uso")
+            elif row.username in taken_usernames:
+                fail(i, "El username ya está en uso")
+
+    # 3. Padres: primero otra fila válida del lote, si no un usuario existente (username o id)
+    batch_usernames = {row.username: i for i, row in valid.items()}
+    ref_usernames = {
+        row.parent_username for row in valid.values()
+        if row.parent_username and row.parent_username not in batch_usernames
+    }
+    ref_ids = {row.parent_id for row in valid.values() if row.parent_id and not row.parent_username}
+    if default_parent_id is not None:
+        ref_ids.add(default_parent_id)
+
+    existing_by_username: Dict[str, int] = {}
+    for chunk in _chunks(sorted(ref_usernames), IMPORT_CHUNK_SIZE):
+        for uid, uname in db.query(models.User.id, models.User.username).filter(models.User.username.in_(chunk)):
+            existing_by_username[uname] = uid
+    existing_ids = set()
+    for chunk in _chunks(sorted(ref_ids), IMPORT_CHUNK_SIZE):
+        existing_ids.update(uid for (uid,) in db.query(models.User.id).filter(models.User.id.in_(chunk)))
+
+    if default_parent_id is not None and default_parent_id not in existing_ids:
+        raise HTTPException(404, "default_parent_id no existe")
+
+    existing_parent: Dict[int, Optional[int]] = {}
+    batch_parent: Dict[int, int] = {}
+    for i, row in list(valid.items()):
+        if row.parent_username:
+            if row.parent_username == row.username:
+                fail(i, "Un usuario no puede ser su propio padre")
+            elif row.parent_username in batch_usernames:
+                batch_parent[i] = batch_usernames[row.parent_username]
+            elif row.parent_username in existing_by_username:
+                existing_parent[i] = existing_by_username[row.parent_username]
+            else:
+                fail(i, f"Padre no encontrado: {row.parent_username}")
+        elif row.parent_id:
+            if row.parent_id in existing_ids:
+                existing_parent[i] = row.parent_id
+            else:
+                fail(i, f"Padre no encontrado: {row.parent_id}")
+        else:
+            existing_parent[i] = default_parent_id
+
+    # 4. Si el padre (dentro del lote) falló, los hijos también
+    changed = True
+    while changed:
+        changed = False
+        for i, parent_row in list(batch_parent.items()):
+            if i in valid and parent_row not in valid:
+                fail(i, f"El padre (fila {parent_row}) tiene errores")
+                batch_parent.pop(i)
+                changed = True
+
+    return results, valid, existing_parent, batch_parent
+
+
+def _insert_import(
+    db: Session,
+    results: Dict[int, ImportRowResult],
+    valid: Dict[int, AdminUserImportRow],
+    hashes: Dict[int, str],
+    existing_parent: Dict[int, Optional[int]],
+    batch_parent: Dict[int, int],
+) -> None:
+    """
+    Inserta en UNA transacción: cada chunk va en su SAVEPOINT (un IntegrityError, p. ej.
+    otro alta simultánea con el mismo email, marca solo ese chunk y sus hijos como error)
+    y se hace un único commit al final. Si algo más falla no queda nada a medias.
+    """
+    created_ids: Dict[int, int] = {}
+    remaining = set(valid)
+    begin_for_savepoints(db)
+
+    # Por rondas: primero las filas que no dependen de otra fila del lote,
+    # luego sus hijos (ya con el id del padre), y así sucesivamente.
+    while remaining:
+        ready = []
+        for i in sorted(remaining):
+            parent_row = batch_parent.get(i)
+            if parent_row is None or parent_row in created_ids:
+                ready.append(i)
+            elif parent_row not in remaining:
+                results[i] = ImportRowResult(
+                    row=i, username=valid[i].username, status="ERROR", error="El padre no se pudo crear",
+                )
+        remaining.difference_update(ready)
+        remaining = {i for i in remaining if results[i].status != "ERROR"}
+
+        if not ready:
+            for i in remaining:
+                results[i] = ImportRowResult(
+                    row=i, username=valid[i].username, status="ERROR", error="Referencia circular entre padres",
+                )
+            break
+
+        for chunk in _chunks(ready, IMPORT_CHUNK_SIZE):
+            values = []
+            for i in chunk:
+                row = valid[i]
+                values.append({
+                    "name": row.name,
+                    "email": row.email,
+                    "username": row.username,
+                    "password": hashes[i],
+                    "hashed_password": hashes[i],
+                    "role": row.role,
+                    "is_superuser": False,
+                    "balance": 0.0,
+                    "is_active": True,
+                    "full_name": row.full_name,
+                    "cedula": row.cedula,
+                    "telefono": row.telefono,
+                    "parent_id": created_ids[batch_parent[i]] if i in batch_parent else existing_parent.get(i),
+                })
+            savepoint = db.begin_nested()
+            try:
+                # Un solo INSERT multi-fila por chunk (RETURNING en el mismo orden)
+                inserted = db.execute(
+                    insert(models.User).returning(models.User.id, sort_by_parameter_order=True),
+                    values,
+                ).all()
+                link_new_users(db, [new_id for (new_id,) in inserted])
+                savepoint.commit()
+            except IntegrityError:
+                savepoint.rollback()
+                for i in chunk:
+                    results[i] = ImportRowResult(
+                        row=i, username=valid[i].username, status="ERROR",
+                        error="Conflicto de email/username al insertar",
+                    )
+                continue
+
+            for i, (new_id,), value in zip(chunk, inserted, values):
+                created_ids[i] = new_id
+                results[i] = ImportRowResult(
+                    row=i, username=valid[i].username, status="CREATED",
+                    id=new_id, parent_id=value["parent_id"],
+                )
+
+    db.commit()
+
+
+@router.post("/import", response_model=ImportReport)
+async def import_users_admin(
+    request: Request,
+    actor_id: int = Query(...),
+    format: Optional[Literal["csv", "ndjson"]] = Query(None, description="Si no se envía, se deduce del Content-Type"),
+    default_parent_id: Optional[int] = Query(None, description="Padre para filas sin parent_username/parent_id"),
+    db: Session = Depends(get_db),
+):
+    """
+    Alta masiva de usuarios (red de un DISTRIBUTOR) desde CSV o NDJSON.
+
+    Columnas: name, email, username, password, role, parent_username | parent_id,
+    full_name, cedula, telefono. parent_username puede apuntar a otra fila del archivo.
+    Devuelve un reporte por fila; las filas con error no bloquean a las demás.
+    La importación es atómica: todo lo creado se confirma en un solo commit al final
+    (un chunk que choca al insertar se descarta con su SAVEPOINT y se reporta como error).
+    """
+    # Autorización ANTES de leer el body: un no-admin no hace que el servidor reciba
+    # ni parsee el archivo. Content-Length excesivo -> 413 sin leer nada.
+    await run_in_threadpool(lambda: require_admin(get_actor(db, actor_id)))
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > IMPORT_MAX_BYTES:
+        raise HTTPException(413, f"Archivo demasiado grande (máximo {IMPORT_MAX_BYTES // (1024 * 1024)} MB)")
+
+    fmt = format
+    if fmt is None:
+        content_type = (request.headers.get("content-type") or "").lower()
+        fmt = "ndjson" if "json" in content_type else "csv"
+
+    raw_rows = await _read_import_rows(request, fmt)
+
+    results, valid, existing_parent, batch_parent = await run_in_threadpool(
+        _plan_import, db, raw_rows, default_parent_id
+    )
+
+    # bcrypt en paralelo (pool de procesos) solo para las filas que sí se van a insertar
+    order = sorted(valid)
+    hashed = await hash_passwords_bulk([valid[i].password for i in order])
+    hashes = dict(zip(order, hashed))
+
+    await run_in_threadpool(_insert_import, db, results, valid, hashes, existing_parent, batch_parent)
+
+    ordered = [results[i] for i in sorted(results)]
+    created = sum(1 for r in ordered if r.status == "CREATED")
+    return ImportReport(total=len(ordered), created=created, failed=len(ordered) - created, results=ordered)
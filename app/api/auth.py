@@ -1,15 +1,25 @@
 import os
+import math
+import random
+import threading
 from datetime import datetime, timedelta
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.concurrency import run_in_threadpool
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+from app.core.config import get_settings
 from app.core.database import get_db
+from app.core.cache import user_cache
+from app.core.hierarchy import link_new_users
+from app.core.ratelimit import client_ip as resolve_client_ip, login_throttle
+# Hashing en pool dedicado
+from app.core.security import verify_password_async, get_password_hash_async, hash_pool_stats
 from app import models
 
 router = APIRouter()
@@ -17,9 +27,12 @@ router = APIRouter()
 # --- CONFIGURACIÓN ---
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "M0t0St0r3_Pyth0n_2025_S3cur3_K3y_N3on")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 300 
+# Los guards por claims (require_roles / get_current_claims) validan rol e is_active
+# contra el snapshot cacheado del usuario (USER_CACHE_TTL_SECONDS), no contra el token:
+# un admin degradado o desactivado pierde el acceso aunque su token siga vigente.
+ACCESS_TOKEN_EXPIRE_MINUTES = get_settings().ACCESS_TOKEN_EXPIRE_MINUTES
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login/access-token")
 
 # --- MODELOS DE DATOS (Schemas) ---
@@ -48,6 +61,25 @@ class UserView(BaseModel):
     class Config:
         from_attributes = True
 
+# Snapshot del usuario autenticado que se guarda en caché (ver get_current_user).
+# Es una copia de solo lectura: para escribir sobre el usuario hay que cargarlo de la BD.
+class CurrentUser(BaseModel):
+    id: int
+    name: Optional[str] = None
+    email: Optional[str] = None
+    username: str
+    role: str
+    is_superuser: Optional[bool] = False
+    balance: Optional[float] = 0.0
+    is_active: Optional[bool] = True
+    parent_id: Optional[int] = None
+    full_name: Optional[str] = None
+    cedula: Optional[str] = None
+    telefono: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
 class LoginRequest(BaseModel):
     email: Optional[EmailStr] = None
     username: Optional[str] = None
@@ -58,33 +90,53 @@ class LoginResponse(BaseModel):
     token: str          
     token_type: str
     user: UserView
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None  # segundos de vida del access_token
 
-# --- FUNCIONES DE SEGURIDAD ---
-def verify_password(plain_password: str, hashed_or_plain: str) -> bool:
-    if not hashed_or_plain: return False
-    try: return pwd_context.verify(plain_password, hashed_or_plain)
-    except Exception: return plain_password == hashed_or_plain
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+# Actor autenticado: id del JWT + rol/username vigentes (snapshot cacheado del usuario)
+class TokenClaims(BaseModel):
+    id: int
+    username: str
+    role: str
 
+# --- FUNCIONES DE SEGURIDAD ---
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+def create_refresh_token(user_id: int) -> str:
+    return create_access_token(
+        {"id": user_id, "type": "refresh"},
+        expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Credenciales inválidas",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _decode_access_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("id")
-        username = payload.get("sub")
-        
+    except JWTError:
+        raise _credentials_exception()
+    # Un refresh token NO sirve para llamar a la API
+    if payload.get("type") == "refresh":
+        raise _credentials_exception()
+    return payload
+
+def _load_current_user(user_id: Optional[int], username: Optional[str], db: Session) -> CurrentUser:
+    # ⚡ Caché por user.id: en un hit no tocamos la BD (la sesión ni abre conexión)
+    current = user_cache.get(int(user_id)) if user_id else None
+
+    if current is None:
         user = None
         if user_id:
             user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -92,91 +144,241 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             user = db.query(models.User).filter(models.User.username == username).first()
 
         if user is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+            raise _credentials_exception()
 
-    if not getattr(user, "is_active", True):
+        current = CurrentUser.model_validate(user)
+        user_cache.set(current.id, current)
+
+    if not getattr(current, "is_active", True):
         raise HTTPException(status_code=400, detail="Usuario inactivo")
-    return user
+    return current
+
+def get_current_claims(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> TokenClaims:
+    """
+    Actor autenticado (id, username, rol) para endpoints que solo necesitan el rol/id.
+    El rol y el estado activo salen del snapshot cacheado del usuario (no del token):
+    en un hit de caché no se consulta la BD.
+    """
+    payload = _decode_access_token(token)
+    user_id = payload.get("id")
+    username = payload.get("sub")
+    if not user_id or not username:
+        raise _credentials_exception()
+    current = _load_current_user(user_id, username, db)
+    return TokenClaims(id=current.id, username=current.username, role=str(current.role or "").upper())
+
+def require_roles(*roles: str, detail: str = "Acceso denegado"):
+    """
+    Guard por rol a partir de los claims: Depends(require_roles("SUPERUSER", "ADMIN")).
+    Devuelve los TokenClaims del actor.
+    """
+    allowed = {r.upper() for r in roles}
+
+    def _guard(claims: TokenClaims = Depends(get_current_claims)) -> TokenClaims:
+        if claims.role not in allowed:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=detail)
+        return claims
+
+    return _guard
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> CurrentUser:
+    payload = _decode_access_token(token)
+    return _load_current_user(payload.get("id"), payload.get("sub"), db)
 
 # --- LÓGICA DE BÚSQUEDA ---
-def _find_user(email: Optional[str], username: Optional[str], password: str, db: Session) -> models.User:
+# Los endpoints de login/registro son async: la BD va al threadpool y bcrypt
+# al pool dedicado de app.core.security, así no bloqueamos el event loop.
+def _lookup_user(email: Optional[str], username: Optional[str], db: Session) -> models.User:
     user = None
     if username and "@" in username: email = username.lower()
     if email: user = db.query(models.User).filter(models.User.email == email).first()
     if not user and username: user = db.query(models.User).filter(models.User.username == username).first()
 
     if not user: raise HTTPException(status_code=401, detail="Usuario no encontrado")
-    
+    return user
+
+async def _throttle_call(fn, *args):
+    if login_throttle.store.blocking:
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
+
+async def _throttle_login(request: Request, identifier: Optional[str]) -> tuple[str, str]:
+    # 🛡️ Se corta ANTES de consultar la BD o gastar CPU en bcrypt
+    client_ip = resolve_client_ip(request.headers, request.client.host if request.client else None)
+    key = (identifier or "").strip().lower()
+    allowed, retry_after = await _throttle_call(login_throttle.hit, key, client_ip)
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Demasiados intentos de inicio de sesión. Intenta más tarde.",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+    return key, client_ip
+
+async def _login_succeeded(key: str, client_ip: str) -> None:
+    # Login correcto: se devuelven los tokens (solo los fallos gastan el bucket)
+    await _throttle_call(login_throttle.succeeded, key, client_ip)
+
+async def _find_user(email: Optional[str], username: Optional[str], password: str, db: Session) -> models.User:
+    user = await run_in_threadpool(_lookup_user, email, username, db)
+
     candidate = getattr(user, "hashed_password", "") or getattr(user, "password", "")
-    if not verify_password(password, candidate):
+    if not await verify_password_async(password, candidate):
         raise HTTPException(status_code=401, detail="Contraseña incorrecta")
     return user
 
 def _generate_response(user: models.User):
     token = create_access_token({"sub": user.username, "id": user.id, "role": user.role})
-    return LoginResponse(access_token=token, token=token, token_type="bearer", user=user)
+    return LoginResponse(
+        access_token=token,
+        token=token,
+        token_type="bearer",
+        user=user,
+        refresh_token=create_refresh_token(user.id),
+        expires_in=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    )
+
+# --- REGISTRO ---
+# El id del SUPERUSER raíz (padre de los registros públicos) se cachea por proceso:
+# así el camino caliente del registro es UN solo INSERT. La unicidad de email y
+# username la garantiza la BD (unique constraints), no un SELECT previo.
+_root_user_id: Optional[int] = None
+_root_user_lock = threading.Lock()
+REGISTER_MAX_ATTEMPTS = 5
+
+def invalidate_root_user_cache() -> None:
+    global _root_user_id
+    with _root_user_lock:
+        _root_user_id = None
+
+def _resolve_registration_parent(db: Session) -> tuple[str, bool, Optional[int]]:
+    """Devuelve (role, is_superuser, parent_id) para un registro público."""
+    global _root_user_id
+    if _root_user_id is not None:
+        return "CLIENT", False, _root_user_id
+
+    boss_id = (
+        db.query(models.User.id)
+        .filter(models.User.role == "SUPERUSER")
+        .order_by(models.User.id.asc())
+        .limit(1)
+        .scalar()
+    )
+    if boss_id is not None:
+        with _root_user_lock:
+            _root_user_id = boss_id
+        return "CLIENT", False, boss_id
+
+    # Bootstrap: sin SUPERUSER y sin ningún usuario -> el primero es el dueño.
+    # LIMIT 1 en vez de COUNT(*) sobre toda la tabla.
+    if db.query(models.User.id).limit(1).scalar() is None:
+        return "SUPERUSER", True, None
+    return "CLIENT", False, None
+
+def _violates_unique(error: str, column: str) -> bool:
+    # SQLite: "UNIQUE constraint failed: users.email"
+    # Postgres: 'unique constraint "ix_users_email" ... Key (email)=(...)'
+    return f"users.{column}" in error or f"users_{column}" in error or f"({column})=" in error
+
+def _insert_registered_user(cmd: RegisterCmd, hashed: str, db: Session) -> UserView:
+    global _root_user_id
+    username = cmd.username
+    for _ in range(REGISTER_MAX_ATTEMPTS):
+        # Lógica de Jerarquía (Padre/Hijo)
+        role, is_superuser, parent_id = _resolve_registration_parent(db)
+
+        # Crear Usuario
+        new_user = models.User(
+            name=cmd.name,
+            email=cmd.email,
+            username=username,
+            password=hashed,
+            hashed_password=hashed,
+            role=role,
+            is_superuser=is_superuser,
+            parent_id=parent_id,
+            balance=0.0,
+            is_active=True
+        )
+        db.add(new_user)
+        try:
+            # flush = INSERT ... RETURNING id; armamos la respuesta antes del commit
+            # para no necesitar un SELECT extra (refresh)
+            db.flush()
+            view = UserView.model_validate(new_user)
+            link_new_users(db, [new_user.id])
+            db.commit()
+        except IntegrityError as e:
+            db.rollback()
+            error = str(e.orig).lower()
+            if _violates_unique(error, "email"):
+                raise HTTPException(status_code=400, detail="El email ya está registrado")
+            if _violates_unique(error, "username"):
+                # Username ocupado: le agregamos un número random y reintentamos
+                username = f"{cmd.username}{random.randint(100, 999)}"
+                continue
+            if "parent" in error or "foreign" in error:
+                # El SUPERUSER cacheado ya no existe: lo volvemos a resolver
+                invalidate_root_user_cache()
+                continue
+            raise
+
+        if role == "SUPERUSER":
+            with _root_user_lock:
+                _root_user_id = view.id
+        return view
+
+    raise HTTPException(status_code=409, detail="No se pudo generar un username disponible, intenta con otro")
 
 # --- ENDPOINTS ---
 
 @router.post("/login/access-token", response_model=LoginResponse)
-def login_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = _find_user(email=None, username=form_data.username, password=form_data.password, db=db)
+async def login_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    throttle = await _throttle_login(request, form_data.username)
+    user = await _find_user(email=None, username=form_data.username, password=form_data.password, db=db)
+    await _login_succeeded(*throttle)
     return _generate_response(user)
 
 @router.post("/login", response_model=LoginResponse)
-def login_json(req: LoginRequest, db: Session = Depends(get_db)):
-    user = _find_user(req.email, req.username, req.password, db)
+async def login_json(request: Request, req: LoginRequest, db: Session = Depends(get_db)):
+    throttle = await _throttle_login(request, req.email or req.username)
+    user = await _find_user(req.email, req.username, req.password, db)
+    await _login_succeeded(*throttle)
+    return _generate_response(user)
+
+# 🔄 Renovar access token: relee el usuario para que el rol nuevo quede en los claims
+@router.post("/refresh", response_model=LoginResponse)
+def refresh_access_token(req: RefreshRequest, db: Session = Depends(get_db)):
+    try:
+        payload = jwt.decode(req.refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise _credentials_exception()
+    if payload.get("type") != "refresh" or not payload.get("id"):
+        raise _credentials_exception()
+
+    user = db.query(models.User).filter(models.User.id == payload["id"]).first()
+    if user is None:
+        raise _credentials_exception()
+    if not getattr(user, "is_active", True):
+        raise HTTPException(status_code=400, detail="Usuario inactivo")
     return _generate_response(user)
 
 # 🔥 REGISTRO BLINDADO (CORREGIDO) 🔥
 @router.post("/register", response_model=UserView)
-def register(cmd: RegisterCmd, db: Session = Depends(get_db)):
+async def register(cmd: RegisterCmd, db: Session = Depends(get_db)):
     
     # 🔥 CAMBIO 2: Generar username automático si no viene
     if not cmd.username:
         # Si el email es juan@gmail.com, el usuario será 'juan'
         cmd.username = cmd.email.split("@")[0]
 
-    # Validaciones
-    if db.query(models.User).filter(models.User.email == cmd.email).first():
-        raise HTTPException(status_code=400, detail="El email ya está registrado")
-    
-    # Verificar si el username existe, si existe le agregamos un número random
-    if db.query(models.User).filter(models.User.username == cmd.username).first():
-        import random
-        cmd.username = f"{cmd.username}{random.randint(100, 999)}"
-
-    hashed = get_password_hash(cmd.password)
-
-    # Lógica de Jerarquía (Padre/Hijo)
-    count = db.query(models.User).count()
-    if count == 0:
-        role = "SUPERUSER"
-        is_superuser = True
-        parent_id = None
-    else:
-        role = "CLIENT"
-        is_superuser = False
-        boss = db.query(models.User).filter(models.User.role == "SUPERUSER").first()
-        parent_id = boss.id if boss else None 
-
-    # Crear Usuario
-    new_user = models.User(
-        name=cmd.name,
-        email=cmd.email,
-        username=cmd.username,
-        password=hashed,
-        hashed_password=hashed,
-        role=role,
-        is_superuser=is_superuser,
-        parent_id=parent_id,
-        balance=0.0,
-        is_active=True
-    )
-    
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return new_user
\ No newline at end of file
+    hashed = await get_password_hash_async(cmd.password)
+
+    return await run_in_threadpool(_insert_registered_user, cmd, hashed, db)
+
+# 📊 Estado del pool de hashing (monitoreo, solo admin)
+@router.get("/hash-pool/stats")
+def get_hash_pool_stats(
+    current_user: TokenClaims = Depends(require_roles("SUPERUSER", "ADMIN")),
+):
+    return hash_pool_stats()
@@ -12,7 +12,7 @@ from pydantic import BaseModel, EmailStr
 
 from app.core.database import get_db
 from app import models
-from app.api.auth import get_current_user
+from app.api.auth import get_current_user, CurrentUser
 
 router = APIRouter()
 
@@ -43,7 +43,7 @@ def get_me(
         description="(Solo SUPERUSER) ID de usuario a consultar. Si no se envía, devuelve el usuario logueado.",
     ),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
     # ✅ CASO 1: Si no piden user_id, devolvemos el usuario logueado PERO ACTUALIZADO
     if user_id is None:
@@ -4,16 +4,27 @@
 # Regla clave:
 #   - Si el usuario NO tiene saldo suficiente -> 400 "Saldo insuficiente en la wallet"
 #   - Si tiene saldo suficiente -> se descuenta y se crea la orden
+#   - Todo en UNA transacción con descuento condicionado (ver app/core/ledger.py)
+#     Benchmark de concurrencia: python scripts/bench_checkout.py
 
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel, Field
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
+from app.core.ledger import post_entry
+from app.core.cache import invalidate_user
+from app.core.activity import SOURCE_ORDER, record_activity
+from app.core.pagination import keyset_page, MAX_PAGE_SIZE
+from app.core.outbox import enqueue_event, notify_outbox
+from app.core.idempotency import claim_idempotency_key, idempotency_key_header, store_idempotent_response
+from app.core.fulfillment import mark_order_fulfilled
 from app import models
+from app.api.auth import require_roles, TokenClaims
 
 router = APIRouter()
 
@@ -33,43 +44,66 @@ class OrderRead(BaseModel):
     status: str
     note: Optional[str]
     created_at: datetime
+    fulfilled_at: Optional[datetime] = None  # None mientras el fulfillment está pendiente
 
     class Config:
         from_attributes = True  # Pydantic v2
 
 
+class CartLine(BaseModel):
+    product_id: int
+    quantity: int = Field(1, gt=0, le=1000)
+
+
+class CartCheckout(BaseModel):
+    user_id: int = Field(..., description="ID del usuario que compra")
+    items: List[CartLine] = Field(..., min_length=1, max_length=100)
+    note: Optional[str] = Field(None, description="Nota opcional sobre la orden")
+
+
+class OrderItemRead(BaseModel):
+    id: int
+    product_id: Optional[int]
+    product_name: str
+    quantity: int
+    unit_price: float
+    unit_cost: float
+    line_total: float
+
+    class Config:
+        from_attributes = True
+
+
+class CheckoutRead(OrderRead):
+    cost_amount: float
+    items: List[OrderItemRead]
+
+
 # ----------------- Endpoints ----------------- #
 
 @router.post("", response_model=OrderRead)
-def create_order(order_in: OrderCreate, db: Session = Depends(get_db)):
+def create_order(
+    order_in: OrderCreate,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Depends(idempotency_key_header),
+):
     """
     Crea una orden de compra pagada con la wallet.
 
-    Lógica:
-      - Busca al usuario
-      - Si no existe -> 404
-      - Si balance < total_amount -> 400 "Saldo insuficiente en la wallet"
-      - Si balance >= total_amount:
-          - Descuenta el saldo
-          - Crea Order
-          - Registra WalletTransaction de tipo PURCHASE
+    Lógica (todo en UNA transacción):
+      - Idempotency-Key: un reintento con la misma llave devuelve la orden original
+      - Crea Order (flush para tener el id)
+      - Descuento condicionado vía ledger: si no existe el usuario -> 404,
+        si balance < total_amount -> 400 "Saldo insuficiente en la wallet"
+      - Registra WalletTransaction de tipo PURCHASE (+ filas del feed de actividad)
+      - Evento order.paid en el outbox (el fulfillment corre en segundo plano)
+      - Un solo commit
     """
-    user = db.query(models.User).filter(models.User.id == order_in.user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-
-    if user.balance is None:
-        user.balance = 0.0
+    replay, idem = claim_idempotency_key(db, idempotency_key, f"orders.create:{order_in.user_id}", order_in)
+    if replay is not None:
+        return replay
 
-    if user.balance < order_in.total_amount:
-        raise HTTPException(status_code=400, detail="Saldo insuficiente en la wallet")
-
-    # 1) Descontar saldo
-    user.balance -= order_in.total_amount
-    db.commit()
-    db.refresh(user)
-
-    # 2) Crear la orden
+    # 1) Crear la orden
     order = models.Order(
         user_id=order_in.user_id,
         total_amount=order_in.total_amount,
@@ -77,37 +111,185 @@ def create_order(order_in: OrderCreate, db: Session = Depends(get_db)):
         note=order_in.note,
     )
     db.add(order)
-    db.commit()
-    db.refresh(order)
+    db.flush()
+    record_activity(db, SOURCE_ORDER, order.id, order.user_id, "order", order.total_amount, order.note)
 
-    # 3) Registrar el movimiento en la wallet
-    tx = models.WalletTransaction(
-        user_id=order_in.user_id,
-        amount=-order_in.total_amount,  # negativo porque es salida
-        type="PURCHASE",
-        note=f"Compra (order #{order.id})",
+    # 2) Descontar saldo + registrar el movimiento (negativo porque es salida)
+    post_entry(
+        db, order_in.user_id, -order_in.total_amount, "PURCHASE", f"Compra (order #{order.id})",
+        commit=False, insufficient_detail="Saldo insuficiente en la wallet",
     )
-    db.add(tx)
+
+    # 3) Fulfillment en segundo plano (outbox, mismo commit que la orden)
+    enqueue_event(db, "order.paid", order.id, {
+        "user_id": order_in.user_id,
+        "total_amount": order_in.total_amount,
+        "items": [],
+    })
+
+    db.flush()
+    db.refresh(order)
+    body = store_idempotent_response(idem, OrderRead.model_validate(order))
     db.commit()
-    db.refresh(tx)
+    invalidate_user(order_in.user_id)
+    notify_outbox()
+    return body
 
-    return order
+
+@router.post("/checkout", response_model=CheckoutRead)
+def checkout_cart(
+    cart: CartCheckout,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Depends(idempotency_key_header),
+):
+    """
+    Checkout de carrito: varias líneas, UNA orden, UN descuento de la wallet.
+
+    Lógica (todo en UNA transacción):
+      - Precios y costos de todas las líneas en UNA consulta a products
+        (solo activos; si falta alguno -> 400 con los ids)
+      - Crea Order (total + cost_amount) y sus OrderItem con precio/costo copiados
+      - Descuento condicionado vía ledger (400 "Saldo insuficiente en la wallet")
+      - Evento order.paid en el outbox (el fulfillment corre en segundo plano)
+      - Un solo commit
+    """
+    replay, idem = claim_idempotency_key(db, idempotency_key, f"orders.checkout:{cart.user_id}", cart)
+    if replay is not None:
+        return replay
+
+    # Mismo producto en varias líneas -> una sola línea con la cantidad sumada
+    quantities: Dict[int, int] = {}
+    for line in cart.items:
+        quantities[line.product_id] = quantities.get(line.product_id, 0) + line.quantity
+
+    products = {
+        p.id: p
+        for p in db.query(models.Product.id, models.Product.name, models.Product.price, models.Product.cost)
+        .filter(models.Product.id.in_(quantities), models.Product.active == True)
+        .all()
+    }
+    missing = sorted(set(quantities) - set(products))
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Productos no disponibles: {missing}")
+
+    lines = []
+    total = cost = 0.0
+    for product_id, quantity in quantities.items():
+        product = products[product_id]
+        unit_cost = float(product.cost or 0.0)
+        line_total = round(float(product.price) * quantity, 2)
+        total += line_total
+        cost += unit_cost * quantity
+        lines.append(models.OrderItem(
+            product_id=product_id,
+            product_name=product.name,
+            quantity=quantity,
+            unit_price=float(product.price),
+            unit_cost=unit_cost,
+            line_total=line_total,
+        ))
+    total = round(total, 2)
+    if total <= 0:
+        raise HTTPException(status_code=400, detail="El total de la orden debe ser mayor a 0")
+
+    # 1) Orden + líneas
+    order = models.Order(
+        user_id=cart.user_id,
+        total_amount=total,
+        cost_amount=round(cost, 2),
+        status="PAID",
+        note=cart.note,
+    )
+    db.add(order)
+    db.flush()
+    record_activity(db, SOURCE_ORDER, order.id, order.user_id, "order", order.total_amount, order.note)
+    for item in lines:
+        item.order_id = order.id
+    db.add_all(lines)
+
+    # 2) Un solo descuento por el total del carrito
+    post_entry(
+        db, cart.user_id, -total, "PURCHASE", f"Compra (order #{order.id}, {len(lines)} productos)",
+        commit=False, insufficient_detail="Saldo insuficiente en la wallet",
+    )
+
+    # 3) Fulfillment en segundo plano (outbox, mismo commit que la orden)
+    enqueue_event(db, "order.paid", order.id, {
+        "user_id": cart.user_id,
+        "total_amount": total,
+        "items": [{"product_id": item.product_id, "quantity": item.quantity} for item in lines],
+    })
+
+    db.flush()
+    db.refresh(order)
+    body = store_idempotent_response(idem, CheckoutRead(
+        **OrderRead.model_validate(order).model_dump(),
+        cost_amount=order.cost_amount,
+        items=[OrderItemRead.model_validate(item) for item in lines],
+    ))
+    db.commit()
+    invalidate_user(cart.user_id)
+    notify_outbox()
+    return body
 
 
 @router.get("", response_model=List[OrderRead])
 def list_orders(
+    response: Response,
     user_id: Optional[int] = None,
+    status: Optional[str] = Query(None, description="PAID, completed, ..."),
+    date_from: Optional[datetime] = Query(None, description="created_at >= date_from"),
+    date_to: Optional[datetime] = Query(None, description="created_at < date_to"),
+    cursor: Optional[str] = Query(None, description="Valor del header X-Next-Cursor de la página anterior"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    include_total: bool = Query(False, description="Agrega X-Total-Count (hace un COUNT, úsalo solo si lo necesitas)"),
     db: Session = Depends(get_db),
 ):
     """
-    Lista órdenes.
-    - Si envías ?user_id=... filtra por usuario.
-    - Si no, devuelve todas.
+    Lista órdenes, más recientes primero, paginadas por cursor.
+    - Filtros opcionales: ?user_id=..., ?status=..., ?date_from=...&date_to=...
+    - Si hay más páginas el cursor siguiente viaja en el header X-Next-Cursor.
+    - ?include_total=true agrega X-Total-Count con el total de órdenes filtradas.
+    Índices: ix_orders_user_created_id / ix_orders_status_created_id.
     """
     query = db.query(models.Order)
     if user_id is not None:
         query = query.filter(models.Order.user_id == user_id)
+    if status:
+        query = query.filter(models.Order.status == status)
+    if date_from is not None:
+        query = query.filter(models.Order.created_at >= date_from)
+    if date_to is not None:
+        query = query.filter(models.Order.created_at < date_to)
+
+    if include_total:
+        total = query.with_entities(func.count(models.Order.id)).scalar() or 0
+        response.headers["X-Total-Count"] = str(total)
 
-    return query.order_by(models.Order.created_at.desc()).all()
+    orders, next_cursor = keyset_page(db, query, models.Order.created_at, models.Order.id, cursor, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return orders
 
 
+@router.post("/{order_id}/fulfill", response_model=OrderRead)
+def fulfill_order(
+    order_id: int,
+    db: Session = Depends(get_db),
+    current_user: TokenClaims = Depends(
+        require_roles("SUPERUSER", "ADMIN", detail="No tienes permisos para despachar órdenes.")
+    ),
+):
+    """
+    Marca una orden como entregada (despacho manual, sin webhook del proveedor).
+    404 si no existe, 409 si ya estaba marcada.
+    """
+    order = db.get(models.Order, order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Orden no encontrada")
+    if not mark_order_fulfilled(db, order_id):
+        db.rollback()
+        raise HTTPException(status_code=409, detail="La orden ya fue entregada")
+    db.commit()
+    db.refresh(order)
+    return order
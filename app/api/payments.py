@@ -1,15 +1,22 @@
 from datetime import datetime
-from typing import Optional, List
-import shutil
-import os
-
-from fastapi import APIRouter, Depends, HTTPException, Query, Form, File, UploadFile, status
-from pydantic import BaseModel
+from typing import Dict, Literal, Optional, List, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query, Form, File, UploadFile, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from sqlalchemy import update
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
+from app.core.ledger import post_entry, post_batch
+from app.core.cache import invalidate_user
+from app.core.activity import SOURCE_PAYMENT, record_activity, set_payment_activity_status
+from app.core.counters import bump_payment_status, payment_status_counts, rebuild_payment_counters
+from app.core.pagination import keyset_page, MAX_PAGE_SIZE
+from app.core.idempotency import claim_idempotency_key, idempotency_key_header, store_idempotent_response
+from app.core.uploads import store_upload
+from app.core.outbox import enqueue_event, notify_outbox
 from app import models
-from app.api.auth import get_current_user 
+from app.api.auth import get_current_user, get_current_claims, require_roles, CurrentUser, TokenClaims
 
 # 🟢 1. IMPORTAMOS LA TESORERÍA PARA CONOCER LAS TASAS DEL DÍA
 from app.api.exchange import get_dynamic_rates_dict
@@ -25,6 +32,8 @@ class PaymentReportRead(BaseModel):
     method: str
     status: str
     proof_url: Optional[str]
+    proof_review_url: Optional[str] = None  # copia comprimida (se genera en segundo plano)
+    proof_thumb_url: Optional[str] = None   # miniatura para el listado
     note: Optional[str]
     created_at: datetime
     approved_by: Optional[int]
@@ -35,6 +44,22 @@ class PaymentReportRead(BaseModel):
     class Config:
         from_attributes = True
 
+class BulkDecisionReq(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=500)
+    decision: Literal["APPROVE", "REJECT"]
+
+class BulkDecisionResult(BaseModel):
+    id: int
+    status: str                          # APPROVED / REJECTED / ALREADY_PROCESSED / NOT_FOUND
+    credited_usd: Optional[float] = None
+    detail: Optional[str] = None
+
+class BulkDecisionResponse(BaseModel):
+    decision: str
+    processed: int
+    skipped: int
+    results: List[BulkDecisionResult]
+
 # ----------------- Helpers internos ----------------- #
 
 def _load_report_or_404(db: Session, payment_id: int) -> models.PaymentReport:
@@ -48,103 +73,134 @@ def _load_report_or_404(db: Session, payment_id: int) -> models.PaymentReport:
     return report
 
 # 🟢 ESTA ES LA FUNCIÓN QUE MODIFICAMOS (La Calculadora)
-def _apply_wallet_deposit_from_report(db: Session, report: models.PaymentReport):
-    user = db.query(models.User).filter(models.User.id == report.user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-
-    # A. OBTENEMOS LAS TASAS ACTUALES
-    rates = get_dynamic_rates_dict()
-    
+def _convert_report_to_usd(report_id: int, amount: float, method: str, rates: Dict[str, float]) -> Tuple[float, str]:
+    """Devuelve (monto en USD, nota del historial) para un reporte."""
     # B. DETECTAMOS LA MONEDA (Asumimos que el 'method' es COP, CLP, PEN o USD)
     # Limpiamos el texto por si viene con espacios (ej: " COP ")
-    currency_code = report.method.upper().strip() 
+    currency_code = method.upper().strip() 
     
     # C. BUSCAMOS LA TASA (Si no existe, usamos 1.0)
     tasa = rates.get(currency_code, 1.0)
     
     # D. HACEMOS LA CONVERSIÓN (MATEMÁTICA PURA)
     # Si reportaron 100.000 COP y la tasa es 4.100 -> 100.000 / 4.100 = 24.39 USD
-    monto_final_usd = report.amount
+    monto_final_usd = amount
     
     if tasa > 1.0:
-        monto_final_usd = report.amount / tasa
+        monto_final_usd = amount / tasa
     
     # Redondeamos a 2 decimales (Dinero real)
     monto_final_usd = round(monto_final_usd, 2)
 
-    # E. CARGAMOS EL SALDO AL USUARIO
-    if user.balance is None:
-        user.balance = 0.0
-
-    user.balance += monto_final_usd
-    db.commit()
-    db.refresh(user)
-
-    # F. CREAMOS EL REGISTRO EN EL HISTORIAL (WALLET)
+    # E. NOTA DEL HISTORIAL (WALLET)
     # Nota inteligente: Guardamos la evidencia de la conversión
-    nota_transaccion = f"Recarga Aprobada (#{report.id})"
+    nota_transaccion = f"Recarga Aprobada (#{report_id})"
     if tasa > 1.0:
-        nota_transaccion += f" [{report.amount} {currency_code} @ {tasa} = {monto_final_usd} USD]"
+        nota_transaccion += f" [{amount} {currency_code} @ {tasa} = {monto_final_usd} USD]"
 
-    tx = models.WalletTransaction(
-        user_id=user.id,
-        amount=monto_final_usd, # <-- AQUÍ GUARDAMOS DÓLARES
-        type="DEPOSIT",
-        note=nota_transaccion,
+    return monto_final_usd, nota_transaccion
+
+# commit=False: el endpoint agrupa el cambio de estado del reporte y el depósito en un solo commit
+# rates: tasas ya cargadas (aprobación masiva: se leen UNA vez para todo el lote)
+def _apply_wallet_deposit_from_report(
+    db: Session, report: models.PaymentReport, commit: bool = True, rates: Optional[Dict[str, float]] = None
+):
+    # A. OBTENEMOS LAS TASAS ACTUALES
+    if rates is None:
+        rates = get_dynamic_rates_dict()
+
+    monto_final_usd, nota_transaccion = _convert_report_to_usd(report.id, report.amount, report.method, rates)
+
+    # F. CARGAMOS EL SALDO + HISTORIAL (en DÓLARES) vía ledger
+    post_entry(db, report.user_id, monto_final_usd, "DEPOSIT", nota_transaccion, commit=commit)
+
+# ----------------- Endpoints ----------------- #
+
+def _create_payment_report(
+    db: Session,
+    user_id: int,
+    method: str,
+    amount: float,
+    note: Optional[str],
+    proof_path: Optional[str],
+    proof_sha: Optional[str],
+    idempotency_key: Optional[str],
+):
+    replay, idem = claim_idempotency_key(db, idempotency_key, f"payments.report:{user_id}", {
+        "method": method,
+        "amount": amount,
+        "note": note,
+        "proof": proof_sha,
+    })
+    if replay is not None:
+        return replay
+
+    report = models.PaymentReport(
+        user_id=user_id,
+        amount=amount,
+        method=method, # Guardamos siempre en mayúsculas (COP, CLP...)
+        proof_url=proof_path,
+        note=note,
+        status="PENDING",
     )
-    db.add(tx)
+    db.add(report)
+    db.flush()
+    bump_payment_status(db, {"PENDING": 1})
+    record_activity(db, SOURCE_PAYMENT, report.id, user_id, "payment-pending", amount, note)
+
+    # Miniatura + copia comprimida en segundo plano (outbox, mismo commit que el reporte)
+    if proof_path:
+        enqueue_event(db, "payment.proof_uploaded", report.id, {"proof_url": proof_path})
+
+    db.refresh(report)
+    body = store_idempotent_response(idem, PaymentReportRead.model_validate(report))
     db.commit()
-    db.refresh(tx)
+    if proof_path:
+        notify_outbox()
+    return body
 
-# ----------------- Endpoints ----------------- #
 
 @router.post("", response_model=PaymentReportRead)
-def report_payment(
+async def report_payment(
     method: str = Form(..., description="Moneda de pago: COP, CLP, PEN, VES, USD"), # Exigimos el código de moneda
     amount: float = Form(...),
     note: Optional[str] = Form(None),
     proof_url: Optional[UploadFile] = File(None, alias="proof_url"),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user),
+    idempotency_key: Optional[str] = Depends(idempotency_key_header),
 ):
     """
     Crea un reporte de pago.
     IMPORTANTE: En 'method' el Frontend debe enviar la moneda (COP, CLP, PEN).
+    El comprobante se guarda por contenido (sha256): máximo UPLOAD_MAX_BYTES (413 si se pasa,
+    cortado por UploadSizeLimitMiddleware mientras llega el body)
+    y un mismo archivo re-enviado no se duplica en disco.
+    Con Idempotency-Key un reintento devuelve el reporte original (no duplica el reporte).
     """
-    user_id = current_user.id 
-    
-    # Manejo del Archivo
-    file_location = None
-    if proof_url:
-        os.makedirs("uploads", exist_ok=True)
-        filename = f"pay_{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{proof_url.filename}"
-        file_location = f"uploads/{filename}"
-        with open(file_location, "wb") as buffer:
-            shutil.copyfileobj(proof_url.file, buffer)
-
-    report = models.PaymentReport(
-        user_id=user_id,
-        amount=amount,
-        method=method.upper(), # Guardamos siempre en mayúsculas (COP, CLP...)
-        proof_url=file_location,
-        note=note,
-        status="PENDING",
+    # Manejo del Archivo (async, por chunks, fuera del threadpool mientras llega)
+    proof_path = proof_sha = None
+    if proof_url and proof_url.filename:
+        proof_path, proof_sha, _ = await store_upload(proof_url, "proofs")
+
+    return await run_in_threadpool(
+        _create_payment_report, db, current_user.id, method.upper(), amount, note,
+        proof_path, proof_sha, idempotency_key,
     )
-    db.add(report)
-    db.commit()
-    db.refresh(report)
-    return report
 
 
 @router.get("", response_model=List[PaymentReportRead])
 def list_all_reports(
+    response: Response,
     status: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="Valor del header X-Next-Cursor de la página anterior"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: TokenClaims = Depends(get_current_claims)
 ):
     """
-    Lista los reportes.
+    Lista los reportes (más recientes primero), paginados por cursor.
+    Si hay más páginas el cursor siguiente viaja en el header X-Next-Cursor.
     """
     query = db.query(models.PaymentReport)
 
@@ -153,8 +209,47 @@ def list_all_reports(
     
     if status:
         query = query.filter(models.PaymentReport.status == status.upper())
-        
-    return query.order_by(models.PaymentReport.created_at.desc()).all()
+
+    reports, next_cursor = keyset_page(
+        db, query, models.PaymentReport.created_at, models.PaymentReport.id, cursor, limit
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return reports
+
+
+def _stats_body(counts: Dict[str, int]) -> dict:
+    for key in ("PENDING", "APPROVED", "REJECTED"):
+        counts.setdefault(key, 0)
+    return {"counts": counts, "total": sum(counts.values())}
+
+
+@router.get("/stats")
+def payment_stats(
+    db: Session = Depends(get_db),
+    current_user: TokenClaims = Depends(
+        require_roles("SUPERUSER", "ADMIN", detail="No tienes permisos para ver estadísticas de pagos.")
+    )
+):
+    """
+    Conteo de reportes por estado (PENDING / APPROVED / REJECTED).
+    Sale de contadores mantenidos en cada cambio de estado: no escanea payment_reports.
+    """
+    return _stats_body(payment_status_counts(db))
+
+
+@router.post("/stats/rebuild")
+def rebuild_payment_stats(
+    db: Session = Depends(get_db),
+    current_user: TokenClaims = Depends(
+        require_roles("SUPERUSER", "ADMIN", detail="No tienes permisos para recalcular estadísticas de pagos.")
+    )
+):
+    """
+    Reparación: recalcula los contadores desde payment_reports (GROUP BY) y los reemplaza.
+    Bloquea los cambios de estado mientras recalcula (ver app/core/counters.py).
+    """
+    return _stats_body(rebuild_payment_counters(db))
 
 
 # 👇👇👇 ZONA DE SEGURIDAD (ADMIN ONLY) 👇👇👇
@@ -163,32 +258,39 @@ def list_all_reports(
 def approve_report(
     payment_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: TokenClaims = Depends(
+        require_roles("SUPERUSER", "ADMIN", detail="No tienes permisos para aprobar pagos.")
+    )
 ):
     """
     Aprueba un pago y carga saldo CONVERTIDO A DÓLARES.
     """
-    if current_user.role not in ["SUPERUSER", "ADMIN"]:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN, 
-            detail="No tienes permisos para aprobar pagos."
-        )
-
     report = _load_report_or_404(db, payment_id)
 
     if report.status != "PENDING":
         raise HTTPException(status_code=400, detail="Este pago ya fue procesado")
 
-    report.status = "APPROVED"
-    report.approved_at = datetime.utcnow()
-    report.approved_by = current_user.id
+    # Cambio de estado condicionado: si otro admin lo aprobó en paralelo no acreditamos dos veces
+    updated = (
+        db.query(models.PaymentReport)
+        .filter(models.PaymentReport.id == payment_id, models.PaymentReport.status == "PENDING")
+        .update(
+            {"status": "APPROVED", "approved_at": datetime.utcnow(), "approved_by": current_user.id},
+            synchronize_session=False,
+        )
+    )
+    if not updated:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Este pago ya fue procesado")
+    bump_payment_status(db, {"PENDING": -1, "APPROVED": 1})
+    set_payment_activity_status(db, [payment_id], "APPROVED")
 
+    # 🟢 AQUÍ OCURRE LA CONVERSIÓN Y DEPOSITO (mismo commit que el cambio de estado)
+    _apply_wallet_deposit_from_report(db, report, commit=False)
     db.commit()
+    invalidate_user(report.user_id)
     db.refresh(report)
 
-    # 🟢 AQUÍ OCURRE LA CONVERSIÓN Y DEPOSITO
-    _apply_wallet_deposit_from_report(db, report)
-
     return report
 
 
@@ -196,27 +298,108 @@ def approve_report(
 def reject_report(
     payment_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: TokenClaims = Depends(
+        require_roles("SUPERUSER", "ADMIN", detail="No tienes permisos para rechazar pagos.")
+    )
 ):
     """
     Rechaza un pago.
     """
-    if current_user.role not in ["SUPERUSER", "ADMIN"]:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN, 
-            detail="No tienes permisos para rechazar pagos."
-        )
-
     report = _load_report_or_404(db, payment_id)
 
     if report.status != "PENDING":
         raise HTTPException(status_code=400, detail="Este pago ya fue procesado")
 
-    report.status = "REJECTED"
-    report.rejected_at = datetime.utcnow()
-    report.rejected_by = current_user.id
+    # Cambio de estado condicionado (igual que approve): el contador no se descuadra
+    updated = (
+        db.query(models.PaymentReport)
+        .filter(models.PaymentReport.id == payment_id, models.PaymentReport.status == "PENDING")
+        .update(
+            {"status": "REJECTED", "rejected_at": datetime.utcnow(), "rejected_by": current_user.id},
+            synchronize_session=False,
+        )
+    )
+    if not updated:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Este pago ya fue procesado")
+    bump_payment_status(db, {"PENDING": -1, "REJECTED": 1})
+    set_payment_activity_status(db, [payment_id], "REJECTED")
 
     db.commit()
     db.refresh(report)
 
     return report
+
+
+@router.post("/bulk", response_model=BulkDecisionResponse)
+def bulk_decide_reports(
+    req: BulkDecisionReq,
+    db: Session = Depends(get_db),
+    current_user: TokenClaims = Depends(
+        require_roles("SUPERUSER", "ADMIN", detail="No tienes permisos para aprobar pagos.")
+    )
+):
+    """
+    Aprueba o rechaza muchos reportes de una vez (cierre del día bancario).
+
+    Lógica (todo en UNA transacción):
+      - UPDATE condicionado ... WHERE id IN (...) AND status = 'PENDING' RETURNING:
+        toma (y bloquea) solo los que siguen pendientes; los demás se reportan como omitidos
+      - Contadores por estado (/payments/stats) y feed de actividad en la misma transacción
+      - APPROVE: tasas leídas UNA vez, todos los depósitos en un solo UPDATE de saldos
+        + un INSERT multi-fila en el historial (ledger.post_batch)
+      - Un solo commit
+    """
+    ids = list(dict.fromkeys(req.ids))
+    now = datetime.utcnow()
+    report = models.PaymentReport
+
+    if req.decision == "APPROVE":
+        values = {"status": "APPROVED", "approved_at": now, "approved_by": current_user.id}
+    else:
+        values = {"status": "REJECTED", "rejected_at": now, "rejected_by": current_user.id}
+
+    claimed = db.execute(
+        update(report)
+        .where(report.id.in_(ids), report.status == "PENDING")
+        .values(**values)
+        .returning(report.id, report.user_id, report.amount, report.method)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    bump_payment_status(db, {"PENDING": -len(claimed), values["status"]: len(claimed)})
+    set_payment_activity_status(db, [row.id for row in claimed], values["status"])
+
+    results: Dict[int, BulkDecisionResult] = {}
+    if req.decision == "APPROVE" and claimed:
+        rates = get_dynamic_rates_dict()
+        entries = []
+        for row in claimed:
+            usd, note = _convert_report_to_usd(row.id, row.amount, row.method, rates)
+            entries.append((row.user_id, usd, note))
+            results[row.id] = BulkDecisionResult(id=row.id, status="APPROVED", credited_usd=usd)
+        post_batch(db, entries, "DEPOSIT", commit=False)
+    else:
+        for row in claimed:
+            results[row.id] = BulkDecisionResult(id=row.id, status=values["status"])
+
+    # Los que no se tomaron: ya procesados o inexistentes (una sola consulta)
+    missing = [i for i in ids if i not in results]
+    if missing:
+        current = dict(db.query(report.id, report.status).filter(report.id.in_(missing)).all())
+        for i in missing:
+            if i in current:
+                results[i] = BulkDecisionResult(id=i, status="ALREADY_PROCESSED", detail=f"Estado actual: {current[i]}")
+            else:
+                results[i] = BulkDecisionResult(id=i, status="NOT_FOUND", detail="Pago reportado no encontrado")
+
+    db.commit()
+    for user_id in {row.user_id for row in claimed}:
+        invalidate_user(user_id)
+
+    return BulkDecisionResponse(
+        decision=req.decision,
+        processed=len(claimed),
+        skipped=len(ids) - len(claimed),
+        results=[results[i] for i in ids],
+    )
@@ -31,6 +31,7 @@ class ProductBase(BaseModel):
     name: str
     description: Optional[str] = None
     price: float
+    cost: Optional[float] = None  # costo de compra (se copia a la orden al vender)
     active: bool = True
     category_id: Optional[int] = None  # id de la categoría
 
@@ -1,10 +1,17 @@
+from datetime import datetime
+from typing import Optional
+
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 from app.core.database import get_db
+from app.core.reconciliation import reconcile_ledger, idle_discrepancies
+from app.core.hierarchy import is_descendant, subtree_totals
+from app.core.activity import SOURCE_WALLET
+from app.core.search import activity_search_filter, highlight_matches
 from app import models
 # Importamos seguridad para proteger el reporte
-from app.api.auth import get_current_user
+from app.api.auth import get_current_claims, require_roles, TokenClaims
 
 router = APIRouter()
 
@@ -14,17 +21,13 @@ router = APIRouter()
 @router.get("/general")
 def get_general_report(
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: TokenClaims = Depends(require_roles("SUPERUSER", "ADMIN", detail="Acceso denegado."))
 ):
     """
     Data para el Dashboard Principal (Frontend).
     Retorna métricas de Ventas, Compras, Usuarios y Conversión.
     """
 
-    # 🔒 SEGURIDAD: Solo Admin/Superuser puede ver esto
-    if current_user.role not in ["SUPERUSER", "ADMIN"]:
-        raise HTTPException(status_code=403, detail="Acceso denegado.")
-
     try:
         # A. Ventas Totales (Suma de órdenes completadas/pagadas)
         total_sales = db.query(func.sum(models.Order.total_amount)) \
@@ -77,15 +80,12 @@ def get_general_report(
 @router.get("/utilities")
 def get_utilities_report(
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: TokenClaims = Depends(require_roles("SUPERUSER", "ADMIN", detail="Acceso denegado."))
 ):
     """
     Reporte Financiero de Wallet (Entradas vs Salidas).
     """
 
-    if current_user.role not in ["SUPERUSER", "ADMIN"]:
-        raise HTTPException(status_code=403, detail="Acceso denegado.")
-
     # 1. Total Dinero Entrado (DEPOSIT)
     total_in = db.query(func.sum(models.WalletTransaction.amount)) \
         .filter(models.WalletTransaction.type == "DEPOSIT").scalar() or 0.0
@@ -116,17 +116,15 @@ def get_movimientos_report(
     q: str | None = None,
     limit: int = 200,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: TokenClaims = Depends(require_roles("SUPERUSER", "ADMIN", detail="Acceso denegado."))
 ):
     """
-    Lista movimientos desde WalletTransaction.
+    Lista movimientos de la wallet (feed de actividad, origen "wallet").
+    q busca en tipo, nota y usuario (índice de texto); con q cada item trae "resaltado".
     Endpoint final:
       /api/v1/reports/movimiento?q=...&limit=200
     """
 
-    if current_user.role not in ["SUPERUSER", "ADMIN"]:
-        raise HTTPException(status_code=403, detail="Acceso denegado.")
-
     # límite seguro
     if limit < 1:
         limit = 1
@@ -134,57 +132,137 @@ def get_movimientos_report(
         limit = 500
 
     try:
-        query = db.query(models.WalletTransaction)
+        # Movimientos de wallet desde el feed de actividad (username ya copiado, sin JOIN)
+        feed = models.ActivityFeed
+        query = db.query(feed).filter(feed.source == SOURCE_WALLET)
 
-        # Filtro simple por tipo (DEPOSIT/WITHDRAW/etc)
+        # Búsqueda por tipo (DEPOSIT/WITHDRAW/etc), nota o usuario con índice de texto
+        q = (q or "").strip()
         if q:
-            w = f"%{q.strip()}%"
-            query = query.filter(models.WalletTransaction.type.ilike(w))
-
-        # Orden: más reciente primero
-        if hasattr(models.WalletTransaction, "created_at"):
-            query = query.order_by(models.WalletTransaction.created_at.desc())
-        else:
-            query = query.order_by(models.WalletTransaction.id.desc())
+            query = query.filter(activity_search_filter(db, q))
 
-        items = query.limit(limit).all()
+        # Orden: más reciente primero (índice created_at desc, id desc)
+        items = query.order_by(feed.created_at.desc(), feed.id.desc()).limit(limit).all()
 
         out = []
         for t in items:
-            # Fecha
-            if hasattr(t, "created_at") and t.created_at:
-                fecha = t.created_at.isoformat()
-            else:
-                fecha = ""
-
-            # Usuario (si existe relación user)
-            usuario = ""
-            if hasattr(t, "user") and t.user:
-                if hasattr(t.user, "username") and t.user.username:
-                    usuario = t.user.username
-                elif hasattr(t.user, "email") and t.user.email:
-                    usuario = t.user.email
-                else:
-                    usuario = str(getattr(t, "user_id", "")) or ""
-            else:
-                usuario = str(getattr(t, "user_id", "")) or ""
-
-            # Estado: si tu modelo no tiene status, ponemos OK
-            estado = "OK"
-            if hasattr(t, "status") and getattr(t, "status"):
-                estado = str(getattr(t, "status"))
-
-            out.append({
-                "id": getattr(t, "id", ""),
-                "fecha": fecha,
-                "tipo": str(getattr(t, "type", "")),
-                "usuario": usuario,
-                "monto": float(getattr(t, "amount", 0.0) or 0.0),
-                "estado": estado
-            })
+            item = {
+                "id": t.source_id,
+                "fecha": t.created_at.isoformat() if t.created_at else "",
+                "tipo": (t.type or "").upper(),
+                "usuario": t.username or str(t.user_id),
+                "monto": float(t.amount or 0.0),
+                "estado": "OK",
+                "nota": t.note or "",
+            }
+            if q:
+                item["resaltado"] = highlight_matches(
+                    {"tipo": item["tipo"], "nota": t.note, "usuario": t.username}, q
+                )
+            out.append(item)
 
         return {"items": out}
 
     except Exception as e:
         print(f"❌ Error en Reporte Movimientos: {e}")
         raise HTTPException(status_code=500, detail="Error generando reporte de movimientos.")
+
+
+# ==========================================
+# 4. CONCILIACIÓN DEL LEDGER (saldo vs historial)
+# ==========================================
+@router.post("/ledger/reconcile")
+def run_ledger_reconciliation(
+    include_idle: bool = False,
+    db: Session = Depends(get_db),
+    current_user: TokenClaims = Depends(require_roles("SUPERUSER", "ADMIN", detail="Acceso denegado."))
+):
+    """
+    Conciliación incremental (solo suma movimientos nuevos desde el último checkpoint).
+    include_idle=true también revisa usuarios sin actividad contra su checkpoint.
+    El job nocturno es scripts/reconcile_ledger.py.
+    """
+    result = reconcile_ledger(db)
+    if include_idle:
+        result["idle_discrepancies"] = idle_discrepancies(db)
+    return result
+
+
+# ==========================================
+# 5. RED DE UN USUARIO (totales del subárbol)
+# ==========================================
+@router.get("/network")
+def get_network_report(
+    user_id: Optional[int] = None,
+    include_self: bool = True,
+    db: Session = Depends(get_db),
+    current_user: TokenClaims = Depends(get_current_claims)
+):
+    """
+    Totales de la red (DISTRIBUTOR -> RESELLER -> TAQUILLA -> CLIENT) de un usuario:
+    saldo, usuarios por rol y ventas PAID. Sin user_id devuelve la red propia.
+    Un admin ve cualquier red; los demás solo la suya o la de alguien debajo de ellos.
+    Se resuelve con la closure table (user_closure), sin recorrer el árbol.
+    """
+    root_id = user_id if user_id is not None else current_user.id
+
+    if current_user.role not in ["SUPERUSER", "ADMIN"] and root_id != current_user.id:
+        if not is_descendant(db, current_user.id, root_id):
+            raise HTTPException(status_code=403, detail="Acceso denegado.")
+
+    if not db.get(models.User, root_id):
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+
+    return subtree_totals(db, root_id, include_self=include_self)
+
+
+# ==========================================
+# 6. VENTAS POR PRODUCTO (order_items)
+# ==========================================
+@router.get("/products/sales")
+def get_product_sales_report(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    limit: int = 50,
+    db: Session = Depends(get_db),
+    current_user: TokenClaims = Depends(require_roles("SUPERUSER", "ADMIN", detail="Acceso denegado."))
+):
+    """
+    Unidades, ventas, costo y utilidad por producto (órdenes PAID), de mayor a menor venta.
+    Usa los precios/costos copiados en order_items al momento de la compra.
+    """
+    limit = max(1, min(limit, 500))
+    item = models.OrderItem
+    sales = func.sum(item.line_total)
+    costs = func.sum(item.unit_cost * item.quantity)
+
+    query = (
+        db.query(
+            item.product_id,
+            func.max(item.product_name).label("product_name"),
+            func.sum(item.quantity).label("units"),
+            sales.label("sales"),
+            costs.label("cost"),
+        )
+        .join(models.Order, models.Order.id == item.order_id)
+        .filter(models.Order.status == "PAID")
+    )
+    if date_from is not None:
+        query = query.filter(models.Order.created_at >= date_from)
+    if date_to is not None:
+        query = query.filter(models.Order.created_at < date_to)
+
+    rows = query.group_by(item.product_id).order_by(sales.desc()).limit(limit).all()
+    return {
+        "items": [
+            {
+                "product_id": r.product_id,
+                "product_name": r.product_name,
+                "units": int(r.units or 0),
+                "sales": round(float(r.sales or 0.0), 2),
+                "cost": round(float(r.cost or 0.0), 2),
+                "profit": round(float((r.sales or 0.0) - (r.cost or 0.0)), 2),
+            }
+            for r in rows
+        ]
+    }
@@ -1,15 +1,22 @@
 # app/api/transactions.py (COMPLETO Y SEGURO)
 
+import csv
+import io
+import json
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, Iterator, List, Literal, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy.orm import Session, aliased
-from app.core.database import get_db
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.core.database import get_db, SessionLocal
+from app.core.pagination import keyset_page, MAX_PAGE_SIZE
+from app.core.search import activity_search_filter, highlight_matches
 from app import models
 # 👇 Importamos la seguridad estándar
-from app.api.auth import get_current_user 
+from app.api.auth import get_current_user, require_roles, CurrentUser, TokenClaims
 
 router = APIRouter()
 
@@ -25,6 +32,7 @@ class TransactionView(BaseModel):
     amount: float
     note: Optional[str] = None
     created_at: datetime
+    highlights: Optional[Dict[str, str]] = None  # solo con q: campo -> texto con <mark>...</mark>
 
     class Config:
         from_attributes = True
@@ -34,73 +42,100 @@ class TransactionView(BaseModel):
 # 2. HELPERS
 # ==========================================
 
-def _collect_transactions_for_user(db: Session, user: models.User) -> List[TransactionView]:
-    out: List[TransactionView] = []
-    
-    user_id = user.id
-    username = user.username
-
-    # ---- WALLET ----
-    wallet_tx = (
-        db.query(models.WalletTransaction)
-        .filter(models.WalletTransaction.user_id == user_id)
-        .all()
-    )
-
-    for tx in wallet_tx:
-        out.append(
-            TransactionView(
-                id=tx.id,
-                user_id=user_id,
-                username=username,
-                type=(tx.type or "").lower(),
-                amount=tx.amount,
-                note=tx.note,
-                created_at=tx.created_at or datetime.utcnow(),
-            )
-        )
-
-    # ---- ORDERS ----
-    orders = (
-        db.query(models.Order)
-        .filter(models.Order.user_id == user_id)
-        .all()
-    )
-
-    for o in orders:
-        out.append(
-            TransactionView(
-                id=o.id,
-                user_id=user_id,
-                username=username,
-                type="order",
-                amount=o.total_amount,
-                note=o.note,
-                created_at=o.created_at or datetime.utcnow(),
-            )
+# Se lee de activity_feed: wallet + órdenes + reportes de pago ya desnormalizados
+# (type final y username copiados al escribir, ver app/core/activity.py).
+# Una página es un rango sobre el índice (created_at desc, id desc), sin UNION ni JOIN.
+
+def transactions_page(
+    db: Session,
+    user_id: Optional[int],
+    q: Optional[str],
+    cursor: Optional[str],
+    limit: int,
+) -> Tuple[List[TransactionView], Optional[str]]:
+    feed = models.ActivityFeed
+    query = db.query(feed)
+    if user_id is not None:
+        query = query.filter(feed.user_id == user_id)
+
+    q = (q or "").strip()
+    if q:
+        # tipo / nota / username, sobre el índice de texto (app/core/search.py)
+        query = query.filter(activity_search_filter(db, q))
+
+    rows, next_cursor = keyset_page(db, query, feed.created_at, feed.id, cursor, limit)
+    out = [
+        TransactionView(
+            id=r.source_id,
+            user_id=r.user_id,
+            username=r.username,
+            type=r.type,
+            amount=r.amount,
+            note=r.note,
+            created_at=r.created_at or datetime.utcnow(),
+            highlights=highlight_matches({"type": r.type, "note": r.note, "username": r.username}, q) if q else None,
         )
-
-    # ---- PAYMENT REPORTS (Solicitudes de Recarga) ----
-    reports = (
-        db.query(models.PaymentReport)
-        .filter(models.PaymentReport.user_id == user_id)
-        .all()
+        for r in rows
+    ]
+    return out, next_cursor
+
+
+# Exportación: filas del feed en orden cronológico, leídas con cursor del servidor
+# (yield_per: Postgres entrega EXPORT_BATCH_SIZE filas por vez) y escritas al
+# cliente lote a lote. La memoria no depende de cuántas filas se exporten.
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ["id", "source", "user_id", "username", "type", "amount", "note", "created_at"]
+
+
+def _export_rows(
+    user_id: Optional[int],
+    source: Optional[str],
+    date_from: Optional[datetime],
+    date_to: Optional[datetime],
+) -> Iterator[List[dict]]:
+    feed = models.ActivityFeed
+    stmt = select(
+        feed.source_id.label("id"), feed.source, feed.user_id, feed.username,
+        feed.type, feed.amount, feed.note, feed.created_at,
     )
-
-    for r in reports:
-        out.append(
-            TransactionView(
-                id=r.id,
-                user_id=user_id,
-                username=username,
-                type=f"payment-{(r.status or '').lower()}", # payment-pending, payment-approved...
-                amount=r.amount,
-                note=r.note,
-                created_at=r.created_at or datetime.utcnow(),
-            )
-        )
-
-    return out
+    if user_id is not None:
+        stmt = stmt.where(feed.user_id == user_id)
+    if source:
+        stmt = stmt.where(feed.source == source)
+    if date_from:
+        stmt = stmt.where(feed.created_at >= date_from)
+    if date_to:
+        stmt = stmt.where(feed.created_at < date_to)
+    stmt = stmt.order_by(feed.created_at, feed.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    # Sesión propia: la respuesta se sigue escribiendo después de que termina el endpoint
+    db = SessionLocal()
+    try:
+        for batch in db.execute(stmt).mappings().partitions():
+            yield [
+                {**row, "created_at": row["created_at"].isoformat() if row["created_at"] else None}
+                for row in batch
+            ]
+    finally:
+        db.close()
+
+
+def _stream_csv(batches: Iterator[List[dict]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _stream_ndjson(batches: Iterator[List[dict]]) -> Iterator[str]:
+    for batch in batches:
+        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in batch)
 
 
 # ==========================================
@@ -109,57 +144,79 @@ def _collect_transactions_for_user(db: Session, user: models.User) -> List[Trans
 
 @router.get("", response_model=List[TransactionView])
 def get_my_transactions(
+    response: Response,
+    cursor: Optional[str] = Query(None, description="Valor del header X-Next-Cursor de la página anterior"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
     db: Session = Depends(get_db),
     # 🔒 OBTENEMOS EL USUARIO DESDE EL TOKEN (Seguro)
-    current_user: models.User = Depends(get_current_user) 
+    current_user: CurrentUser = Depends(get_current_user) 
 ):
     """
-    Devuelve TODOS los movimientos financieros del usuario LOGUEADO.
+    Devuelve los movimientos financieros del usuario LOGUEADO (más recientes primero).
     (Sustituye la funcionalidad insegura de consultar por user_id).
+    Paginado: si hay más, el cursor siguiente viaja en el header X-Next-Cursor.
     """
-    out = _collect_transactions_for_user(db, current_user)
-
-    # Ordenar descendente por fecha
-    out.sort(key=lambda x: x.created_at, reverse=True)
+    out, next_cursor = transactions_page(db, current_user.id, None, cursor, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return out
 
 
 @router.get("/all", response_model=List[TransactionView])
 def get_all_transactions(
+    response: Response,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user), # 🔒 Actor que consulta
-    q: Optional[str] = Query(None, description="Filtro de texto (tipo/nota)"),
+    # 🔒 Actor que consulta (solo SUPERUSER / ADMIN, validado por claims del token)
+    current_user: TokenClaims = Depends(
+        require_roles("SUPERUSER", "ADMIN", detail="No tienes permisos para ver transacciones globales")
+    ),
+    q: Optional[str] = Query(None, description="Filtro de texto (tipo/nota/username)"),
+    cursor: Optional[str] = Query(None, description="Valor del header X-Next-Cursor de la página anterior"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
 ):
     """
-    Transacciones de TODOS los usuarios.
+    Transacciones de TODOS los usuarios (wallet + órdenes + reportes de pago).
     Solo para SUPERUSER / ADMIN.
+    Lee la tabla activity_feed: una página es un rango por índice.
+    q busca en tipo/nota/username con índice de texto; cada fila trae "highlights".
+    Si hay más páginas el cursor siguiente viaja en el header X-Next-Cursor.
     """
-    # 🔒 VERIFICACIÓN DE ROL
-    if current_user.role not in {"SUPERUSER", "ADMIN"}:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="No tienes permisos para ver transacciones globales",
-        )
-
-    out: List[TransactionView] = []
-
-    # Juntamos de todos los usuarios
-    users = db.query(models.User).all()
-    for u in users:
-        out.extend(_collect_transactions_for_user(db, u))
-
-    # Filtro q simple
-    if q:
-        s = q.strip().lower()
-        out = [
-            tx
-            for tx in out
-            if s in tx.type.lower()
-            or (tx.note or "").lower().find(s) != -1
-            or (tx.username or "").lower().find(s) != -1 # Permitir buscar por username
-        ]
-
-    # Ordenar descendente por fecha
-    out.sort(key=lambda x: x.created_at, reverse=True)
+    out, next_cursor = transactions_page(db, None, q, cursor, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return out
 
+
+@router.get("/export")
+def export_transactions(
+    format: Literal["csv", "ndjson"] = Query("csv"),
+    user_id: Optional[int] = Query(None, description="Solo los movimientos de este usuario"),
+    source: Optional[Literal["wallet", "order", "payment"]] = Query(None, description="wallet / order / payment"),
+    date_from: Optional[datetime] = Query(None, description="created_at >= date_from"),
+    date_to: Optional[datetime] = Query(None, description="created_at < date_to"),
+    # 🔒 Solo SUPERUSER / ADMIN (contabilidad)
+    current_user: TokenClaims = Depends(
+        require_roles("SUPERUSER", "ADMIN", detail="No tienes permisos para exportar transacciones")
+    ),
+):
+    """
+    Exporta el historial completo (wallet + órdenes + reportes de pago) en CSV o NDJSON,
+    en orden cronológico. Se envía por partes (streaming): sirve para millones de filas
+    sin cargar todo en memoria.
+    Rango [date_from, date_to): igual que GET /orders, date_to=2026-10-01 corta justo antes
+    de la medianoche, así dos exportaciones mensuales seguidas no repiten filas.
+    """
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from debe ser anterior a date_to")
+
+    batches = _export_rows(user_id, source, date_from, date_to)
+    filename = f"transacciones_{datetime.utcnow():%Y%m%d_%H%M%S}.{'csv' if format == 'csv' else 'ndjson'}"
+    if format == "csv":
+        body, media_type = _stream_csv(batches), "text/csv; charset=utf-8"
+    else:
+        body, media_type = _stream_ndjson(batches), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -6,7 +6,10 @@ from pydantic import BaseModel, EmailStr
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
+from app.core.cache import invalidate_user
+from app.core.ledger import post_entry
 from app import models
+from app.api.auth import invalidate_root_user_cache
 
 # Intentamos importar el hasheador de contraseñas
 try:
@@ -67,14 +70,9 @@ def get_user(user_id: int, db: Session = Depends(get_db)):
 # CAJA RÁPIDA
 @router.post("/{user_id}/balance")
 def update_balance(user_id: int, data: BalanceUpdate, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-    
-    current = float(user.balance or 0)
-    user.balance = current + data.amount
-    db.commit()
-    return {"status": "ok", "new_balance": user.balance}
+    # Ajuste atómico vía ledger (queda registrado en el historial como ADJUSTMENT)
+    new_balance, _ = post_entry(db, user_id, data.amount, "ADJUSTMENT", "Ajuste manual de saldo (caja rápida)")
+    return {"status": "ok", "new_balance": new_balance}
 
 # 🔥 FIX DEFINITIVO: Quitamos response_model para que NO falle validando la respuesta
 @router.patch("/{user_id}") 
@@ -125,6 +123,9 @@ def patch_user(
         if val_cedula: user.cedula = str(val_cedula)
 
         db.commit()
+        invalidate_user(user.id)
+        if user_in.role:
+            invalidate_root_user_cache()
         
         # 🔥 RETORNAMOS UN JSON SIMPLE (Esto evita el crash 500)
         return {
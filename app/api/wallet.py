@@ -1,16 +1,22 @@
 # app/api/wallet.py
 
-from typing import Optional, List
+import hashlib
+from typing import Optional, List, Tuple
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
 from pydantic import BaseModel
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 
 from app.core.database import get_db
+from app.core.cache import invalidate_user
+from app.core.ledger import post_entry, post_batch
+from app.core.idempotency import claim_idempotency_key, idempotency_key_header, store_idempotent_response
+from app.core.pagination import keyset_page, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from app import models
 # 👇 Importamos seguridad para las funciones nuevas
-from app.api.auth import get_current_user 
+from app.api.auth import get_current_user, require_roles, CurrentUser, TokenClaims
 
 router = APIRouter()
 
@@ -35,12 +41,33 @@ class AddFundsResponse(BaseModel):
     balance: float
     currency: str
 
+class BatchCreditItem(BaseModel):
+    userId: int
+    amount: float
+    note: Optional[str] = None
+
+class BatchCreditReq(BaseModel):
+    credits: List[BatchCreditItem]
+
+class BatchCreditBalance(BaseModel):
+    userId: int
+    balance: float
+
+class BatchCreditResponse(BaseModel):
+    credited: int        # movimientos registrados
+    total: float         # suma acreditada
+    currency: str
+    balances: List[BatchCreditBalance]
+
+BATCH_CREDIT_MAX_ITEMS = 5000
+
 class WalletTransactionView(BaseModel):
     id: int
     amount: float
     type: str
     note: Optional[str]
     created_at: Optional[str] # String ISO
+    balance_after: Optional[float] = None  # Saldo corrido después del movimiento
 
     class Config:
         from_attributes = True
@@ -54,6 +81,7 @@ class MyWalletResponse(BaseModel):
     balance: float
     currency: str
     history: List[WalletTransactionView]
+    next_cursor: Optional[str] = None  # Para pedir la siguiente página (?cursor=...)
 
 # ==========================================
 # 2. HELPERS (Lógica interna MANTENIDA)
@@ -75,33 +103,87 @@ def balance_payload(user_id: int, balance: float) -> WalletBalance:
         currency=resolve_currency(user_id),
     )
 
-def register_transaction(
-    db: Session, user_id: int, amount: float, note: Optional[str], tx_type: str = "DEPOSIT"
-) -> models.WalletTransaction:
-    log = models.WalletTransaction(
-        user_id=user_id,
-        amount=amount,
-        type=tx_type,
-        note=note or "Transacción",
-    )
-    db.add(log)
-    db.commit()
-    db.refresh(log)
-    return log
-
-def apply_deposit(db: Session, user_id: int, amount: float, note: Optional[str]) -> models.User:
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=400, detail=f"Usuario no encontrado: {user_id}")
+def apply_deposit(db: Session, user_id: int, amount: float, note: Optional[str], commit: bool = True) -> float:
+    """Acredita saldo + historial en una sola transacción. Devuelve el saldo nuevo."""
+    new_balance, _ = post_entry(db, user_id, amount, "DEPOSIT", note, commit=commit)
+    return new_balance
 
-    if user.balance is None:
-        user.balance = 0.0
+def idempotent_deposit(
+    db: Session, idempotency_key: Optional[str], user_id: int, amount: float, note: Optional[str]
+):
+    """Recarga con Idempotency-Key: la llave y el movimiento se confirman en el mismo commit."""
+    replay, idem = claim_idempotency_key(
+        db, idempotency_key, f"wallet.add_funds:{user_id}", {"userId": user_id, "amount": amount, "note": note}
+    )
+    if replay is not None:
+        return replay
 
-    user.balance += float(amount)
+    new_balance = apply_deposit(db, user_id, amount, note, commit=False)
+    body = store_idempotent_response(idem, AddFundsResponse(
+        userId=user_id,
+        amount=amount,
+        balance=new_balance,
+        currency=resolve_currency(user_id),
+    ))
     db.commit()
-    db.refresh(user)
-    register_transaction(db, user_id, amount, note, "DEPOSIT")
-    return user
+    invalidate_user(user_id)
+    return body
+
+def wallet_history_page(db: Session, user_id: int, cursor: Optional[str], limit: int):
+    """Página del historial por cursor (usa ix_wallet_tx_user_created_id)."""
+    query = db.query(models.WalletTransaction).filter(models.WalletTransaction.user_id == user_id)
+    logs, next_cursor = keyset_page(
+        db, query, models.WalletTransaction.created_at, models.WalletTransaction.id, cursor, limit
+    )
+    history = [
+        WalletTransactionView(
+            id=t.id,
+            amount=t.amount,
+            type=t.type,
+            note=t.note,
+            created_at=t.created_at.isoformat() if t.created_at else None,
+            balance_after=t.balance_after,
+        )
+        for t in logs
+    ]
+    return history, next_cursor
+
+def wallet_version(db: Session, user_id: int) -> Tuple[float, int, int]:
+    """
+    (saldo, id del último movimiento, versión de ediciones) en una sola consulta indexada.
+    Si cualquiera cambia, cambió la wallet (la versión cubre movimientos editados en el
+    lugar, ej. un retiro aprobado: ni el saldo ni el último id cambian).
+    """
+    last_tx_id = (
+        select(func.max(models.WalletTransaction.id))
+        .where(models.WalletTransaction.user_id == models.User.id)
+        .scalar_subquery()
+    )
+    row = (
+        db.query(models.User.balance, last_tx_id, models.User.wallet_version)
+        .filter(models.User.id == user_id)
+        .first()
+    )
+    if not row:
+        return 0.0, 0, 0
+    return float(row[0] or 0.0), int(row[1] or 0), int(row[2] or 0)
+
+def wallet_etag(
+    user_id: int, balance: float, last_tx_id: int, version: int, cursor: Optional[str], limit: int
+) -> str:
+    # La página pedida (cursor/limit) también forma parte de la representación
+    raw = f"{user_id}|{last_tx_id}|{version}|{balance:.2f}|{cursor or ''}|{limit}"
+    return f'W/"{hashlib.sha1(raw.encode()).hexdigest()[:20]}"'
+
+def _weak(tag: str) -> str:
+    # Comparación débil: W/"x" y "x" son el mismo valor
+    return tag[2:] if tag.startswith("W/") else tag
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {_weak(tag.strip()) for tag in if_none_match.split(",")}
+    return "*" in candidates or _weak(etag) in candidates
 
 def resolve_user_or_superuser(user_id: Optional[int], db: Session) -> int:
     if user_id is not None:
@@ -117,62 +199,68 @@ def resolve_user_or_superuser(user_id: Optional[int], db: Session) -> int:
 
 @router.get("/me", response_model=MyWalletResponse)
 def get_my_wallet(
+    response: Response,
+    cursor: Optional[str] = Query(None, description="next_cursor de la página anterior"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Obtiene saldo e historial del usuario logueado (Seguro).
+    Historial paginado por cursor: 50 movimientos por defecto, sigue con ?cursor=next_cursor.
+
+    Responde con ETag (versión = saldo + último movimiento + ediciones). Si el frontend manda
+    If-None-Match con el mismo valor -> 304 sin cargar ni serializar el historial.
     """
-    logs = (
-        db.query(models.WalletTransaction)
-        .filter(models.WalletTransaction.user_id == current_user.id)
-        .order_by(models.WalletTransaction.created_at.desc())
-        .limit(50)
-        .all()
-    )
-    
-    # Convertir a View
-    history_view = []
-    for t in logs:
-        history_view.append(WalletTransactionView(
-            id=t.id, 
-            amount=t.amount, 
-            type=t.type, 
-            note=t.note, 
-            created_at=t.created_at.isoformat() if t.created_at else None
-        ))
+    # El saldo se lee de la BD: el current_user viene de la caché de auth
+    balance, last_tx_id, version = wallet_version(db, current_user.id)
+    etag = wallet_etag(current_user.id, balance, last_tx_id, version, cursor, limit)
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=cache_headers)
+
+    history_view, next_cursor = wallet_history_page(db, current_user.id, cursor, limit)
+    response.headers.update(cache_headers)
 
     return {
-        "balance": current_user.balance or 0.0,
+        "balance": balance,
         "currency": "USD",
-        "history": history_view
+        "history": history_view,
+        "next_cursor": next_cursor,
     }
 
 @router.post("/withdraw")
 def request_withdrawal(
     req: WithdrawRequest,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user),
+    idempotency_key: Optional[str] = Depends(idempotency_key_header),
 ):
     """
     Solicitar retiro de dinero (Resta del saldo).
+    Con Idempotency-Key un reintento devuelve la respuesta original sin descontar de nuevo.
     """
-    if (current_user.balance or 0.0) < req.amount:
-        raise HTTPException(status_code=400, detail="Saldo insuficiente")
-    
     if req.amount <= 0:
         raise HTTPException(status_code=400, detail="Monto inválido")
 
-    # 1. Descontar saldo
-    current_user.balance -= req.amount
-    
-    # 2. Registrar movimiento (Negativo)
-    register_transaction(db, current_user.id, -req.amount, f"Retiro a: {req.bank_info}", "WITHDRAW_REQUEST")
-    
-    return {
+    replay, idem = claim_idempotency_key(db, idempotency_key, f"wallet.withdraw:{current_user.id}", req)
+    if replay is not None:
+        return replay
+
+    # Descuento condicionado (saldo >= monto) + movimiento negativo, un solo commit
+    new_balance, _ = post_entry(
+        db, current_user.id, -req.amount, "WITHDRAW_REQUEST", f"Retiro a: {req.bank_info}",
+        commit=False, insufficient_detail="Saldo insuficiente",
+    )
+    body = store_idempotent_response(idem, {
         "message": "Retiro solicitado correctamente", 
-        "new_balance": current_user.balance
-    }
+        "new_balance": new_balance
+    })
+    db.commit()
+    invalidate_user(current_user.id)
+    return body
 
 # ==========================================
 # 4. ENDPOINTS ORIGINALES (Compatibilidad) ♻️
@@ -193,55 +281,73 @@ def balance_by_query(
     return balance_payload(effective_user_id, balance)
 
 @router.post("/add-funds", response_model=AddFundsResponse)
-def add_funds(req: AddFundsReq, db: Session = Depends(get_db)):
+def add_funds(
+    req: AddFundsReq,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Depends(idempotency_key_header),
+):
     if req.userId is None or req.amount is None:
         raise HTTPException(status_code=400, detail="userId y amount requeridos")
     if req.amount <= 0:
         raise HTTPException(status_code=400, detail="Monto debe ser positivo")
 
-    apply_deposit(db, req.userId, req.amount, req.note)
-    new_balance = find_balance(db, req.userId)
-
-    return AddFundsResponse(
-        userId=req.userId,
-        amount=req.amount,
-        balance=new_balance,
-        currency=resolve_currency(req.userId),
-    )
+    return idempotent_deposit(db, idempotency_key, req.userId, req.amount, req.note)
 
 @router.post("/{userId}/add-funds", response_model=AddFundsResponse)
-def add_funds_path(userId: int, req: AddFundsReq, db: Session = Depends(get_db)):
+def add_funds_path(
+    userId: int,
+    req: AddFundsReq,
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Depends(idempotency_key_header),
+):
     amount = req.amount or 0.0
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Monto debe ser positivo")
 
-    apply_deposit(db, userId, amount, req.note)
-    new_balance = find_balance(db, userId)
+    return idempotent_deposit(db, idempotency_key, userId, amount, req.note)
 
-    return AddFundsResponse(
-        userId=userId,
-        amount=amount,
-        balance=new_balance,
-        currency=resolve_currency(userId),
+@router.post("/add-funds/batch", response_model=BatchCreditResponse)
+def add_funds_batch(
+    req: BatchCreditReq,
+    db: Session = Depends(get_db),
+    current_user: TokenClaims = Depends(require_roles("SUPERUSER", "ADMIN", detail="No tienes permisos para acreditar en lote")),
+):
+    """
+    Acreditación masiva (promociones, comisiones): un solo UPDATE de saldos,
+    un INSERT multi-fila en el historial y un commit. Todo o nada.
+    """
+    if not req.credits:
+        raise HTTPException(status_code=400, detail="La lista de créditos está vacía")
+    if len(req.credits) > BATCH_CREDIT_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Máximo {BATCH_CREDIT_MAX_ITEMS} créditos por lote")
+    invalid = [c.userId for c in req.credits if c.amount is None or c.amount <= 0]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Monto debe ser positivo (userId: {invalid})")
+
+    balances = post_batch(db, [(c.userId, c.amount, c.note) for c in req.credits], "DEPOSIT")
+
+    return BatchCreditResponse(
+        credited=len(req.credits),
+        total=round(sum(c.amount for c in req.credits), 2),
+        currency="USD",
+        balances=[BatchCreditBalance(userId=uid, balance=bal) for uid, bal in balances.items()],
     )
 
 @router.get("/transactions/{userId}", response_model=List[WalletTransactionView])
-def get_transactions(userId: int, db: Session = Depends(get_db)):
-    logs = (
-        db.query(models.WalletTransaction)
-        .filter(models.WalletTransaction.user_id == userId)
-        .order_by(models.WalletTransaction.created_at.desc())
-        .all()
-    )
-    result = []
-    for t in logs:
-        result.append(WalletTransactionView(
-            id=t.id,
-            amount=t.amount,
-            type=t.type,
-            note=t.note,
-            created_at=t.created_at.isoformat() if t.created_at else None,
-        ))
+def get_transactions(
+    userId: int,
+    response: Response,
+    cursor: Optional[str] = Query(None, description="Valor del header X-Next-Cursor de la página anterior"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    """
+    Historial paginado por cursor. Se mantiene la respuesta como lista (compatibilidad);
+    si hay más páginas el cursor siguiente viaja en el header X-Next-Cursor.
+    """
+    result, next_cursor = wallet_history_page(db, userId, cursor, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return result
 
 
@@ -2,10 +2,14 @@ from typing import List, Optional
 from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
+from sqlalchemy import func, update
 from sqlalchemy.orm import Session
 from app.core.database import get_db
+from app.core.ledger import post_entry, touch_wallet
+from app.core.cache import invalidate_user
+from app.core.activity import set_wallet_activity
 from app import models
-from app.api.auth import get_current_user
+from app.api.auth import require_roles, TokenClaims
 
 router = APIRouter()
 
@@ -22,20 +26,44 @@ class WithdrawalRead(BaseModel):
     class Config:
         from_attributes = True
 
+# --- Helpers ---
+
+def _claim_withdrawal(db: Session, tx_id: int, new_type: str, suffix: str):
+    """
+    Cambio de estado condicionado (un solo UPDATE ... WHERE type='WITHDRAW_REQUEST' RETURNING):
+    si dos admins procesan la misma solicitud a la vez, solo uno la toma.
+    La fila del feed de actividad se actualiza en la misma transacción.
+    404 si no existe, 409 si ya fue procesada.
+    """
+    wt = models.WalletTransaction
+    row = db.execute(
+        update(wt)
+        .where(wt.id == tx_id, wt.type == "WITHDRAW_REQUEST")
+        .values(type=new_type, note=func.coalesce(wt.note, "") + suffix)
+        .returning(wt.id, wt.user_id, wt.amount, wt.type, wt.note)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        exists = db.query(wt.id).filter(wt.id == tx_id).first()
+        db.rollback()
+        if not exists:
+            raise HTTPException(status_code=404, detail="Solicitud no encontrada")
+        raise HTTPException(status_code=409, detail="La solicitud ya fue procesada")
+    set_wallet_activity(db, row.id, row.type, row.note)
+    touch_wallet(db, row.user_id)  # el historial cambió: nuevo ETag en /wallet/me
+    return row
+
 # --- Endpoints ---
 
 @router.get("/pending", response_model=List[WithdrawalRead])
 def get_pending_withdrawals(
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: TokenClaims = Depends(require_roles("SUPERUSER", "ADMIN"))
 ):
     """
     Lista todas las solicitudes de retiro pendientes (Type = WITHDRAW_REQUEST).
     Solo Admin/Superuser.
     """
-    if current_user.role not in ["SUPERUSER", "ADMIN"]:
-        raise HTTPException(status_code=403, detail="Acceso denegado")
-
     # Buscamos transacciones tipo "WITHDRAW_REQUEST"
     txs = (
         db.query(models.WalletTransaction, models.User.username)
@@ -63,25 +91,16 @@ def get_pending_withdrawals(
 def approve_withdrawal(
     tx_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: TokenClaims = Depends(require_roles("SUPERUSER", "ADMIN"))
 ):
     """
     Aprueba el retiro. 
     Cambia el tipo de transacción de 'WITHDRAW_REQUEST' a 'WITHDRAW' (Confirmado).
     El saldo ya se descontó al solicitar, así que solo confirmamos el estado.
     """
-    if current_user.role not in ["SUPERUSER", "ADMIN"]:
-        raise HTTPException(status_code=403, detail="Acceso denegado")
-
-    tx = db.query(models.WalletTransaction).filter(models.WalletTransaction.id == tx_id).first()
-    
-    if not tx or tx.type != "WITHDRAW_REQUEST":
-        raise HTTPException(status_code=404, detail="Solicitud no encontrada o ya procesada")
+    # Confirmamos el retiro (condicionado: 409 si ya se procesó)
+    _claim_withdrawal(db, tx_id, "WITHDRAW", f" (APROBADO por {current_user.username})")
 
-    # Confirmamos el retiro
-    tx.type = "WITHDRAW" 
-    tx.note = f"{tx.note} (APROBADO por {current_user.username})"
-    
     db.commit()
     return {"message": "Retiro marcado como pagado"}
 
@@ -89,40 +108,21 @@ def approve_withdrawal(
 def reject_withdrawal(
     tx_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_user: TokenClaims = Depends(require_roles("SUPERUSER", "ADMIN"))
 ):
     """
     Rechaza el retiro y DEVUELVE el dinero al usuario.
     """
-    if current_user.role not in ["SUPERUSER", "ADMIN"]:
-        raise HTTPException(status_code=403, detail="Acceso denegado")
-
-    tx = db.query(models.WalletTransaction).filter(models.WalletTransaction.id == tx_id).first()
-    
-    if not tx or tx.type != "WITHDRAW_REQUEST":
-        raise HTTPException(status_code=404, detail="Solicitud no encontrada o ya procesada")
+    # 1. Marcamos la original como rechazada ANTES de reembolsar (condicionado:
+    #    dos rechazos simultáneos no pueden devolver el dinero dos veces -> 409)
+    tx = _claim_withdrawal(db, tx_id, "WITHDRAW_REJECTED", f" (RECHAZADO por {current_user.username})")
 
-    # 1. Cambiamos estado a REJECTED (para historial) o lo borramos?
-    # Mejor: Creamos una contra-transacción de reembolso para que quede registro
+    # 2. Contra-transacción de reembolso para que quede registro
     amount_to_refund = abs(tx.amount)
-    user = db.query(models.User).filter(models.User.id == tx.user_id).first()
-    
-    if user:
-        user.balance += amount_to_refund
-    
-    # Marcamos la original como rechazada
-    tx.type = "WITHDRAW_REJECTED"
-    tx.note = f"{tx.note} (RECHAZADO por {current_user.username})"
 
-    # Creamos el registro del reembolso
-    refund_tx = models.WalletTransaction(
-        user_id=tx.user_id,
-        amount=amount_to_refund,
-        type="REFUND",
-        note=f"Reembolso de retiro #{tx.id}"
-    )
-    
-    db.add(refund_tx)
+    # Reembolso vía ledger (saldo + registro REFUND), mismo commit que el rechazo
+    post_entry(db, tx.user_id, amount_to_refund, "REFUND", f"Reembolso de retiro #{tx.id}", commit=False)
     db.commit()
+    invalidate_user(tx.user_id)
     
     return {"message": "Retiro rechazado y dinero devuelto al usuario"}
\ No newline at end of file
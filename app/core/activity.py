@@ -0,0 +1,180 @@
+# Feed de actividad (activity_feed): wallet + órdenes + reportes de pago en una tabla.
+#
+# Cada escritura agrega su fila del feed en la MISMA transacción:
+#   - ledger.post_entry / post_batch -> source="wallet"  (type = tipo del movimiento)
+#   - orders                         -> source="order"   (type = "order")
+#   - payments                       -> source="payment" (type = "payment-<estado>";
+#                                       aprobar/rechazar actualiza esa misma fila)
+#   - retiros (aprobar/rechazar)     -> cambian type/note del movimiento de wallet en
+#                                       el lugar: set_wallet_activity() actualiza su fila
+# El username se copia con INSERT ... SELECT desde users (sin consulta extra).
+# backfill_activity_feed() llena la tabla con lo que ya existía y repair_activity_feed()
+# corrige filas desfasadas de su origen (scripts/backfill_activity_feed.py).
+
+from typing import Iterable, List, Optional
+
+from sqlalchemy import String, bindparam, func, insert, literal, or_, select, union_all, update
+from sqlalchemy.orm import Session
+
+from app import models
+
+SOURCE_WALLET = "wallet"
+SOURCE_ORDER = "order"
+SOURCE_PAYMENT = "payment"
+
+_FEED_COLUMNS = ["source", "source_id", "user_id", "username", "type", "amount", "note"]
+
+
+def _insert_from_user():
+    # INSERT INTO activity_feed (...) SELECT :source, :source_id, users.id, users.username, ... WHERE users.id = :user_id
+    user = models.User
+    return insert(models.ActivityFeed.__table__).from_select(
+        _FEED_COLUMNS,
+        select(
+            bindparam("source", type_=String),
+            bindparam("source_id"),
+            user.id,
+            user.username,
+            bindparam("type", type_=String),
+            bindparam("amount"),
+            bindparam("note", type_=String),
+        ).where(user.id == bindparam("user_id")),
+    )
+
+
+def record_activity(
+    db: Session, source: str, source_id: int, user_id: int, type_: str, amount: float, note: Optional[str]
+) -> None:
+    record_activities(db, [{
+        "source": source, "source_id": source_id, "user_id": user_id,
+        "type": type_, "amount": amount, "note": note,
+    }])
+
+
+def record_activities(db: Session, rows: List[dict]) -> None:
+    """Varias filas del feed en un solo executemany (sin commit)."""
+    if rows:
+        db.execute(_insert_from_user(), [{**row, "type": (row["type"] or "").lower()} for row in rows])
+
+
+def set_payment_activity_status(db: Session, report_ids: Iterable[int], status: str) -> None:
+    ids = list(report_ids)
+    if not ids:
+        return
+    feed = models.ActivityFeed
+    db.execute(
+        update(feed)
+        .where(feed.source == SOURCE_PAYMENT, feed.source_id.in_(ids))
+        .values(type=f"payment-{status.lower()}")
+        .execution_options(synchronize_session=False)
+    )
+
+
+def set_wallet_activity(db: Session, tx_id: int, type_: str, note: Optional[str]) -> None:
+    """Un movimiento de wallet cambió de tipo/nota en el lugar (retiro aprobado/rechazado)."""
+    feed = models.ActivityFeed
+    db.execute(
+        update(feed)
+        .where(feed.source == SOURCE_WALLET, feed.source_id == tx_id)
+        .values(type=(type_ or "").lower(), note=note)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rename_activity_user(db: Session, user_id: int, username: str) -> None:
+    """El username está copiado en el feed: si cambia, se actualiza (cambio raro)."""
+    db.execute(
+        update(models.ActivityFeed)
+        .where(models.ActivityFeed.user_id == user_id)
+        .values(username=username)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# --- BACKFILL ---
+
+def _source_union():
+    wt, order, report = models.WalletTransaction, models.Order, models.PaymentReport
+
+    def branch(model, source, type_expr, amount_col):
+        return select(
+            literal(source, String).label("source"),
+            model.id.label("source_id"),
+            model.user_id.label("user_id"),
+            type_expr.label("type"),
+            amount_col.label("amount"),
+            model.note.label("note"),
+            model.created_at.label("created_at"),
+        )
+
+    return union_all(
+        branch(wt, SOURCE_WALLET, func.lower(func.coalesce(wt.type, "")), wt.amount),
+        branch(order, SOURCE_ORDER, literal("order", String), order.total_amount),
+        branch(report, SOURCE_PAYMENT, literal("payment-", String) + func.lower(func.coalesce(report.status, "")), report.amount),
+    ).subquery("src")
+
+
+def backfill_activity_feed(db: Session) -> int:
+    """
+    Agrega al feed los movimientos que aún no están (idempotente: se puede correr
+    varias veces). Un solo INSERT ... SELECT. Devuelve las filas agregadas.
+    """
+    src = _source_union()
+    feed = models.ActivityFeed
+    missing = (
+        select(
+            src.c.source, src.c.source_id, src.c.user_id, models.User.username,
+            src.c.type, src.c.amount, src.c.note, src.c.created_at,
+        )
+        .select_from(src)
+        .outerjoin(models.User, models.User.id == src.c.user_id)
+        .outerjoin(feed, (feed.source == src.c.source) & (feed.source_id == src.c.source_id))
+        .where(feed.id.is_(None))
+        .order_by(src.c.created_at, src.c.source, src.c.source_id)
+    )
+    result = db.execute(insert(feed.__table__).from_select(_FEED_COLUMNS + ["created_at"], missing))
+    db.commit()
+    return result.rowcount or 0
+
+
+def repair_activity_feed(db: Session) -> int:
+    """
+    Corrige filas del feed que ya no coinciden con su origen (type, note, amount o
+    username): p. ej. retiros procesados antes de que el feed se actualizara en el lugar.
+    Dos UPDATE ... FROM (origen y users). Devuelve las filas corregidas.
+    """
+    src = _source_union()
+    feed = models.ActivityFeed
+    fixed = db.execute(
+        update(feed)
+        .where(
+            feed.source == src.c.source,
+            feed.source_id == src.c.source_id,
+            or_(
+                feed.type.is_distinct_from(src.c.type),
+                feed.note.is_distinct_from(src.c.note),
+                feed.amount.is_distinct_from(src.c.amount),
+            ),
+        )
+        .values(type=src.c.type, note=src.c.note, amount=src.c.amount)
+        .execution_options(synchronize_session=False)
+    ).rowcount or 0
+    fixed += db.execute(
+        update(feed)
+        .where(feed.user_id == models.User.id, feed.username.is_distinct_from(models.User.username))
+        .values(username=models.User.username)
+        .execution_options(synchronize_session=False)
+    ).rowcount or 0
+    db.commit()
+    return fixed
+
+
+def ensure_activity_feed(db: Session) -> None:
+    """Arranque: feed nuevo (vacío) con movimientos existentes -> backfill."""
+    if db.query(models.ActivityFeed.id).limit(1).first() is not None:
+        return
+    for model in (models.WalletTransaction, models.Order, models.PaymentReport):
+        if db.query(model.id).limit(1).first() is not None:
+            rows = backfill_activity_feed(db)
+            print(f"✅ [DB] Feed de actividad (activity_feed) reconstruido: {rows} filas")
+            return
@@ -15,7 +15,92 @@ class Settings:
     # ---------------------------
     JWT_SECRET_KEY: str = os.getenv("JWT_SECRET_KEY") or os.getenv("SECRET_KEY") or "secret"
     ALGORITHM: str = os.getenv("ALGORITHM") or "HS256"
-    ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES") or "1440")
+    # Token de acceso corto: acota cuánto vive un rol/estado viejo en los claims del token
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES") or "30")
+
+    # ---------------------------
+    # CACHÉ DE USUARIOS (get_current_user)
+    # ---------------------------
+    # TTL corto: con varios workers de gunicorn cada proceso tiene su propia caché,
+    # así que un cambio hecho en otro worker tarda como máximo esto en verse.
+    USER_CACHE_TTL_SECONDS: int = int(os.getenv("USER_CACHE_TTL_SECONDS") or "30")
+    USER_CACHE_MAX_ENTRIES: int = int(os.getenv("USER_CACHE_MAX_ENTRIES") or "5000")
+
+    # ---------------------------
+    # POOL DE HASHING (bcrypt fuera del threadpool general)
+    # ---------------------------
+    # HASH_POOL_MODE: "thread" (bcrypt libera el GIL) o "process"
+    HASH_POOL_MODE: str = (os.getenv("HASH_POOL_MODE") or "thread").lower()
+    HASH_POOL_SIZE: int = int(os.getenv("HASH_POOL_SIZE") or str(min(4, os.cpu_count() or 1)))
+    # Máximo de hashes en vuelo (ejecutando + en cola). Por encima -> 503.
+    HASH_POOL_MAX_QUEUE: int = int(os.getenv("HASH_POOL_MAX_QUEUE") or "64")
+    # Importación masiva de usuarios: pool de PROCESOS aparte (no compite con el login).
+    # Es POR worker de gunicorn: por defecto las CPUs se reparten entre WEB_CONCURRENCY
+    # workers (el mismo env que usa gunicorn), y nunca más procesos que CPUs.
+    BULK_HASH_PROCESSES: int = max(1, min(
+        os.cpu_count() or 1,
+        int(os.getenv("BULK_HASH_PROCESSES")
+            or str((os.cpu_count() or 1) // max(1, int(os.getenv("WEB_CONCURRENCY") or "1")))),
+    ))
+
+    # ---------------------------
+    # LÍMITE DE INTENTOS DE LOGIN (token bucket)
+    # ---------------------------
+    # BACKEND: "memory" (por proceso) o "sqlite" (archivo local compartido por
+    # todos los workers de gunicorn en la misma máquina)
+    LOGIN_THROTTLE_BACKEND: str = (os.getenv("LOGIN_THROTTLE_BACKEND") or "memory").lower()
+    LOGIN_THROTTLE_SQLITE_PATH: str = os.getenv("LOGIN_THROTTLE_SQLITE_PATH") or "./login_throttle.db"
+    # Por usuario: ráfaga de 5 intentos, luego 1 cada 12s
+    LOGIN_THROTTLE_USER_BURST: int = int(os.getenv("LOGIN_THROTTLE_USER_BURST") or "5")
+    LOGIN_THROTTLE_USER_PER_MINUTE: float = float(os.getenv("LOGIN_THROTTLE_USER_PER_MINUTE") or "5")
+    # Por IP: ráfaga de 20 intentos, luego 1 cada 2s
+    LOGIN_THROTTLE_IP_BURST: int = int(os.getenv("LOGIN_THROTTLE_IP_BURST") or "20")
+    LOGIN_THROTTLE_IP_PER_MINUTE: float = float(os.getenv("LOGIN_THROTTLE_IP_PER_MINUTE") or "30")
+    # IP real del cliente. Por defecto la IP de la conexión (request.client.host): sin un
+    # proxy delante el cliente podría escribir el header y elegir su propio bucket.
+    # Detrás del proxy de Render se activa en el entorno: CLIENT_IP_HEADER=x-forwarded-for.
+    # TRUSTED_PROXY_HOPS: cuántos proxys confiables agregan entradas (se toma esa posición
+    # contando desde la DERECHA; la parte izquierda la puede inventar el cliente).
+    # TRUSTED_PROXIES: IPs/CIDRs separados por coma; si se define, el header solo se lee
+    # cuando la conexión viene de uno de ellos.
+    CLIENT_IP_HEADER: str = (os.getenv("CLIENT_IP_HEADER") or "").strip().lower()
+    TRUSTED_PROXY_HOPS: int = int(os.getenv("TRUSTED_PROXY_HOPS") or "1")
+    TRUSTED_PROXIES: str = os.getenv("TRUSTED_PROXIES") or ""
+
+    # ---------------------------
+    # IDEMPOTENCY-KEY (órdenes, retiros, recargas, reportes de pago)
+    # ---------------------------
+    # Tiempo que una respuesta guardada se puede re-servir ante un reintento
+    IDEMPOTENCY_TTL_HOURS: int = int(os.getenv("IDEMPOTENCY_TTL_HOURS") or "24")
+
+    # ---------------------------
+    # OUTBOX (fulfillment de órdenes en segundo plano)
+    # ---------------------------
+    OUTBOX_WORKER_ENABLED: bool = (os.getenv("OUTBOX_WORKER_ENABLED") or "true").lower() in ("1", "true", "yes")
+    OUTBOX_CONCURRENCY: int = int(os.getenv("OUTBOX_CONCURRENCY") or "8")          # eventos procesándose a la vez
+    OUTBOX_BATCH_SIZE: int = int(os.getenv("OUTBOX_BATCH_SIZE") or "50")
+    OUTBOX_POLL_SECONDS: float = float(os.getenv("OUTBOX_POLL_SECONDS") or "2")
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS") or "8")
+    OUTBOX_BACKOFF_SECONDS: float = float(os.getenv("OUTBOX_BACKOFF_SECONDS") or "5")  # 5s, 10s, 20s... (máx 1h)
+    OUTBOX_HANDLER_TIMEOUT_SECONDS: float = float(os.getenv("OUTBOX_HANDLER_TIMEOUT_SECONDS") or "60")
+    # Si un worker muere con eventos tomados, otro los re-toma al vencer este plazo
+    OUTBOX_LEASE_SECONDS: int = int(os.getenv("OUTBOX_LEASE_SECONDS") or "300")
+    # Despachador del proveedor (order.paid). Vacío = despacho manual (POST /orders/{id}/fulfill)
+    FULFILLMENT_WEBHOOK_URL: str = os.getenv("FULFILLMENT_WEBHOOK_URL") or ""
+    FULFILLMENT_WEBHOOK_TOKEN: str = os.getenv("FULFILLMENT_WEBHOOK_TOKEN") or ""
+    FULFILLMENT_WEBHOOK_TIMEOUT_SECONDS: float = float(os.getenv("FULFILLMENT_WEBHOOK_TIMEOUT_SECONDS") or "20")
+
+    # ---------------------------
+    # ARCHIVOS SUBIDOS (comprobantes de pago)
+    # ---------------------------
+    UPLOAD_DIR: str = os.getenv("UPLOAD_DIR") or "uploads"
+    UPLOAD_MAX_BYTES: int = int(os.getenv("UPLOAD_MAX_BYTES") or str(10 * 1024 * 1024))  # 10 MB
+    # Segundos sin recibir bytes del body antes de cortar la subida (408)
+    UPLOAD_IDLE_TIMEOUT_SECONDS: float = float(os.getenv("UPLOAD_IDLE_TIMEOUT_SECONDS") or "30")
+    # Copia comprimida (revisión) y miniatura de los comprobantes, en un pool de PROCESOS
+    IMAGE_PROCESSES: int = int(os.getenv("IMAGE_PROCESSES") or "2")
+    IMAGE_REVIEW_MAX_PX: int = int(os.getenv("IMAGE_REVIEW_MAX_PX") or "1600")
+    IMAGE_THUMB_MAX_PX: int = int(os.getenv("IMAGE_THUMB_MAX_PX") or "320")
 
     @property
     def DATABASE_URL(self) -> str:
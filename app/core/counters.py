@@ -0,0 +1,70 @@
+# Contadores por estado de payment_reports.
+#
+# En vez de COUNT(*) ... GROUP BY status en cada consulta del panel, cada cambio de
+# estado suma/resta en payment_status_counts DENTRO de la misma transacción:
+#   crear reporte      -> PENDING +1
+#   aprobar / rechazar -> PENDING -n, APPROVED|REJECTED +n
+# Upsert (INSERT ... ON CONFLICT DO UPDATE) en Postgres y SQLite.
+# rebuild_payment_counters() recalcula desde la tabla (arranque / reparación, por POST de admin).
+
+from typing import Dict
+
+from sqlalchemy import delete, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app import models
+
+
+def bump_payment_status(db: Session, deltas: Dict[str, int]) -> None:
+    """Aplica {estado: delta} a los contadores (sin commit: va en la transacción del endpoint)."""
+    deltas = {status: delta for status, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    table = models.PaymentStatusCount.__table__
+    insert = pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+    # Orden fijo de estados: dos transacciones no se bloquean en orden cruzado
+    for status in sorted(deltas):
+        stmt = insert(table).values(status=status, count=deltas[status])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.status],
+            set_={"count": table.c.count + stmt.excluded.count},
+        ))
+
+
+def payment_status_counts(db: Session) -> Dict[str, int]:
+    rows = db.query(models.PaymentStatusCount.status, models.PaymentStatusCount.count).all()
+    return {status: int(count) for status, count in rows}
+
+
+def rebuild_payment_counters(db: Session) -> Dict[str, int]:
+    """
+    Recalcula los contadores con un GROUP BY (una sola vez, no por consulta).
+    Ningún cambio de estado puede colarse entre el conteo y la escritura (se perdería su +1):
+      - Postgres: LOCK payment_reports IN SHARE MODE -> espera a las transacciones que ya
+        cambiaron reportes y bloquea las nuevas hasta el commit (las lecturas siguen).
+      - SQLite: el DELETE va primero y toma el lock de escritura de la BD.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE payment_reports IN SHARE MODE"))
+    db.execute(delete(models.PaymentStatusCount).execution_options(synchronize_session=False))
+    counts = dict(
+        db.query(models.PaymentReport.status, func.count(models.PaymentReport.id))
+        .group_by(models.PaymentReport.status)
+        .all()
+    )
+    if counts:
+        db.add_all(models.PaymentStatusCount(status=s, count=c) for s, c in counts.items() if s)
+    db.commit()
+    return payment_status_counts(db)
+
+
+def ensure_payment_counters(db: Session) -> None:
+    """Arranque: tabla de contadores nueva (vacía) con reportes existentes -> backfill."""
+    if db.query(models.PaymentStatusCount.status).limit(1).first() is not None:
+        return
+    if db.query(models.PaymentReport.id).limit(1).first() is None:
+        return
+    counts = rebuild_payment_counters(db)
+    print(f"✅ [DB] Contadores de pagos reconstruidos: {counts}")
@@ -1,6 +1,8 @@
 import logging
-from sqlalchemy import create_engine
+from sqlalchemy import DateTime, create_engine, inspect, text
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.sql import functions
 from app.core.config import get_settings
 
 settings = get_settings()
@@ -21,6 +23,20 @@ engine = create_engine(
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# --- FECHAS EN SQLITE (fallback local) ---
+# SQLite guarda las fechas como texto. SQLAlchemy escribe los datetime de Python como
+# 'YYYY-MM-DD HH:MM:SS.ffffff', pero CURRENT_TIMESTAMP (el now() por defecto) da
+# 'YYYY-MM-DD HH:MM:SS': con dos formatos el orden/comparación de texto falla y la
+# paginación keyset no puede usar la columna cruda (ni su índice). now() se compila al
+# mismo formato que SQLAlchemy (precisión de milisegundos, rellenado a 6 dígitos).
+SQLITE_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%f000"
+
+
+@compiles(functions.now, "sqlite")
+def _sqlite_now(element, compiler, **kw):
+    return f"strftime('{SQLITE_TIMESTAMP_FORMAT}', 'now')"
+
+
 Base = declarative_base()
 
 def get_db():
@@ -34,6 +50,87 @@ def get_db():
     finally:
         db.close()
 
+def begin_for_savepoints(db) -> None:
+    """
+    Antes de usar db.begin_nested() (SAVEPOINT) con un único commit al final.
+    pysqlite no emite BEGIN hasta el primer INSERT/UPDATE, y en SQLite un SAVEPOINT fuera
+    de una transacción ES la transacción: su RELEASE hace commit. Se abre explícitamente
+    para que los SAVEPOINT queden dentro y nada se confirme antes del commit final.
+    En Postgres la transacción ya está abierta (no hace nada).
+    """
+    if db.get_bind().dialect.name != "sqlite":
+        return
+    if not db.connection().connection.dbapi_connection.in_transaction:
+        db.execute(text("BEGIN"))
+
+def ensure_columns():
+    """
+    create_all() no altera tablas existentes. Agregamos las columnas NUEVAS que
+    sean nullable (sin default de servidor) con ALTER TABLE ... ADD COLUMN.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text(ddl))
+                print(f"✅ [DB] Columna agregada: {table.name}.{column.name}")
+            except Exception as e:
+                print(f"⚠️ [DB] No se pudo agregar {table.name}.{column.name}: {e}")
+
+def ensure_sqlite_timestamps():
+    """
+    SQLite: pasa al formato único las fechas guardadas con el formato viejo y, en tablas
+    creadas antes del cambio (DEFAULT CURRENT_TIMESTAMP, que SQLite no deja alterar),
+    agrega un trigger que normaliza cada fila nueva. En Postgres no hace nada.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            ddl = conn.execute(
+                text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": table.name},
+            ).scalar()
+            if not ddl:
+                continue
+            legacy_default = "CURRENT_TIMESTAMP" in ddl.upper()
+            for column in table.columns:
+                if not isinstance(column.type, DateTime):
+                    continue
+                col, fmt = column.name, SQLITE_TIMESTAMP_FORMAT
+                fixed = conn.execute(text(
+                    f"UPDATE {table.name} SET {col} = strftime('{fmt}', {col}) "
+                    f"WHERE length({col}) <> 26 AND strftime('{fmt}', {col}) IS NOT NULL"
+                )).rowcount
+                if fixed:
+                    print(f"✅ [DB] Fechas normalizadas: {table.name}.{col} ({fixed} filas)")
+                if legacy_default and column.server_default is not None:
+                    conn.execute(text(
+                        f"CREATE TRIGGER IF NOT EXISTS {table.name}_{col}_format AFTER INSERT ON {table.name} "
+                        f"WHEN length(new.{col}) <> 26 BEGIN "
+                        f"UPDATE {table.name} SET {col} = strftime('{fmt}', new.{col}) WHERE rowid = new.rowid; "
+                        f"END"
+                    ))
+
+def ensure_indexes():
+    """
+    create_all() solo crea índices junto con tablas NUEVAS.
+    Aquí creamos los índices que falten en tablas que ya existían (sin Alembic).
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                print(f"⚠️ [DB] No se pudo crear el índice {index.name}: {e}")
+
 def init_db():
     """
     Función de Inicialización:
@@ -50,6 +147,15 @@ def init_db():
 
     print("🔄 [DB] Conectando a Neon (Postgres) y verificando tablas...")
     Base.metadata.create_all(bind=engine)
+    ensure_columns()
+    ensure_sqlite_timestamps()
+    ensure_indexes()
+    # Índices de búsqueda de texto (pg_trgm en Postgres / FTS5 en SQLite)
+    from app.core.search import ensure_search_indexes
+    try:
+        ensure_search_indexes()
+    except Exception as e:
+        print(f"⚠️ [DB] No se pudieron crear los índices de búsqueda: {e}")
     print("✅ [DB] Estructura de tablas verificada/creada.")
 
     print("👤 [AUTH] Verificando Superusuario por defecto...")
@@ -64,4 +170,37 @@ def init_db():
     except Exception as e:
         print(f"⚠️ [ERROR] Al intentar crear superusuario: {e}")
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+    # Closure table de la jerarquía: backfill si hay usuarios sin registrar (tabla nueva)
+    from app.core.hierarchy import ensure_closure
+    db = SessionLocal()
+    try:
+        ensure_closure(db)
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ [DB] No se pudo verificar user_closure: {e}")
+    finally:
+        db.close()
+
+    # Contadores por estado de payment_reports (tabla nueva -> backfill)
+    from app.core.counters import ensure_payment_counters
+    db = SessionLocal()
+    try:
+        ensure_payment_counters(db)
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ [DB] No se pudo verificar payment_status_counts: {e}")
+    finally:
+        db.close()
+
+    # Feed de actividad (tabla nueva -> backfill; scripts/backfill_activity_feed.py para re-correrlo)
+    from app.core.activity import ensure_activity_feed
+    db = SessionLocal()
+    try:
+        ensure_activity_feed(db)
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ [DB] No se pudo verificar activity_feed: {e}")
+    finally:
+        db.close()
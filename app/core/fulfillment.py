@@ -0,0 +1,75 @@
+# Handlers del outbox para el fulfillment de órdenes.
+#
+# Corren en el worker del outbox, NUNCA dentro del request: si el proveedor está lento
+# o caído, el checkout no lo nota y el evento se reintenta con backoff.
+#
+# order.paid:
+#   - Con FULFILLMENT_WEBHOOK_URL: se envía la orden (id, usuario, ítems) al despachador
+#     del proveedor con "Idempotency-Key: order-<id>" (un reintento no despacha dos veces).
+#     Solo con respuesta 2xx se marca Order.fulfilled_at; error -> excepción -> reintento.
+#   - Sin webhook: no hay despacho automático. La orden queda con fulfilled_at vacío
+#     hasta que un admin la marque entregada (POST /orders/{id}/fulfill).
+
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.core.outbox import register_handler
+
+settings = get_settings()
+
+
+def mark_order_fulfilled(db: Session, order_id: int) -> bool:
+    """
+    Marca la orden como entregada (sin commit). Condicionado a fulfilled_at vacío:
+    devuelve False si ya estaba marcada o no existe.
+    """
+    result = db.execute(
+        update(models.Order)
+        .where(models.Order.id == order_id, models.Order.fulfilled_at.is_(None))
+        .values(fulfilled_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    return bool(result.rowcount)
+
+
+def _mark_fulfilled(order_id: int) -> None:
+    db = SessionLocal()
+    try:
+        mark_order_fulfilled(db, order_id)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def fulfill_paid_order(payload: Dict[str, Any]) -> None:
+    url = settings.FULFILLMENT_WEBHOOK_URL
+    if not url:
+        return  # despacho manual (ver encabezado)
+
+    order_id = payload["aggregate_id"]
+    headers = {"Idempotency-Key": f"order-{order_id}"}
+    if settings.FULFILLMENT_WEBHOOK_TOKEN:
+        headers["Authorization"] = f"Bearer {settings.FULFILLMENT_WEBHOOK_TOKEN}"
+
+    async with httpx.AsyncClient(timeout=settings.FULFILLMENT_WEBHOOK_TIMEOUT_SECONDS) as client:
+        response = await client.post(url, headers=headers, json={
+            "order_id": order_id,
+            "user_id": payload.get("user_id"),
+            "total_amount": payload.get("total_amount"),
+            "items": payload.get("items", []),
+        })
+        response.raise_for_status()  # no 2xx -> el outbox reintenta
+
+    await run_in_threadpool(_mark_fulfilled, order_id)
+
+
+def register_handlers() -> None:
+    register_handler("order.paid", fulfill_paid_order)
@@ -0,0 +1,153 @@
+# Closure table de la jerarquía DISTRIBUTOR -> RESELLER -> TAQUILLA -> CLIENT.
+#
+# user_closure guarda TODOS los pares (ancestro, descendiente, profundidad):
+#   - alta:        link_new_users()  -> fila propia + ancestros del padre (INSERT ... SELECT)
+#   - re-parent:   move_subtree()    -> corta el subárbol de sus ancestros viejos y lo
+#                                       cuelga de los nuevos (2 sentencias, sin recorrer)
+#   - baja:        unlink_user()
+#   - backfill:    rebuild_closure() -> WITH RECURSIVE sobre users.parent_id
+# Todas las funciones escriben SIN commit: van en la transacción del endpoint.
+
+from typing import Dict, Iterable, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, delete, func, insert, select, text, true
+from sqlalchemy.orm import Session, aliased
+
+from app import models
+
+MAX_TREE_DEPTH = 64  # corta ciclos accidentales en parent_id durante el backfill
+
+
+def link_new_users(db: Session, user_ids: Iterable[int]) -> None:
+    """Agrega a la closure usuarios recién insertados (su parent_id ya debe estar en la tabla)."""
+    ids = list(user_ids)
+    if not ids:
+        return
+    closure = models.UserClosure
+    db.execute(insert(closure), [{"ancestor_id": i, "descendant_id": i, "depth": 0} for i in ids])
+    db.execute(
+        insert(closure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(closure.ancestor_id, models.User.id, closure.depth + 1)
+            .join(closure, closure.descendant_id == models.User.parent_id)
+            .where(models.User.id.in_(ids)),
+        )
+    )
+
+
+def is_descendant(db: Session, ancestor_id: int, user_id: int) -> bool:
+    closure = models.UserClosure
+    return db.query(closure.depth).filter(
+        closure.ancestor_id == ancestor_id, closure.descendant_id == user_id
+    ).first() is not None
+
+
+def move_subtree(db: Session, user_id: int, new_parent_id: Optional[int]) -> None:
+    """Re-parent: el usuario y toda su red pasan a colgar de new_parent_id."""
+    closure = models.UserClosure
+    if new_parent_id is not None and is_descendant(db, user_id, new_parent_id):
+        raise HTTPException(400, "El nuevo padre no puede estar dentro de la red del usuario")
+
+    subtree = select(closure.descendant_id).where(closure.ancestor_id == user_id)
+
+    # 1. Cortar los vínculos con los ancestros viejos (los internos del subárbol se quedan)
+    db.execute(
+        delete(closure)
+        .where(closure.descendant_id.in_(subtree))
+        .where(closure.ancestor_id.not_in(subtree))
+        .execution_options(synchronize_session=False)
+    )
+    if new_parent_id is None:
+        return
+
+    # 2. Producto cartesiano: ancestros del nuevo padre x nodos del subárbol
+    above = aliased(closure)
+    below = aliased(closure)
+    db.execute(
+        insert(closure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+            .select_from(above)
+            .join(below, true())
+            .where(above.descendant_id == new_parent_id, below.ancestor_id == user_id),
+        )
+    )
+
+
+def unlink_user(db: Session, user_id: int) -> None:
+    closure = models.UserClosure
+    db.execute(
+        delete(closure)
+        .where((closure.ancestor_id == user_id) | (closure.descendant_id == user_id))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def rebuild_closure(db: Session) -> int:
+    """Reconstruye toda la tabla desde users.parent_id. Devuelve el número de filas."""
+    db.execute(delete(models.UserClosure).execution_options(synchronize_session=False))
+    db.execute(text(
+        """
+        INSERT INTO user_closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM users
+            UNION ALL
+            SELECT t.ancestor_id, u.id, t.depth + 1
+            FROM tree t JOIN users u ON u.parent_id = t.descendant_id
+            WHERE t.depth < :max_depth
+        )
+        SELECT ancestor_id, descendant_id, MIN(depth) FROM tree
+        GROUP BY ancestor_id, descendant_id
+        """
+    ), {"max_depth": MAX_TREE_DEPTH})
+    db.commit()
+    return db.query(func.count()).select_from(models.UserClosure).scalar() or 0
+
+
+def ensure_closure(db: Session) -> None:
+    """Arranque: si hay usuarios sin fila propia en la closure (tabla nueva), backfill."""
+    closure = models.UserClosure
+    missing = (
+        db.query(models.User.id)
+        .outerjoin(closure, and_(closure.ancestor_id == models.User.id, closure.descendant_id == models.User.id))
+        .filter(closure.ancestor_id.is_(None))
+        .limit(1)
+        .first()
+    )
+    if missing is not None:
+        rows = rebuild_closure(db)
+        print(f"✅ [DB] Jerarquía (user_closure) reconstruida: {rows} filas")
+
+
+def subtree_totals(db: Session, root_id: int, include_self: bool = True) -> Dict:
+    """Saldo, usuarios (por rol) y ventas de toda la red de root_id en consultas indexadas."""
+    closure = models.UserClosure
+    members = [closure.ancestor_id == root_id]
+    if not include_self:
+        members.append(closure.depth > 0)
+
+    by_role = (
+        db.query(models.User.role, func.count(models.User.id), func.coalesce(func.sum(models.User.balance), 0.0))
+        .join(closure, closure.descendant_id == models.User.id)
+        .filter(*members)
+        .group_by(models.User.role)
+        .all()
+    )
+    sales_count, sales_total = (
+        db.query(func.count(models.Order.id), func.coalesce(func.sum(models.Order.total_amount), 0.0))
+        .join(closure, closure.descendant_id == models.Order.user_id)
+        .filter(*members, models.Order.status == "PAID")
+        .one()
+    )
+    max_depth = db.query(func.max(closure.depth)).filter(closure.ancestor_id == root_id).scalar() or 0
+
+    return {
+        "user_id": root_id,
+        "users": sum(count for _, count, _ in by_role),
+        "balance": round(float(sum(total for _, _, total in by_role)), 2),
+        "users_by_role": {role: count for role, count, _ in by_role},
+        "orders": int(sales_count or 0),
+        "sales": round(float(sales_total or 0.0), 2),
+        "depth": int(max_depth),
+    }
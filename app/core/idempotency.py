@@ -0,0 +1,123 @@
+# Idempotency-Key para los endpoints que mueven dinero.
+#
+# Flujo (todo dentro de la MISMA transacción que la escritura):
+#   1. claim_idempotency_key(): si la llave ya tiene respuesta guardada -> se re-sirve
+#      tal cual (sin tocar saldos). Si no, se inserta la fila de la llave (flush).
+#   2. El endpoint hace su trabajo con commit=False.
+#   3. store_idempotent_response() guarda el cuerpo y el endpoint hace UN commit.
+#
+# Dos reintentos simultáneos con la misma llave chocan en el índice único
+# (scope, key): el segundo espera al primero, recibe IntegrityError, hace rollback
+# y responde con lo que guardó el primero. Si la escritura falla (400, 404...)
+# el rollback se lleva también la llave y el cliente puede reintentar.
+
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional, Tuple
+
+from fastapi import Header, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core.config import get_settings
+
+settings = get_settings()
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+
+def idempotency_key_header(
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+) -> Optional[str]:
+    """Dependency: lee y valida el header Idempotency-Key (opcional)."""
+    if idempotency_key is None:
+        return None
+    idempotency_key = idempotency_key.strip()
+    if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} inválida (1-{MAX_KEY_LENGTH} caracteres)")
+    return idempotency_key
+
+
+def request_fingerprint(payload: Any) -> str:
+    raw = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _find(db: Session, scope: str, key: str) -> Optional[models.IdempotencyKey]:
+    return (
+        db.query(models.IdempotencyKey)
+        .filter(models.IdempotencyKey.scope == scope, models.IdempotencyKey.key == key)
+        .first()
+    )
+
+
+def _expired(record: models.IdempotencyKey) -> bool:
+    created = record.created_at
+    if created is None:
+        return False
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return created < datetime.now(timezone.utc) - timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS)
+
+
+def _replay(record: Optional[models.IdempotencyKey], fingerprint: str) -> JSONResponse:
+    if record is None or record.response_body is None:
+        # La primera petición sigue en curso (o falló y se deshizo): que reintente
+        raise HTTPException(
+            status_code=409,
+            detail="Hay una petición en curso con esta Idempotency-Key",
+            headers={"Retry-After": "1"},
+        )
+    if record.request_hash != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key ya usada con otros datos")
+    return JSONResponse(
+        content=json.loads(record.response_body),
+        status_code=record.status_code or 200,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+def claim_idempotency_key(
+    db: Session, key: Optional[str], scope: str, payload: Any
+) -> Tuple[Optional[JSONResponse], Optional[models.IdempotencyKey]]:
+    """
+    Devuelve (respuesta_guardada, None) si es un reintento,
+    o (None, registro) si es la primera vez (el registro queda en la transacción abierta).
+    Sin llave devuelve (None, None) y el endpoint funciona como siempre.
+    """
+    if not key:
+        return None, None
+    fingerprint = request_fingerprint(payload)
+
+    existing = _find(db, scope, key)
+    if existing is not None:
+        if not _expired(existing):
+            return _replay(existing, fingerprint), None
+        db.delete(existing)
+        db.flush()
+
+    record = models.IdempotencyKey(scope=scope, key=key, request_hash=fingerprint)
+    db.add(record)
+    try:
+        db.flush()
+    except IntegrityError:
+        # Otro reintento ganó la carrera y ya confirmó su respuesta
+        db.rollback()
+        return _replay(_find(db, scope, key), fingerprint), None
+    return None, record
+
+
+def store_idempotent_response(
+    record: Optional[models.IdempotencyKey], body: Any, status_code: int = 200
+) -> Any:
+    """Guarda la respuesta en el registro de la llave (el commit lo hace el endpoint)."""
+    encoded = jsonable_encoder(body)
+    if record is not None:
+        record.status_code = status_code
+        record.response_body = json.dumps(encoded)
+    return encoded
@@ -0,0 +1,120 @@
+# Copia comprimida + miniatura de los comprobantes de pago.
+#
+# Corre como handler del outbox (payment.proof_uploaded), nunca dentro del request.
+# El trabajo de imagen es CPU puro: va a un pool de PROCESOS propio para no
+# competir con el event loop ni con el threadpool de las rutas.
+# Los derivados también van por contenido: uploads/proofs/review|thumbs/<ab>/<sha256>.jpg
+# -> un comprobante re-enviado reutiliza los que ya existen.
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from sqlalchemy import update
+
+from app import models
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+from app.core.outbox import register_handler
+
+settings = get_settings()
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".heic"}
+REVIEW_QUALITY = 80
+THUMB_QUALITY = 70
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=max(1, settings.IMAGE_PROCESSES))
+    return _pool
+
+
+def shutdown_image_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def derivative_paths(proof_path: str) -> Tuple[str, str]:
+    """uploads/proofs/ab/<sha>.png -> (uploads/proofs/review/ab/<sha>.jpg, uploads/proofs/thumbs/ab/<sha>.jpg)"""
+    folder, filename = os.path.split(proof_path)
+    shard_dir, shard = os.path.split(folder)
+    name = os.path.splitext(filename)[0]
+    review = os.path.join(shard_dir, "review", shard, f"{name}.jpg")
+    thumb = os.path.join(shard_dir, "thumbs", shard, f"{name}.jpg")
+    return review.replace(os.sep, "/"), thumb.replace(os.sep, "/")
+
+
+def _save_jpeg(img, path: str, max_px: int, quality: int) -> None:
+    copy = img.copy()
+    copy.thumbnail((max_px, max_px))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    copy.save(tmp, "JPEG", quality=quality, optimize=True, progressive=True)
+    os.replace(tmp, path)
+
+
+def _make_derivatives(src: str, review: str, thumb: str, review_px: int, thumb_px: int) -> None:
+    # Se ejecuta en el pool de procesos (función de módulo: se puede serializar)
+    if os.path.exists(review) and os.path.exists(thumb):
+        return
+    with Image.open(src) as img:
+        img = ImageOps.exif_transpose(img)  # fotos de celular: respetar la rotación
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        if not os.path.exists(review):
+            _save_jpeg(img, review, review_px, REVIEW_QUALITY)
+        if not os.path.exists(thumb):
+            _save_jpeg(img, thumb, thumb_px, THUMB_QUALITY)
+
+
+async def build_proof_derivatives(payload: Dict[str, Any]) -> None:
+    report_id = payload["aggregate_id"]
+    proof_path = payload.get("proof_url")
+    if not proof_path:
+        return
+    if os.path.splitext(proof_path)[1].lower() not in IMAGE_EXTENSIONS:
+        return  # PDF u otro: sin miniatura
+    if not os.path.exists(proof_path):
+        raise FileNotFoundError(proof_path)
+
+    review, thumb = derivative_paths(proof_path)
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(
+            _get_pool(), _make_derivatives, proof_path, review, thumb,
+            settings.IMAGE_REVIEW_MAX_PX, settings.IMAGE_THUMB_MAX_PX,
+        )
+    except UnidentifiedImageError:
+        return  # formato que Pillow no lee (ej. HEIC sin plugin): reintentar no sirve
+
+    def _save():
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(models.PaymentReport)
+                .where(models.PaymentReport.id == report_id)
+                .values(proof_review_url=review, proof_thumb_url=thumb)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    await loop.run_in_executor(None, _save)
+
+
+def register_handlers() -> None:
+    register_handler("payment.proof_uploaded", build_proof_derivatives)
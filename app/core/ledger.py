@@ -0,0 +1,182 @@
+# Motor de asientos de la wallet.
+# Todo movimiento de dinero pasa por post_entry():
+#   1. UPDATE users SET balance = balance + :x
+#        WHERE id = :id AND balance + :x >= 0
+#        RETURNING balance                         (atómico, sin read-modify-write)
+#   2. INSERT en wallet_transactions (+ su fila en activity_feed)
+#   3. UN solo commit
+# Así dos peticiones concurrentes no pueden pisarse el saldo ni dejarlo negativo.
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Float, Integer, column, func, insert, update, values
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core.activity import SOURCE_WALLET, record_activities, record_activity
+from app.core.cache import invalidate_user
+
+BatchEntry = Tuple[int, float, Optional[str]]  # (user_id, amount, note)
+
+
+def post_entry(
+    db: Session,
+    user_id: int,
+    amount: float,
+    tx_type: str,
+    note: Optional[str] = None,
+    *,
+    commit: bool = True,
+    allow_negative: bool = False,
+    insufficient_detail: str = "Saldo insuficiente",
+) -> Tuple[float, models.WalletTransaction]:
+    """
+    Aplica `amount` (positivo = entrada, negativo = salida) al saldo del usuario y
+    registra el movimiento en el historial. Devuelve (nuevo_saldo, transacción).
+
+    commit=False deja la transacción abierta para que el endpoint agregue más
+    escrituras (orden, reporte de pago...) y haga un único commit al final; en ese
+    caso es el endpoint quien llama invalidate_user() DESPUÉS de su commit (si se
+    invalida antes, otra petición puede volver a cachear el saldo viejo).
+    Si falla hace rollback y lanza 404 (usuario) o 400 (saldo insuficiente).
+    """
+    amount = float(amount)
+    new_balance = func.coalesce(models.User.balance, 0.0) + amount
+
+    stmt = (
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(balance=new_balance)
+        .returning(models.User.balance)
+        .execution_options(synchronize_session=False)
+    )
+    if amount < 0 and not allow_negative:
+        stmt = stmt.where(new_balance >= 0)
+
+    balance = db.execute(stmt).scalar_one_or_none()
+    if balance is None:
+        exists = db.query(models.User.id).filter(models.User.id == user_id).first()
+        db.rollback()
+        if not exists:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+        raise HTTPException(status_code=400, detail=insufficient_detail)
+
+    tx = models.WalletTransaction(
+        user_id=user_id,
+        amount=amount,
+        type=tx_type,
+        note=note or "Transacción",
+        balance_after=balance,
+    )
+    db.add(tx)
+    db.flush()  # id del movimiento para el feed
+    record_activity(db, SOURCE_WALLET, tx.id, user_id, tx_type, amount, tx.note)
+
+    if commit:
+        db.commit()
+        invalidate_user(user_id)
+    return float(balance), tx
+
+
+def touch_wallet(db: Session, user_id: int) -> None:
+    """
+    Un movimiento ya registrado cambió en el lugar (tipo/nota): sube users.wallet_version
+    para que el ETag de /wallet/me cambie aunque el saldo y el último id sigan iguales.
+    """
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(wallet_version=func.coalesce(models.User.wallet_version, 0) + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def post_batch(
+    db: Session,
+    entries: Sequence[BatchEntry],
+    tx_type: str,
+    *,
+    commit: bool = True,
+) -> Dict[int, float]:
+    """
+    Acredita muchos usuarios a la vez (solo montos positivos):
+      1. UN UPDATE users ... FROM (VALUES (id, total), ...) RETURNING id, balance
+      2. UN INSERT multi-fila en wallet_transactions (con balance_after por fila)
+         + las filas del feed de actividad
+      3. UN commit
+    Si un usuario se repite se suman sus montos y cada fila lleva su saldo corrido.
+    Todo o nada: si falta algún usuario hace rollback y lanza 404.
+    Devuelve {user_id: nuevo_saldo}. Con commit=False el llamador invalida la caché
+    de esos usuarios después de su commit.
+    """
+    totals: Dict[int, float] = {}
+    for user_id, amount, _ in entries:
+        totals[user_id] = totals.get(user_id, 0.0) + float(amount)
+    if not totals:
+        return {}
+
+    balances = _apply_totals(db, totals)
+
+    missing = sorted(set(totals) - set(balances))
+    if missing:
+        db.rollback()
+        raise HTTPException(status_code=404, detail=f"Usuarios no encontrados: {missing}")
+
+    # Saldo corrido por fila: se parte del saldo previo (nuevo - total) y se va sumando
+    running = {uid: balances[uid] - totals[uid] for uid in totals}
+    rows: List[dict] = []
+    for user_id, amount, note in entries:
+        running[user_id] += float(amount)
+        rows.append({
+            "user_id": user_id,
+            "amount": float(amount),
+            "type": tx_type,
+            "note": note or "Transacción",
+            "balance_after": running[user_id],
+        })
+    wt = models.WalletTransaction
+    tx_ids = db.execute(
+        insert(wt).returning(wt.id, sort_by_parameter_order=True), rows
+    ).scalars().all()
+    record_activities(db, [
+        {"source": SOURCE_WALLET, "source_id": tx_id, "user_id": row["user_id"],
+         "type": tx_type, "amount": row["amount"], "note": row["note"]}
+        for tx_id, row in zip(tx_ids, rows)
+    ])
+
+    if commit:
+        db.commit()
+        for user_id in totals:
+            invalidate_user(user_id)
+    return balances
+
+
+def _apply_totals(db: Session, totals: Dict[int, float]) -> Dict[int, float]:
+    if db.get_bind().dialect.name == "sqlite":
+        # SQLite no acepta "(VALUES ...) AS v(col, ...)": un UPDATE por usuario,
+        # dentro de la misma transacción (sigue siendo un único commit).
+        balances = {}
+        for user_id, total in totals.items():
+            balance = db.execute(
+                update(models.User)
+                .where(models.User.id == user_id)
+                .values(balance=func.coalesce(models.User.balance, 0.0) + total)
+                .returning(models.User.balance)
+                .execution_options(synchronize_session=False)
+            ).scalar_one_or_none()
+            if balance is not None:
+                balances[user_id] = float(balance)
+        return balances
+
+    credits = values(
+        column("user_id", Integer), column("amount", Float), name="credits"
+    ).data(list(totals.items()))
+    result = db.execute(
+        update(models.User)
+        .where(models.User.id == credits.c.user_id)
+        .values(balance=func.coalesce(models.User.balance, 0.0) + credits.c.amount)
+        .returning(models.User.id, models.User.balance)
+        .execution_options(synchronize_session=False)
+    )
+    return {row.id: float(row.balance) for row in result}
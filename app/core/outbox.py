@@ -0,0 +1,254 @@
+# Outbox transaccional + worker asíncrono.
+#
+# El endpoint escribe el evento con enqueue_event() en la MISMA transacción que la
+# orden: si la orden se confirma, el evento existe; si hace rollback, tampoco.
+# Nada externo (proveedor de recargas, licencias, streaming) se llama dentro del request.
+#
+# El worker (una tarea asyncio por proceso, arranca en main.py):
+#   1. Toma un lote con UPDATE ... WHERE status='PENDING' AND available_at <= now
+#      (varios workers/procesos no toman el mismo evento)
+#   2. Lo procesa con concurrencia acotada (semáforo OUTBOX_CONCURRENCY)
+#   3. OK -> DONE. Error -> reintento con backoff exponencial; al agotar -> FAILED
+# Un evento tomado por un worker que murió se re-toma al vencer su lease.
+# Cada toma guarda locked_by = id del worker: el cierre (DONE/FAILED/reintento) solo se
+# aplica si el worker TODAVÍA tiene el lease; si venció y otro lo re-tomó, no lo pisa.
+
+import asyncio
+import inspect
+import json
+import os
+import random
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core.config import get_settings
+from app.core.database import SessionLocal
+
+settings = get_settings()
+
+Handler = Callable[[Dict[str, Any]], Union[None, Awaitable[None]]]
+_handlers: Dict[str, Handler] = {}
+
+MAX_BACKOFF_SECONDS = 3600
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# --- PRODUCTOR (dentro de la transacción del endpoint) ---
+
+def enqueue_event(db: Session, topic: str, aggregate_id: Optional[int], payload: Optional[dict] = None) -> None:
+    """Agrega un evento a la transacción abierta (el commit lo hace el endpoint)."""
+    db.add(models.OutboxEvent(
+        topic=topic,
+        aggregate_id=aggregate_id,
+        payload=json.dumps(payload or {}),
+        status="PENDING",
+        attempts=0,
+        available_at=_utcnow(),
+    ))
+
+
+def register_handler(topic: str, fn: Handler) -> None:
+    """
+    Asocia un topic a su handler (cada módulo lo hace en su register_handlers(), que
+    main.py llama al arrancar).
+    El handler recibe el payload (dict) + "aggregate_id"; puede ser async (llamadas
+    HTTP a proveedores) o sync (se ejecuta en el threadpool). Si lanza excepción se reintenta.
+    """
+    _handlers[topic] = fn
+
+
+# --- CONSUMIDOR (worker) ---
+
+def _claim_batch(limit: int, worker_id: str) -> List[dict]:
+    db = SessionLocal()
+    try:
+        now = _utcnow()
+        ev = models.OutboxEvent
+        ready = or_(
+            ev.status == "PENDING",
+            ev.status == "PROCESSING",  # lease vencido: el worker anterior murió
+        )
+        candidates = (
+            select(ev.id)
+            .where(ready, ev.available_at <= now)
+            .order_by(ev.available_at, ev.id)
+            .limit(limit)
+        )
+        if db.get_bind().dialect.name == "postgresql":
+            candidates = candidates.with_for_update(skip_locked=True)
+        ids = db.execute(candidates).scalars().all()
+        if not ids:
+            db.rollback()
+            return []
+
+        # Re-chequeamos la condición en el UPDATE: si otro proceso ya lo tomó, no vuelve
+        rows = db.execute(
+            update(ev)
+            .where(ev.id.in_(ids), ready, ev.available_at <= now)
+            .values(
+                status="PROCESSING",
+                locked_by=worker_id,
+                attempts=ev.attempts + 1,
+                available_at=now + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS),
+            )
+            .returning(ev.id, ev.topic, ev.aggregate_id, ev.payload, ev.attempts)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.commit()
+        return [dict(row._mapping) for row in rows]
+    finally:
+        db.close()
+
+
+def _finish(event_id: int, attempts: int, error: Optional[str], worker_id: str) -> Optional[float]:
+    """
+    Cierra el evento si este worker todavía tiene el lease.
+    Devuelve los segundos hasta el reintento (None si no hay o si el lease se perdió).
+    """
+    delay = None
+    db = SessionLocal()
+    try:
+        now = _utcnow()
+        if error is None:
+            values = {"status": "DONE", "processed_at": now, "last_error": None}
+        elif attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+            values = {"status": "FAILED", "processed_at": now, "last_error": error}
+        else:
+            delay = min(MAX_BACKOFF_SECONDS, settings.OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1))
+            delay *= random.uniform(0.8, 1.2)  # jitter: que los reintentos no lleguen todos juntos
+            values = {"status": "PENDING", "available_at": now + timedelta(seconds=delay), "last_error": error}
+        ev = models.OutboxEvent
+        result = db.execute(
+            update(ev)
+            .where(ev.id == event_id, ev.status == "PROCESSING", ev.locked_by == worker_id)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        if not result.rowcount:
+            print(f"⚠️ [OUTBOX] Evento #{event_id}: lease vencido, otro worker lo re-tomó (no se cierra)")
+            return None
+    finally:
+        db.close()
+    return delay
+
+
+class OutboxWorker:
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._running: set = set()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"[:64]
+        self.processed = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(max(1, settings.OUTBOX_CONCURRENCY))
+        self._task = self._loop.create_task(self._run())
+        print("✅ [OUTBOX] Worker iniciado")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        # Lo que quede en vuelo vuelve a la cola al vencer el lease
+        for task in list(self._running):
+            task.cancel()
+        self._task = None
+
+    def notify(self) -> None:
+        """Despierta al worker ya (thread-safe: se llama desde endpoints sync)."""
+        if self._loop is not None and self._wakeup is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass  # loop cerrado (shutdown)
+
+    async def _run(self) -> None:
+        while True:
+            # Se limpia ANTES de tomar: un notify() durante la toma no se pierde
+            self._wakeup.clear()
+            try:
+                claimed = await self._drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ [OUTBOX] Error tomando eventos: {e}")
+                claimed = 0
+            if claimed:
+                continue  # puede haber más: seguimos sin esperar
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _drain_once(self) -> int:
+        # Solo tomamos lo que podemos procesar: el lease no corre mientras esperan en cola
+        free = max(1, settings.OUTBOX_CONCURRENCY - len(self._running))
+        events = await run_in_threadpool(_claim_batch, min(free, settings.OUTBOX_BATCH_SIZE), self.worker_id)
+        for event in events:
+            await self._semaphore.acquire()
+            task = asyncio.create_task(self._process(event))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+        return len(events)
+
+    async def _process(self, event: dict) -> None:
+        error = None
+        try:
+            handler = _handlers.get(event["topic"])
+            if handler is None:
+                raise RuntimeError(f"Sin handler para el tópico {event['topic']}")
+            payload = json.loads(event["payload"] or "{}")
+            payload["aggregate_id"] = event["aggregate_id"]
+            if inspect.iscoroutinefunction(handler):
+                await asyncio.wait_for(handler(payload), timeout=settings.OUTBOX_HANDLER_TIMEOUT_SECONDS)
+            else:
+                await run_in_threadpool(handler, payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:2000]
+            print(f"⚠️ [OUTBOX] Evento #{event['id']} ({event['topic']}) intento {event['attempts']}: {error}")
+        finally:
+            self._semaphore.release()
+
+        try:
+            retry_in = await run_in_threadpool(_finish, event["id"], event["attempts"], error, self.worker_id)
+        except Exception as e:
+            print(f"⚠️ [OUTBOX] No se pudo cerrar el evento #{event['id']}: {e}")
+            return
+        if error is None:
+            self.processed += 1
+        else:
+            self.failed += 1
+        if retry_in is not None and retry_in < settings.OUTBOX_POLL_SECONDS:
+            # Reintento antes del próximo sondeo: despertamos al worker a tiempo
+            self._loop.call_later(retry_in, self._wakeup.set)
+
+
+outbox_worker = OutboxWorker()
+
+
+def notify_outbox() -> None:
+    outbox_worker.notify()
@@ -0,0 +1,61 @@
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import literal, tuple_
+from sqlalchemy.orm import Query, Session
+
+# ==========================================
+# PAGINACIÓN KEYSET (cursor = created_at + id)
+# ==========================================
+# En vez de OFFSET (que recorre todas las filas anteriores) filtramos
+# "WHERE (created_at, id) < (:c, :id) ORDER BY created_at DESC, id DESC LIMIT n".
+# Con un índice (..., created_at DESC, id DESC) la página 1000 cuesta lo mismo que la 1.
+# Se compara la columna cruda (sin funciones encima) para que el índice sirva también en
+# SQLite: ahí todas las fechas se guardan en un solo formato de texto (ver
+# app/core/database.py, SQLITE_TIMESTAMP_FORMAT).
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(created_at: Optional[datetime], row_id: int) -> str:
+    raw = f"{created_at.isoformat() if created_at else ''}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_raw, id_raw = base64.urlsafe_b64decode(padded.encode()).decode().rsplit("|", 1)
+        return (datetime.fromisoformat(created_raw) if created_raw else None), int(id_raw)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def keyset_page(db: Session, query: Query, created_col, id_col, cursor: Optional[str], limit: int):
+    """
+    Aplica orden DESC + cursor + LIMIT a `query`.
+    Devuelve (filas, next_cursor). next_cursor es None en la última página.
+    Las filas deben exponer los atributos created_at e id.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        if created_at is not None:
+            # El valor viaja con el tipo de la columna: se guarda/compara en su mismo formato
+            bound = literal(created_at, created_col.type)
+            query = query.filter(tuple_(created_col, id_col) < tuple_(bound, row_id))
+        else:
+            query = query.filter(id_col < row_id)
+
+    rows = query.order_by(created_col.desc(), id_col.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, "created_at", None), getattr(last, "id"))
+    return rows, next_cursor
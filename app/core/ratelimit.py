@@ -0,0 +1,192 @@
+import ipaddress
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+
+def _retry_after(tokens: float, refill_per_sec: float) -> float:
+    if refill_per_sec <= 0:
+        return 60.0
+    return (1 - tokens) / refill_per_sec
+
+
+# ==========================================
+# ALMACENES DE BUCKETS (pluggable)
+# ==========================================
+# Cada store implementa de forma atómica:
+#   take(key, capacity, refill_per_sec) -> (permitido, retry_after_segundos)
+#   refund(key, capacity)               -> devuelve el token tomado (login exitoso)
+# "blocking" indica si hace I/O (para llamarlo desde el threadpool).
+
+class MemoryBucketStore:
+    """Buckets en memoria del proceso (cada worker de gunicorn lleva su cuenta)."""
+
+    blocking = False
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: float, refill_per_sec: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * refill_per_sec)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else _retry_after(tokens, refill_per_sec)
+
+    def refund(self, key: str, capacity: float) -> None:
+        with self._lock:
+            if key in self._buckets:
+                tokens, last = self._buckets[key]
+                self._buckets[key] = (min(capacity, tokens + 1), last)
+
+
+class SQLiteBucketStore:
+    """
+    Buckets en un archivo SQLite local: todos los workers de la misma máquina
+    comparten el estado (sustituto local de un Redis).
+    """
+
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS login_buckets ("
+            " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, capacity: float, refill_per_sec: float) -> Tuple[bool, float]:
+        # time.time(): el reloj tiene que ser comparable entre procesos
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM login_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, last = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - last) * refill_per_sec)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute(
+                "INSERT INTO login_buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, 0.0 if allowed else _retry_after(tokens, refill_per_sec)
+
+    def refund(self, key: str, capacity: float) -> None:
+        self._conn().execute(
+            "UPDATE login_buckets SET tokens = MIN(?, tokens + 1) WHERE key = ?", (capacity, key)
+        )
+
+
+# ==========================================
+# LIMITADOR DE LOGIN
+# ==========================================
+
+@lru_cache(maxsize=8)
+def _trusted_networks(raw: str):
+    return tuple(ipaddress.ip_network(item.strip(), strict=False) for item in raw.split(",") if item.strip())
+
+
+_trusted_networks(settings.TRUSTED_PROXIES)  # un valor mal escrito falla al arrancar, no en cada login
+
+
+def _is_trusted_proxy(peer: Optional[str]) -> bool:
+    networks = _trusted_networks(settings.TRUSTED_PROXIES)
+    if not networks:
+        return True  # header activado sin lista: se confía en quien esté delante
+    try:
+        address = ipaddress.ip_address(peer or "")
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def client_ip(headers, peer: Optional[str]) -> str:
+    """
+    IP del cliente. Por defecto la de la conexión (peer). Con CLIENT_IP_HEADER activado
+    (detrás del proxy de Render, donde el peer es el proxy y todos compartirían el bucket)
+    se toma la entrada que agregó el proxy confiable más externo (TRUSTED_PROXY_HOPS desde
+    la derecha), y solo si el peer está en TRUSTED_PROXIES cuando esa lista existe.
+    """
+    if settings.CLIENT_IP_HEADER and _is_trusted_proxy(peer):
+        forwarded = [ip.strip() for ip in (headers.get(settings.CLIENT_IP_HEADER) or "").split(",") if ip.strip()]
+        if forwarded:
+            return forwarded[max(0, len(forwarded) - max(1, settings.TRUSTED_PROXY_HOPS))]
+    return peer or ""
+
+
+class LoginThrottle:
+    """
+    Token bucket por IP y por usuario. Se consulta ANTES de tocar la BD o bcrypt.
+    El token se toma antes del intento y se DEVUELVE si el login fue exitoso:
+    solo los intentos fallidos gastan el bucket (el usuario real no se bloquea a sí mismo).
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def hit(self, username: str, client_ip: str) -> Tuple[bool, float]:
+        if client_ip:
+            allowed, retry_after = self.store.take(
+                f"ip:{client_ip}",
+                settings.LOGIN_THROTTLE_IP_BURST,
+                settings.LOGIN_THROTTLE_IP_PER_MINUTE / 60.0,
+            )
+            if not allowed:
+                return False, retry_after
+        if username:
+            return self.store.take(
+                f"user:{username.strip().lower()}",
+                settings.LOGIN_THROTTLE_USER_BURST,
+                settings.LOGIN_THROTTLE_USER_PER_MINUTE / 60.0,
+            )
+        return True, 0.0
+
+    def succeeded(self, username: str, client_ip: str) -> None:
+        if client_ip:
+            self.store.refund(f"ip:{client_ip}", settings.LOGIN_THROTTLE_IP_BURST)
+        if username:
+            self.store.refund(f"user:{username.strip().lower()}", settings.LOGIN_THROTTLE_USER_BURST)
+
+
+def _build_store():
+    if settings.LOGIN_THROTTLE_BACKEND == "sqlite":
+        return SQLiteBucketStore(settings.LOGIN_THROTTLE_SQLITE_PATH)
+    return MemoryBucketStore()
+
+
+login_throttle = LoginThrottle(_build_store())
@@ -0,0 +1,161 @@
+# Conciliación incremental: users.balance vs historial (wallet_transactions).
+#
+# En vez de un SUM(amount) de TODO el historial por usuario, cada usuario tiene
+# un checkpoint (ledger_checkpoints) con la suma verificada hasta last_tx_id.
+# Cada corrida solo suma los movimientos NUEVOS (id > floor de la corrida anterior),
+# así el costo crece con la actividad del día y no con el historial total.
+#
+# Los movimientos de los últimos RECONCILE_SETTLE_SECONDS se cuentan para comparar
+# pero NO se consolidan en el checkpoint: un id menor puede confirmarse (commit)
+# después de uno mayor y no queremos saltarlo.
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.orm import Session
+
+from app import models
+
+RECONCILE_SETTLE_SECONDS = 300
+TOLERANCE = 0.005  # saldos en Float: medio centavo de tolerancia
+
+
+def reconcile_ledger(db: Session, settle_seconds: int = RECONCILE_SETTLE_SECONDS) -> Dict:
+    wt = models.WalletTransaction
+    cp = models.LedgerCheckpoint
+
+    last_run = (
+        db.query(models.LedgerReconciliationRun)
+        .order_by(models.LedgerReconciliationRun.id.desc())
+        .first()
+    )
+    floor = last_run.next_floor_tx_id if last_run else 0
+    settle_before = datetime.now(timezone.utc) - timedelta(seconds=settle_seconds)
+    settled = wt.created_at < settle_before
+
+    # 1. Deltas por usuario SOLO de los movimientos nuevos (rango por PK)
+    delta = (
+        select(
+            wt.user_id.label("user_id"),
+            func.count(wt.id).label("rows"),
+            func.sum(wt.amount).label("delta_all"),
+            func.sum(case((settled, wt.amount), else_=0.0)).label("delta_settled"),
+            func.max(case((settled, wt.id))).label("settled_max_id"),
+            func.min(case((settled, None), else_=wt.id)).label("unsettled_min_id"),
+            func.max(wt.id).label("max_id"),
+        )
+        .select_from(wt)
+        .outerjoin(cp, cp.user_id == wt.user_id)
+        .where(wt.id > floor, wt.id > func.coalesce(cp.last_tx_id, 0))
+        .group_by(wt.user_id)
+        .subquery()
+    )
+
+    # 2. Saldo + checkpoint + delta en UNA consulta (misma foto de la BD)
+    rows = db.execute(
+        select(
+            delta.c.user_id,
+            delta.c.rows,
+            delta.c.delta_all,
+            delta.c.delta_settled,
+            delta.c.settled_max_id,
+            delta.c.unsettled_min_id,
+            delta.c.max_id,
+            models.User.balance,
+            cp.verified_sum,
+            cp.last_tx_id,
+        )
+        .select_from(delta)
+        .join(models.User, models.User.id == delta.c.user_id)
+        .outerjoin(cp, cp.user_id == delta.c.user_id)
+    ).all()
+
+    now = datetime.now(timezone.utc)
+    discrepancies: List[Dict] = []
+    rows_scanned = 0
+    next_floor = floor
+    unsettled_floor = None
+
+    for r in rows:
+        rows_scanned += r.rows
+        next_floor = max(next_floor, r.max_id)
+        if r.unsettled_min_id is not None:
+            unsettled_floor = min(unsettled_floor or r.unsettled_min_id, r.unsettled_min_id)
+
+        verified = r.verified_sum or 0.0
+        expected = verified + (r.delta_all or 0.0)
+        diff = round(float(r.balance or 0.0) - expected, 2)
+        if abs(diff) > TOLERANCE:
+            discrepancies.append({
+                "user_id": r.user_id,
+                "balance": float(r.balance or 0.0),
+                "ledger_sum": round(expected, 2),
+                "difference": diff,
+            })
+
+        checkpoint = db.get(cp, r.user_id)
+        if checkpoint is None:
+            checkpoint = cp(user_id=r.user_id, last_tx_id=0, verified_sum=0.0)
+            db.add(checkpoint)
+        if r.settled_max_id is not None:
+            checkpoint.last_tx_id = r.settled_max_id
+            checkpoint.verified_sum = verified + (r.delta_settled or 0.0)
+        checkpoint.last_discrepancy = diff
+        checkpoint.checked_at = now
+
+    # La próxima corrida arranca antes del primer movimiento sin consolidar
+    if unsettled_floor is not None:
+        next_floor = min(next_floor, unsettled_floor - 1)
+
+    run = models.LedgerReconciliationRun(
+        floor_tx_id=floor,
+        next_floor_tx_id=next_floor,
+        rows_scanned=rows_scanned,
+        users_checked=len(rows),
+        discrepancies=len(discrepancies),
+    )
+    db.add(run)
+    db.commit()
+
+    return {
+        "run_id": run.id,
+        "floor_tx_id": floor,
+        "next_floor_tx_id": next_floor,
+        "rows_scanned": rows_scanned,
+        "users_checked": len(rows),
+        "discrepancies": discrepancies,
+    }
+
+
+def idle_discrepancies(db: Session) -> List[Dict]:
+    """
+    Usuarios SIN movimientos nuevos cuyo saldo ya no coincide con su checkpoint
+    (o con 0 si nunca tuvieron movimientos): alguien tocó users.balance por fuera
+    del ledger. No lee el historial.
+    """
+    cp = models.LedgerCheckpoint
+    verified = func.coalesce(cp.verified_sum, 0.0)
+    rows = (
+        db.query(models.User.id, models.User.balance, verified.label("verified_sum"))
+        .outerjoin(cp, cp.user_id == models.User.id)
+        .outerjoin(
+            models.WalletTransaction,
+            and_(
+                models.WalletTransaction.user_id == models.User.id,
+                models.WalletTransaction.id > func.coalesce(cp.last_tx_id, 0),
+            ),
+        )
+        .filter(models.WalletTransaction.id.is_(None))
+        .filter(func.abs(func.coalesce(models.User.balance, 0.0) - verified) > TOLERANCE)
+        .all()
+    )
+    return [
+        {
+            "user_id": r.id,
+            "balance": float(r.balance or 0.0),
+            "ledger_sum": round(r.verified_sum, 2),
+            "difference": round(float(r.balance or 0.0) - r.verified_sum, 2),
+        }
+        for r in rows
+    ]
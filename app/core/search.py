@@ -0,0 +1,115 @@
+# Búsqueda de texto sobre el feed de actividad (type, note, username).
+#
+# Postgres: extensión pg_trgm + índices GIN (gin_trgm_ops) -> el ILIKE '%q%' usa el índice.
+# SQLite:   tabla FTS5 externa (activity_feed_fts, tokenizer trigram) sincronizada por
+#           triggers con activity_feed -> MATCH sobre el índice.
+# En ambos casos es búsqueda por subcadena (igual que el ILIKE de antes), sin distinguir
+# mayúsculas. El resaltado se arma sobre la página devuelta (pocas filas), no sobre la tabla.
+
+import html
+import re
+from typing import Dict, Optional
+
+from sqlalchemy import or_, select, text
+from sqlalchemy.orm import Session
+
+from app import models
+from app.core.database import engine
+
+SEARCH_COLUMNS = ("type", "note", "username")
+FTS_MIN_CHARS = 3  # el tokenizer trigram necesita al menos 3 caracteres
+
+_PG_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    *[
+        f"CREATE INDEX IF NOT EXISTS ix_activity_feed_{col}_trgm ON activity_feed USING gin ({col} gin_trgm_ops)"
+        for col in SEARCH_COLUMNS
+    ],
+]
+
+_SQLITE_DDL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS activity_feed_fts_ai AFTER INSERT ON activity_feed BEGIN
+        INSERT INTO activity_feed_fts(rowid, type, note, username)
+        VALUES (new.id, new.type, new.note, new.username);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS activity_feed_fts_ad AFTER DELETE ON activity_feed BEGIN
+        INSERT INTO activity_feed_fts(activity_feed_fts, rowid, type, note, username)
+        VALUES ('delete', old.id, old.type, old.note, old.username);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS activity_feed_fts_au AFTER UPDATE ON activity_feed BEGIN
+        INSERT INTO activity_feed_fts(activity_feed_fts, rowid, type, note, username)
+        VALUES ('delete', old.id, old.type, old.note, old.username);
+        INSERT INTO activity_feed_fts(rowid, type, note, username)
+        VALUES (new.id, new.type, new.note, new.username);
+    END
+    """,
+]
+
+
+def ensure_search_indexes() -> None:
+    """Arranque: crea los índices de búsqueda (DDL propio de cada motor, sin Alembic)."""
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        with engine.begin() as conn:
+            for ddl in _PG_DDL:
+                conn.execute(text(ddl))
+    elif dialect == "sqlite":
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'activity_feed_fts'")
+            ).first()
+            if not exists:
+                conn.execute(text(
+                    "CREATE VIRTUAL TABLE activity_feed_fts USING fts5("
+                    "type, note, username, content='activity_feed', content_rowid='id', tokenize='trigram')"
+                ))
+                # Tabla nueva: indexa lo que ya hay en el feed
+                conn.execute(text("INSERT INTO activity_feed_fts(activity_feed_fts) VALUES ('rebuild')"))
+                print("✅ [DB] Índice de búsqueda (activity_feed_fts) creado")
+            for ddl in _SQLITE_DDL:
+                conn.execute(text(ddl))
+
+
+def _like_term(q: str) -> str:
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def activity_search_filter(db: Session, q: str):
+    """Condición WHERE sobre models.ActivityFeed para el texto `q` (ya sin espacios extremos)."""
+    feed = models.ActivityFeed
+    if db.get_bind().dialect.name == "sqlite" and len(q) >= FTS_MIN_CHARS:
+        phrase = '"' + q.replace('"', '""') + '"'
+        matches = select(text("rowid")).select_from(text("activity_feed_fts")).where(
+            text("activity_feed_fts MATCH :fts_query").bindparams(fts_query=phrase)
+        )
+        return feed.id.in_(matches)
+
+    # Postgres (GIN trigram) o término corto en SQLite
+    term = _like_term(q)
+    return or_(*[getattr(feed, col).ilike(term, escape="\\") for col in SEARCH_COLUMNS])
+
+
+def highlight_matches(values: Dict[str, Optional[str]], q: str) -> Dict[str, str]:
+    """
+    {"note": "Compra (order #5)"} + q="order" -> {"note": "Compra (<mark>order</mark> #5)"}.
+    Solo devuelve los campos donde hubo coincidencia; el resto del texto va escapado (HTML).
+    """
+    pattern = re.compile(re.escape(q), re.IGNORECASE)
+    out: Dict[str, str] = {}
+    for field, value in values.items():
+        if not value or not pattern.search(value):
+            continue
+        parts, last = [], 0
+        for m in pattern.finditer(value):
+            parts.append(html.escape(value[last:m.start()]))
+            parts.append(f"<mark>{html.escape(m.group(0))}</mark>")
+            last = m.end()
+        parts.append(html.escape(value[last:]))
+        out[field] = "".join(parts)
+    return out
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+# --- FUNCIONES SYNC (se ejecutan dentro del pool) ---
+
+def verify_password(plain_password: str, hashed_or_plain: str) -> bool:
+    if not hashed_or_plain: return False
+    try: return pwd_context.verify(plain_password, hashed_or_plain)
+    except Exception: return plain_password == hashed_or_plain
+
+def get_password_hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+# --- POOL DEDICADO ---
+# bcrypt es CPU puro (~250ms por hash). Si corre en el threadpool por defecto de
+# anyio compite con TODAS las rutas sync (wallet, catálogo...). Aquí lo aislamos
+# en un pool propio y acotado: si se llena, respondemos 503 en vez de encolar sin fin.
+
+_executor: Optional[Executor] = None
+_bulk_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+_in_flight = 0
+_rejected = 0
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                size = max(1, settings.HASH_POOL_SIZE)
+                if settings.HASH_POOL_MODE == "process":
+                    _executor = ProcessPoolExecutor(max_workers=size)
+                else:
+                    _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="bcrypt")
+    return _executor
+
+
+async def _run_in_hash_pool(fn, *args):
+    global _in_flight, _rejected
+    with _executor_lock:
+        if _in_flight >= settings.HASH_POOL_MAX_QUEUE:
+            _rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Servidor ocupado, intenta de nuevo en unos segundos",
+                headers={"Retry-After": "2"},
+            )
+        _in_flight += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), fn, *args)
+    finally:
+        with _executor_lock:
+            _in_flight -= 1
+
+
+async def verify_password_async(plain_password: str, hashed_or_plain: str) -> bool:
+    return await _run_in_hash_pool(verify_password, plain_password, hashed_or_plain)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_in_hash_pool(get_password_hash, password)
+
+
+# --- HASHING MASIVO (importación de usuarios) ---
+
+def _hash_many(passwords: List[str]) -> List[str]:
+    return [get_password_hash(p) for p in passwords]
+
+
+def _get_bulk_executor() -> ProcessPoolExecutor:
+    global _bulk_executor
+    if _bulk_executor is None:
+        with _executor_lock:
+            if _bulk_executor is None:
+                _bulk_executor = ProcessPoolExecutor(max_workers=max(1, settings.BULK_HASH_PROCESSES))
+    return _bulk_executor
+
+
+async def hash_passwords_bulk(passwords: List[str]) -> List[str]:
+    """Hashea una lista de contraseñas en paralelo (pool de procesos). Mantiene el orden."""
+    if not passwords:
+        return []
+    workers = max(1, settings.BULK_HASH_PROCESSES)
+    # Varios lotes por proceso para repartir bien la carga sin pagar IPC por cada hash
+    size = max(1, -(-len(passwords) // (workers * 4)))
+    parts = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+    loop = asyncio.get_running_loop()
+    executor = _get_bulk_executor()
+    results = await asyncio.gather(*(loop.run_in_executor(executor, _hash_many, part) for part in parts))
+    return [h for part in results for h in part]
+
+
+def hash_pool_stats() -> dict:
+    size = max(1, settings.HASH_POOL_SIZE)
+    in_flight = _in_flight
+    return {
+        "mode": settings.HASH_POOL_MODE,
+        "workers": size,
+        "in_flight": in_flight,
+        "queue_depth": max(0, in_flight - size),
+        "max_queue": settings.HASH_POOL_MAX_QUEUE,
+        "rejected": _rejected,
+    }
+
+
+def shutdown_hash_pool() -> None:
+    global _executor, _bulk_executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+        if _bulk_executor is not None:
+            _bulk_executor.shutdown(wait=False, cancel_futures=True)
+            _bulk_executor = None
@@ -0,0 +1,186 @@
+# Almacenamiento de archivos subidos direccionado por contenido.
+#
+# UploadSizeLimitMiddleware corta los multipart ANTES de que FastAPI parsee el
+# formulario (request.form() lee y guarda todo el body antes de correr el endpoint):
+#   - Content-Length mayor al máximo -> 413 sin leer nada
+#   - sin Content-Length (chunked) -> se cuentan los bytes que llegan: 413 al pasarse
+#   - subida trabada (sin bytes por UPLOAD_IDLE_TIMEOUT_SECONDS) -> 408
+#
+# El archivo se lee por chunks (async), se hashea (sha256) mientras se copia a un
+# temporal y se corta con 413 apenas supera el máximo. Al terminar se mueve a
+#   uploads/<subdir>/<ab>/<sha256><ext>
+# Si ese archivo ya existe (mismo comprobante re-enviado) se descarta el temporal:
+# el mismo contenido se guarda UNA sola vez.
+# La escritura a disco va al threadpool: el event loop queda libre mientras el
+# celular sube despacio.
+
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".heic", ".gif", ".pdf"}
+CONTENT_TYPE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/heic": ".heic",
+    "image/gif": ".gif",
+    "application/pdf": ".pdf",
+}
+
+# Margen para los demás campos del formulario multipart
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+def _too_large_detail() -> str:
+    return f"Archivo demasiado grande (máximo {settings.UPLOAD_MAX_BYTES // (1024 * 1024)} MB)"
+
+
+class UploadRejected(HTTPException):
+    """
+    413/408 lanzado mientras se recibe el body. Es HTTPException para que FastAPI no la
+    convierta en 400 "error parsing the body" al fallar request.form().
+    """
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Middleware ASGI para los POST/PUT/PATCH multipart/form-data: limita el body a
+    UPLOAD_MAX_BYTES (+ margen de los demás campos) mientras llega, no después.
+    """
+
+    def __init__(self, app, max_bytes: Optional[int] = None, idle_timeout: Optional[float] = None):
+        self.app = app
+        self.max_bytes = (max_bytes or settings.UPLOAD_MAX_BYTES) + MULTIPART_OVERHEAD_BYTES
+        self.idle_timeout = idle_timeout or settings.UPLOAD_IDLE_TIMEOUT_SECONDS
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._is_multipart(scope):
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            await self._reject(send, 413, _too_large_detail())
+            return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            try:
+                message = await asyncio.wait_for(receive(), timeout=self.idle_timeout)
+            except asyncio.TimeoutError:
+                raise UploadRejected(status_code=408, detail="La subida se detuvo (tiempo de espera agotado)")
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise UploadRejected(status_code=413, detail=_too_large_detail())
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except UploadRejected as e:
+            # Si el corte ocurrió fuera del parseo de FastAPI (no se llegó a responder)
+            if started:
+                raise
+            await self._reject(send, e.status_code, e.detail)
+
+    @staticmethod
+    def _is_multipart(scope) -> bool:
+        if scope.get("method") not in ("POST", "PUT", "PATCH"):
+            return False
+        content_type = dict(scope["headers"]).get(b"content-type", b"")
+        return content_type.lower().startswith(b"multipart/form-data")
+
+    @staticmethod
+    async def _reject(send, status_code: int, detail: str) -> None:
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def _extension(upload: UploadFile) -> str:
+    ext = os.path.splitext(upload.filename or "")[1].lower()
+    if ext in ALLOWED_EXTENSIONS:
+        return ".jpg" if ext == ".jpeg" else ext
+    return CONTENT_TYPE_EXTENSIONS.get((upload.content_type or "").split(";")[0].strip().lower(), "")
+
+
+def _finalize(tmp_path: str, final_path: str) -> bool:
+    """Mueve el temporal a su ruta final. Devuelve False si ya existía (duplicado)."""
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    if os.path.exists(final_path):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, final_path)
+    return True
+
+
+async def store_upload(
+    upload: UploadFile, subdir: str, max_bytes: Optional[int] = None
+) -> Tuple[str, str, int]:
+    """
+    Guarda el archivo por contenido. Devuelve (ruta_relativa, sha256, bytes).
+    413 si supera max_bytes, 400 si está vacío o el tipo no está permitido.
+    """
+    max_bytes = max_bytes or settings.UPLOAD_MAX_BYTES
+    ext = _extension(upload)
+    if not ext:
+        raise HTTPException(status_code=400, detail="Tipo de archivo no permitido (imagen o PDF)")
+
+    tmp_dir = os.path.join(settings.UPLOAD_DIR, ".tmp")
+    await run_in_threadpool(os.makedirs, tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail=_too_large_detail())
+                digest.update(chunk)
+                await run_in_threadpool(out.write, chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="El archivo está vacío")
+
+        sha = digest.hexdigest()
+        final_path = os.path.join(settings.UPLOAD_DIR, subdir, sha[:2], f"{sha}{ext}")
+        await run_in_threadpool(_finalize, tmp_path, final_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return final_path.replace(os.sep, "/"), sha, size
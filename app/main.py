@@ -1,6 +1,14 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.database import init_db
+from app.core.security import shutdown_hash_pool
+from app.core.config import get_settings
+from app.core.outbox import outbox_worker
+from app.core.images import shutdown_image_pool
+from app.core.uploads import UploadSizeLimitMiddleware
+from app.core import fulfillment, images
 
 # 1. IMPORTACIONES (Traemos todos los módulos)
 from app.api import (
@@ -11,9 +19,35 @@ from app.api import (
     withdrawals, announcements, admin_users, admin_products
 )
 
-app = FastAPI(title="Backend Motostore")
+# 2. INICIO Y CIERRE (BASE DE DATOS + WORKERS)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        init_db()
+        print("--- DB INICIALIZADA CORRECTAMENTE ---")
+    except Exception as e:
+        print(f"--- ERROR AL INICIAR DB: {e}")
+
+    # Handlers del outbox: fulfillment de órdenes y derivados de comprobantes
+    fulfillment.register_handlers()
+    images.register_handlers()
+    if get_settings().OUTBOX_WORKER_ENABLED:
+        outbox_worker.start()
+
+    yield
+
+    await outbox_worker.stop()
+    shutdown_image_pool()
+    shutdown_hash_pool()
 
-# 2. CONFIGURACIÓN DE SEGURIDAD (CORS BLINDADO)
+
+app = FastAPI(title="Backend Motostore", lifespan=lifespan)
+
+# Límite de tamaño de las subidas multipart mientras llega el body (antes de parsear el formulario).
+# Se agrega ANTES que CORS: CORS queda por fuera y el 413 también lleva sus headers.
+app.add_middleware(UploadSizeLimitMiddleware)
+
+# 3. CONFIGURACIÓN DE SEGURIDAD (CORS BLINDADO)
 # Listamos explícitamente los métodos para evitar bloqueos en PATCH
 app.add_middleware(
     CORSMiddleware,
@@ -21,18 +55,12 @@ app.add_middleware(
     allow_credentials=False, # Debe ser False si usamos origins=["*"]
     allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"], # 🔥 PATCH EXPLÍCITO
     allow_headers=["*"],
+    # Paginación por cursor, totales, ETag y Retry-After viajan en headers: el frontend
+    # (otro origen) solo puede leerlos si se exponen explícitamente
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "ETag", "Retry-After"],
     max_age=600,
 )
 
-# 3. INICIO DE BASE DE DATOS
-@app.on_event("startup")
-def on_startup():
-    try:
-        init_db()
-        print("--- DB INICIALIZADA CORRECTAMENTE ---")
-    except Exception as e:
-        print(f"--- ERROR AL INICIAR DB: {e}")
-
 # ==================================================================
 # 4. CONEXIÓN DE RUTAS (ROUTERS)
 # ==================================================================
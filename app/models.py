@@ -7,6 +7,8 @@ from sqlalchemy import (
     Boolean,
     ForeignKey,
     DateTime,
+    Index,
+    UniqueConstraint,
     func,
 )
 from sqlalchemy.orm import relationship
@@ -33,6 +35,8 @@ class Product(Base):
     name = Column(String(200), nullable=False)
     description = Column(Text, nullable=True)
     price = Column(Float, nullable=False)
+    # Costo de compra: el checkout lo copia en order_items.unit_cost
+    cost = Column(Float, nullable=True)
     active = Column(Boolean, default=True)
 
     category_id = Column(Integer, ForeignKey("categories.id"), nullable=True)
@@ -101,6 +105,9 @@ class User(Base):
     role = Column(String(30), nullable=False, default="CLIENT")
     is_superuser = Column(Boolean, default=False)
     balance = Column(Float, default=0.0)
+    # Sube cada vez que un movimiento existente cambia en el lugar (retiro aprobado/rechazado).
+    # Forma parte del ETag de /wallet/me junto con el saldo y el último movimiento.
+    wallet_version = Column(Integer, nullable=True)
 
     is_active = Column(Boolean, nullable=True, default=True)
     full_name = Column(String(255), nullable=True)
@@ -119,6 +126,25 @@ class User(Base):
     orders = relationship("Order", backref="user", lazy="select")
 
 
+# ===================== JERARQUÍA (CLOSURE TABLE) ===================== #
+
+class UserClosure(Base):
+    """
+    Un registro por cada par (ancestro, descendiente) del árbol users.parent_id,
+    incluido el propio usuario (depth=0). La red de un DISTRIBUTOR es
+    "WHERE ancestor_id = :id" sin recorrer el árbol. La mantiene app/core/hierarchy.py.
+    """
+    __tablename__ = "user_closure"
+
+    ancestor_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    depth = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_user_closure_descendant", descendant_id, ancestor_id),
+    )
+
+
 # ===================== CLIENTES ===================== #
 
 class Customer(Base):
@@ -163,6 +189,126 @@ class WalletTransaction(Base):
     note = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
+    # Saldo del usuario justo después de este movimiento (lo escribe el ledger).
+    # NULL en movimientos anteriores a esta columna.
+    balance_after = Column(Float, nullable=True)
+
+    # Historial paginado por cursor: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+    __table_args__ = (
+        Index("ix_wallet_tx_user_created_id", user_id, created_at.desc(), id.desc()),
+        # /transactions/all (UNION ALL global ordenado por fecha)
+        Index("ix_wallet_tx_created_id", created_at.desc(), id.desc()),
+    )
+
+
+# ===================== FEED DE ACTIVIDAD ===================== #
+
+class ActivityFeed(Base):
+    """
+    Vista desnormalizada de wallet + órdenes + reportes de pago (lo que muestran
+    /transactions y /transactions/all). Se escribe en la MISMA transacción que el
+    movimiento original (app/core/activity.py); leer el feed es un rango por índice.
+    """
+    __tablename__ = "activity_feed"
+
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String(20), nullable=False)      # wallet / order / payment
+    source_id = Column(Integer, nullable=False)      # id en la tabla de origen
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    username = Column(String(100), nullable=True)
+    type = Column(String(40), nullable=False)        # deposit / purchase / order / payment-pending...
+    amount = Column(Float, nullable=False)
+    note = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("source", "source_id", name="uq_activity_feed_source"),
+        Index("ix_activity_feed_created_id", created_at.desc(), id.desc()),
+        Index("ix_activity_feed_user_created_id", user_id, created_at.desc(), id.desc()),
+    )
+
+
+# ===================== CONCILIACIÓN DEL LEDGER ===================== #
+
+class LedgerCheckpoint(Base):
+    """
+    Suma verificada del historial de cada usuario hasta last_tx_id.
+    La conciliación solo suma los movimientos con id > last_tx_id.
+    """
+    __tablename__ = "ledger_checkpoints"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    last_tx_id = Column(Integer, nullable=False, default=0)
+    verified_sum = Column(Float, nullable=False, default=0.0)
+    # users.balance - suma del historial en la última corrida (0 = cuadra)
+    last_discrepancy = Column(Float, nullable=True)
+    checked_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=True)
+
+
+class LedgerReconciliationRun(Base):
+    __tablename__ = "ledger_reconciliation_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    started_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Movimientos con id > floor_tx_id fueron revisados en esta corrida
+    floor_tx_id = Column(Integer, nullable=False, default=0)
+    next_floor_tx_id = Column(Integer, nullable=False, default=0)
+    rows_scanned = Column(Integer, nullable=False, default=0)
+    users_checked = Column(Integer, nullable=False, default=0)
+    discrepancies = Column(Integer, nullable=False, default=0)
+
+
+# ===================== IDEMPOTENCY-KEY ===================== #
+
+class IdempotencyKey(Base):
+    """
+    Primera respuesta de cada petición con header Idempotency-Key.
+    Los reintentos con la misma llave se responden desde aquí sin volver a mover saldo.
+    """
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # Endpoint + dueño (ej: "wallet.withdraw:5"): la misma llave en otro endpoint es otra petición
+    scope = Column(String(120), nullable=False)
+    key = Column(String(255), nullable=False)
+    # sha256 del cuerpo: misma llave con otro cuerpo -> 422
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+
+    __table_args__ = (
+        UniqueConstraint("scope", "key", name="uq_idempotency_scope_key"),
+    )
+
+
+# ===================== OUTBOX (EVENTOS PENDIENTES) ===================== #
+
+class OutboxEvent(Base):
+    """
+    Trabajo pendiente escrito en la MISMA transacción que el cambio que lo origina
+    (ej: order.paid junto con la Order). Lo procesa app/core/outbox.py en segundo plano.
+    """
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    topic = Column(String(50), nullable=False)
+    aggregate_id = Column(Integer, nullable=True)   # ej: id de la orden
+    payload = Column(Text, nullable=True)           # JSON
+    # PENDING -> PROCESSING -> DONE | FAILED (agotó reintentos)
+    status = Column(String(20), nullable=False, default="PENDING")
+    attempts = Column(Integer, nullable=False, default=0)
+    # PENDING: próximo intento. PROCESSING: vencimiento del lease.
+    available_at = Column(DateTime(timezone=True), nullable=False)
+    locked_by = Column(String(64), nullable=True)   # worker que tiene el lease
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_outbox_status_available", status, available_at),
+    )
+
 
 # ===================== ORDERS (VENTAS) ===================== #
 
@@ -178,6 +324,39 @@ class Order(Base):
     status = Column(String(20), default="completed") 
     note = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    # Lo llena el worker del outbox cuando termina el fulfillment
+    fulfilled_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Listado paginado por cursor: por usuario o por estado, más recientes primero
+    __table_args__ = (
+        Index("ix_orders_user_created_id", user_id, created_at.desc(), id.desc()),
+        Index("ix_orders_status_created_id", status, created_at.desc(), id.desc()),
+        Index("ix_orders_created_id", created_at.desc(), id.desc()),
+    )
+
+    items = relationship("OrderItem", backref="order", lazy="select")
+
+
+class OrderItem(Base):
+    """
+    Línea de una orden (checkout de carrito). Precio y costo se copian del
+    producto al momento de la compra: cambios de precio posteriores no alteran ventas pasadas.
+    """
+    __tablename__ = "order_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=True)
+    product_name = Column(String(200), nullable=False)
+    quantity = Column(Integer, nullable=False, default=1)
+    unit_price = Column(Float, nullable=False)
+    unit_cost = Column(Float, nullable=False, default=0.0)
+    line_total = Column(Float, nullable=False)
+
+    # Ventas por producto: WHERE product_id = ? sin recorrer órdenes
+    __table_args__ = (
+        Index("ix_order_items_product_order", product_id, order_id),
+    )
 
 
 # ===================== PAYMENTS REPORT ===================== #
@@ -191,6 +370,9 @@ class PaymentReport(Base):
     method = Column(String(50), nullable=False)
     status = Column(String(20), default="PENDING")
     proof_url = Column(String(500), nullable=True)
+    # Derivados del comprobante (los genera el outbox en segundo plano)
+    proof_review_url = Column(String(500), nullable=True)   # copia comprimida para revisar
+    proof_thumb_url = Column(String(500), nullable=True)    # miniatura para el listado
     note = Column(Text, nullable=True)
 
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -201,6 +383,24 @@ class PaymentReport(Base):
     rejected_by = Column(Integer, ForeignKey("users.id"), nullable=True)
     rejected_at = Column(DateTime(timezone=True), nullable=True)
 
+    # Cola de admins: WHERE status = ? ORDER BY created_at DESC, id DESC (y por usuario)
+    __table_args__ = (
+        Index("ix_payment_reports_status_created_id", status, created_at.desc(), id.desc()),
+        Index("ix_payment_reports_user_created_id", user_id, created_at.desc(), id.desc()),
+        Index("ix_payment_reports_created_id", created_at.desc(), id.desc()),
+    )
+
+
+class PaymentStatusCount(Base):
+    """
+    Contador por estado de payment_reports, mantenido en cada cambio de estado
+    (misma transacción). /payments/stats lo lee sin COUNT(*) sobre la tabla.
+    """
+    __tablename__ = "payment_status_counts"
+
+    status = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
 
 # ===================== HELPERS ===================== #
 
@@ -0,0 +1,48 @@
+# scripts/backfill_activity_feed.py
+#
+# Llena activity_feed con los movimientos existentes (wallet, órdenes, reportes de pago)
+# que todavía no tienen su fila, y corrige las filas que quedaron desfasadas de su
+# origen (tipo, nota, monto o username). Idempotente: se puede correr las veces que haga falta.
+# INSERT ... SELECT + UPDATE ... FROM (la BD hace todo el trabajo).
+#
+# Uso:
+#   python scripts/backfill_activity_feed.py
+import sys
+from pathlib import Path
+
+def _add_project_root_to_path():
+    # Permite ejecutar el script desde /scripts sin errores de imports
+    root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(root))
+
+def _try_load_dotenv():
+    try:
+        from dotenv import load_dotenv  # type: ignore
+        load_dotenv()
+    except Exception:
+        pass
+
+def main():
+    _add_project_root_to_path()
+    _try_load_dotenv()
+
+    from app.core.database import SessionLocal, init_db
+    from app.core.activity import backfill_activity_feed, repair_activity_feed
+
+    # Asegura la tabla (e índices) antes de correr
+    init_db()
+
+    db = SessionLocal()
+    try:
+        rows = backfill_activity_feed(db)
+        fixed = repair_activity_feed(db)
+        print(f"✅ Feed de actividad: {rows} fila(s) agregada(s), {fixed} corregida(s).")
+    except Exception as e:
+        db.rollback()
+        print("❌ ERROR:", str(e))
+        sys.exit(1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
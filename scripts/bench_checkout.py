@@ -0,0 +1,139 @@
+# scripts/bench_checkout.py
+#
+# Benchmark de concurrencia del checkout (POST /orders).
+# Dispara N compras en paralelo contra UNA misma cuenta y reporta:
+#   throughput, latencias p50/p99, compras aceptadas/rechazadas y saldo final.
+# Verifica la regla clave: el saldo nunca queda negativo y
+#   saldo_final == saldo_inicial - compras_aceptadas * monto
+#
+# Uso:
+#   python scripts/bench_checkout.py                          -> en proceso (TestClient + BD de DATABASE_URL)
+#   python scripts/bench_checkout.py --url http://localhost:8000 --user-id 5
+#   Opciones: --requests 200 --concurrency 32 --amount 1 --balance 50
+import argparse
+import statistics
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+def _add_project_root_to_path():
+    # Permite ejecutar el script desde /scripts sin errores de imports
+    root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(root))
+
+def _try_load_dotenv():
+    try:
+        from dotenv import load_dotenv  # type: ignore
+        load_dotenv()
+    except Exception:
+        pass
+
+def _parse_args():
+    p = argparse.ArgumentParser(description="Compras concurrentes contra una misma wallet")
+    p.add_argument("--url", help="Servidor ya levantado (si no, se usa la app en proceso)")
+    p.add_argument("--user-id", type=int, help="Cuenta a usar (si no, se crea una de prueba)")
+    p.add_argument("--requests", type=int, default=200, help="Compras a disparar")
+    p.add_argument("--concurrency", type=int, default=32, help="Compras simultáneas")
+    p.add_argument("--amount", type=float, default=1.0, help="Monto de cada compra")
+    p.add_argument("--balance", type=float, default=50.0, help="Saldo a cargar antes de empezar")
+    return p.parse_args()
+
+def _client(args):
+    if args.url:
+        import httpx
+        return httpx.Client(base_url=args.url.rstrip("/"), timeout=30.0)
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+    client = TestClient(app)
+    client.__enter__()  # dispara el startup (init_db)
+    return client
+
+def _create_bench_user() -> int:
+    from app import models
+    from app.core.database import SessionLocal
+    from app.core.hierarchy import link_new_users
+
+    db = SessionLocal()
+    try:
+        name = f"bench_{uuid.uuid4().hex[:8]}"
+        user = models.User(
+            name=name, email=f"{name}@bench.local", username=name,
+            hashed_password="!", role="CLIENT", balance=0.0, is_active=True,
+        )
+        db.add(user)
+        db.flush()
+        link_new_users(db, [user.id])
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+def _balance(client, user_id: int) -> float:
+    r = client.get(f"/api/v1/wallet/balance/{user_id}")
+    r.raise_for_status()
+    return float(r.json()["balance"])
+
+def _percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+def main():
+    _add_project_root_to_path()
+    _try_load_dotenv()
+    args = _parse_args()
+
+    client = _client(args)
+    user_id = args.user_id
+    if user_id is None:
+        if args.url:
+            print("❌ ERROR: con --url hay que indicar --user-id")
+            sys.exit(1)
+        user_id = _create_bench_user()
+
+    if args.balance > 0:
+        client.post(f"/api/v1/wallet/{user_id}/add-funds", json={"amount": args.balance, "note": "Bench checkout"}).raise_for_status()
+    initial = _balance(client, user_id)
+
+    def buy(_):
+        started = time.perf_counter()
+        try:
+            r = client.post("/api/v1/orders", json={
+                "user_id": user_id, "total_amount": args.amount, "note": "bench",
+            })
+            code = r.status_code
+        except Exception:
+            code = -1
+        return code, time.perf_counter() - started
+
+    print(f"🚀 {args.requests} compras de {args.amount} con {args.concurrency} en paralelo (user #{user_id}, saldo {initial})")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(buy, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [lat * 1000 for _, lat in results]
+    ok = sum(1 for code, _ in results if code == 200)
+    rejected = sum(1 for code, _ in results if code == 400)
+    errors = len(results) - ok - rejected
+
+    final = _balance(client, user_id)
+    expected = round(initial - ok * args.amount, 2)
+
+    print(f"   Tiempo total:   {elapsed:.2f}s  ({len(results) / elapsed:.1f} req/s, {ok / elapsed:.1f} compras/s)")
+    print(f"   Latencia:       p50={statistics.median(latencies):.1f}ms  p99={_percentile(latencies, 99):.1f}ms  max={max(latencies):.1f}ms")
+    print(f"   Aceptadas:      {ok}   Saldo insuficiente: {rejected}   Errores: {errors}")
+    print(f"   Saldo final:    {final}  (esperado {expected})")
+
+    if final < 0 or abs(final - expected) > 0.005:
+        print("❌ El saldo final no cuadra con las compras aceptadas")
+        sys.exit(2)
+    print("✅ Saldo consistente: ninguna compra pasó sin fondos.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# scripts/reconcile_ledger.py
+#
+# Conciliación nocturna: users.balance vs historial de la wallet.
+# Incremental: solo suma los movimientos nuevos desde el último checkpoint.
+#
+# Uso (cron):
+#   python scripts/reconcile_ledger.py            -> usuarios con movimientos nuevos
+#   python scripts/reconcile_ledger.py --all      -> + usuarios sin actividad vs su checkpoint
+import sys
+from pathlib import Path
+
+def _add_project_root_to_path():
+    # Permite ejecutar el script desde /scripts sin errores de imports
+    root = Path(__file__).resolve().parents[1]
+    sys.path.insert(0, str(root))
+
+def _try_load_dotenv():
+    try:
+        from dotenv import load_dotenv  # type: ignore
+        load_dotenv()
+    except Exception:
+        pass
+
+def main():
+    _add_project_root_to_path()
+    _try_load_dotenv()
+
+    from app.core.database import SessionLocal, init_db
+    from app.core.reconciliation import reconcile_ledger, idle_discrepancies
+
+    # Asegura tablas/columnas nuevas (checkpoints) antes de correr
+    init_db()
+
+    db = SessionLocal()
+    try:
+        result = reconcile_ledger(db)
+        print(f"✅ Corrida #{result['run_id']}: {result['rows_scanned']} movimientos nuevos, "
+              f"{result['users_checked']} usuarios revisados.")
+
+        found = list(result["discrepancies"])
+        if "--all" in sys.argv[1:]:
+            found += idle_discrepancies(db)
+
+        if not found:
+            print("   Todo cuadra.")
+            return
+
+        print(f"⚠️ {len(found)} usuario(s) con diferencias:")
+        for d in found:
+            print(f"   user #{d['user_id']}: saldo={d['balance']} historial={d['ledger_sum']} diferencia={d['difference']}")
+        sys.exit(2)
+    except Exception as e:
+        print("❌ ERROR:", str(e))
+        sys.exit(1)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
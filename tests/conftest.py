@@ -0,0 +1,86 @@
+# Fixtures compartidas de la suite.
+#
+# La configuración (app/core/config.py) se lee al importar, así que el entorno se fija
+# ANTES de importar la app: SQLite temporal propio (nunca el test.db del repo), sin
+# worker del outbox y con las subidas en el directorio temporal.
+
+import itertools
+import os
+import shutil
+import tempfile
+
+_TMP_DIR = tempfile.mkdtemp(prefix="motostore-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_TMP_DIR}/test.db"
+os.environ["OUTBOX_WORKER_ENABLED"] = "false"
+os.environ["LOGIN_THROTTLE_BACKEND"] = "memory"
+os.environ["UPLOAD_DIR"] = os.path.join(_TMP_DIR, "uploads")
+os.environ.pop("ACCESS_TOKEN_EXPIRE_MINUTES", None)  # los tests verifican el valor por defecto
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import models  # noqa: E402
+from app.main import app  # noqa: E402
+from app.api.auth import create_access_token  # noqa: E402
+from app.core.database import SessionLocal  # noqa: E402
+from app.core.hierarchy import link_new_users  # noqa: E402
+from app.core.ledger import post_entry  # noqa: E402
+
+_user_seq = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def client():
+    # El context manager corre el lifespan de la app: arranque (init_db, handlers) y cierre
+    with TestClient(app) as test_client:
+        yield test_client
+    shutil.rmtree(_TMP_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def db(client):
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def make_user(db):
+    """
+    Crea un usuario directo en la BD (sin bcrypt: los tests entran con token) y lo
+    cuelga de la closure. El saldo inicial pasa por el ledger, como en producción.
+    """
+    def _make(role: str = "CLIENT", balance: float = 0.0, parent_id=None) -> models.User:
+        n = next(_user_seq)
+        user = models.User(
+            name=f"Test {n}",
+            email=f"user{n}@example.com",
+            username=f"user{n}",
+            hashed_password="!",
+            role=role,
+            is_superuser=role == "SUPERUSER",
+            balance=0.0,
+            is_active=True,
+            parent_id=parent_id,
+        )
+        db.add(user)
+        db.flush()
+        link_new_users(db, [user.id])
+        db.commit()
+        if balance:
+            post_entry(db, user.id, balance, "DEPOSIT", "Saldo inicial")
+        db.refresh(user)
+        return user
+
+    return _make
+
+
+@pytest.fixture
+def auth_headers():
+    def _headers(user: models.User) -> dict:
+        token = create_access_token({"sub": user.username, "id": user.id, "role": user.role})
+        return {"Authorization": f"Bearer {token}"}
+
+    return _headers
@@ -0,0 +1,95 @@
+# Feed de actividad (app/core/activity.py): cada movimiento de wallet tiene su fila en
+# activity_feed con el mismo tipo, nota y monto, también después de aprobar o rechazar
+# un retiro (el movimiento cambia en el lugar).
+
+from sqlalchemy import update
+
+from app import models
+from app.core.activity import SOURCE_WALLET, repair_activity_feed
+
+
+def _feed_vs_wallet(db, user_id):
+    """(feed, origen) de los movimientos de wallet del usuario, por id de movimiento.
+    El feed guarda el tipo en minúsculas (igual que _source_union)."""
+    db.expire_all()
+    feed = {
+        r.source_id: (r.type, r.note, r.amount, r.username)
+        for r in db.query(models.ActivityFeed).filter(
+            models.ActivityFeed.source == SOURCE_WALLET, models.ActivityFeed.user_id == user_id
+        )
+    }
+    username = db.get(models.User, user_id).username
+    wallet = {
+        t.id: (t.type.lower(), t.note, t.amount, username)
+        for t in db.query(models.WalletTransaction).filter(models.WalletTransaction.user_id == user_id)
+    }
+    return feed, wallet
+
+
+def _request_withdrawal(client, headers, amount):
+    r = client.post("/api/v1/wallet/withdraw", json={"amount": amount, "bank_info": "Banco 0102"}, headers=headers)
+    assert r.status_code == 200, r.text
+    history = client.get("/api/v1/wallet/me", headers=headers).json()["history"]
+    return next(tx["id"] for tx in history if tx["type"] == "WITHDRAW_REQUEST")
+
+
+def test_approve_updates_the_feed_row(client, make_user, auth_headers, db):
+    user, admin = make_user(balance=50.0), make_user(role="ADMIN")
+    tx_id = _request_withdrawal(client, auth_headers(user), 20.0)
+
+    r = client.post(f"/api/v1/withdrawals/{tx_id}/approve", headers=auth_headers(admin))
+
+    assert r.status_code == 200, r.text
+    feed, wallet = _feed_vs_wallet(db, user.id)
+    assert feed == wallet
+    assert feed[tx_id][0] == "withdraw"
+    assert f"APROBADO por {admin.username}" in feed[tx_id][1]
+
+
+def test_reject_updates_the_feed_row_and_records_the_refund(client, make_user, auth_headers, db):
+    user, admin = make_user(balance=50.0), make_user(role="ADMIN")
+    tx_id = _request_withdrawal(client, auth_headers(user), 20.0)
+
+    r = client.post(f"/api/v1/withdrawals/{tx_id}/reject", headers=auth_headers(admin))
+
+    assert r.status_code == 200, r.text
+    feed, wallet = _feed_vs_wallet(db, user.id)
+    assert feed == wallet
+    assert feed[tx_id][0] == "withdraw_rejected"
+    refunds = [row for row in feed.values() if row[0] == "refund"]
+    assert [row[2] for row in refunds] == [20.0]
+    assert db.get(models.User, user.id).balance == 50.0
+
+
+def test_second_decision_is_a_conflict(client, make_user, auth_headers, db):
+    user, admin = make_user(balance=50.0), make_user(role="ADMIN")
+    tx_id = _request_withdrawal(client, auth_headers(user), 20.0)
+    admin_headers = auth_headers(admin)
+
+    assert client.post(f"/api/v1/withdrawals/{tx_id}/approve", headers=admin_headers).status_code == 200
+    assert client.post(f"/api/v1/withdrawals/{tx_id}/reject", headers=admin_headers).status_code == 409
+    assert client.post(f"/api/v1/withdrawals/{tx_id}/approve", headers=admin_headers).status_code == 409
+
+    feed, wallet = _feed_vs_wallet(db, user.id)
+    assert feed == wallet
+    assert not any(row[0] == "refund" for row in feed.values())
+    assert db.get(models.User, user.id).balance == 30.0
+
+
+def test_repair_fixes_rows_that_drifted(client, make_user, auth_headers, db):
+    # Filas escritas antes de que el feed se actualizara en el lugar
+    user = make_user(balance=50.0)
+    tx_id = _request_withdrawal(client, auth_headers(user), 20.0)
+    db.execute(
+        update(models.WalletTransaction).where(models.WalletTransaction.id == tx_id)
+        .values(type="WITHDRAW", note="Retiro pagado (legacy)")
+    )
+    db.commit()
+    feed, wallet = _feed_vs_wallet(db, user.id)
+    assert feed[tx_id] != wallet[tx_id]
+
+    assert repair_activity_feed(db) >= 1
+
+    feed, wallet = _feed_vs_wallet(db, user.id)
+    assert feed == wallet
+    assert repair_activity_feed(db) == 0
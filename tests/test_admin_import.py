@@ -0,0 +1,137 @@
+# Importación masiva de usuarios (POST /admin/users/import): padres dentro del lote,
+# errores por fila y un único commit al final.
+
+import itertools
+import json
+
+import pytest
+
+from app import models
+from app.api import admin_users
+from app.core.database import SessionLocal
+from app.core.hierarchy import link_new_users
+
+_batch = itertools.count(1)
+
+
+def _rows(*specs):
+    """specs: (username, parent_username | None). Emails/usernames únicos por test."""
+    prefix = f"imp{next(_batch)}"
+    rows = []
+    for username, parent in specs:
+        row = {"name": username, "email": f"{prefix}_{username}@example.com",
+               "username": f"{prefix}_{username}", "password": "pw1234", "role": "CLIENT"}
+        if parent:
+            row["parent_username"] = f"{prefix}_{parent}"
+        rows.append(row)
+    return prefix, rows
+
+
+def _import(client, actor, rows, **params):
+    body = "\n".join(json.dumps(row) for row in rows)
+    return client.post(
+        "/api/v1/admin/users/import",
+        params={"actor_id": actor.id, "format": "ndjson", **params},
+        content=body.encode(),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+
+
+def _by_username(report, prefix):
+    return {r["username"].removeprefix(f"{prefix}_"): r for r in report["results"]}
+
+
+def test_parents_inside_the_batch_are_resolved(client, make_user, db):
+    admin = make_user(role="ADMIN")
+    # El hijo viene ANTES que su padre en el archivo
+    prefix, rows = _rows(("taquilla", "reseller"), ("reseller", "dist"), ("dist", None))
+
+    r = _import(client, admin, rows)
+
+    assert r.status_code == 200, r.text
+    report = r.json()
+    assert (report["created"], report["failed"]) == (3, 0)
+    result = _by_username(report, prefix)
+    assert result["reseller"]["parent_id"] == result["dist"]["id"]
+    assert result["taquilla"]["parent_id"] == result["reseller"]["id"]
+    closure = db.query(models.UserClosure).filter(
+        models.UserClosure.ancestor_id == result["dist"]["id"],
+        models.UserClosure.descendant_id == result["taquilla"]["id"],
+    ).one()
+    assert closure.depth == 2
+
+
+def test_circular_parents_are_reported(client, make_user):
+    admin = make_user(role="ADMIN")
+    prefix, rows = _rows(("a", "b"), ("b", "a"), ("ok", None))
+
+    report = _import(client, admin, rows).json()
+
+    result = _by_username(report, prefix)
+    assert result["ok"]["status"] == "CREATED"
+    for name in ("a", "b"):
+        assert result[name]["status"] == "ERROR"
+        assert result[name]["error"] == "Referencia circular entre padres"
+
+
+def test_duplicate_usernames_are_rejected(client, make_user):
+    admin = make_user(role="ADMIN")
+    existing = make_user()
+    prefix, rows = _rows(("uno", None), ("dos", None))
+    rows.append({**rows[0], "email": f"{prefix}_otro@example.com"})  # repetido en el archivo
+    rows.append({**rows[1], "email": f"{prefix}_x@example.com", "username": existing.username})  # ya existe
+
+    report = _import(client, admin, rows).json()
+
+    errors = [r["error"] for r in report["results"] if r["status"] == "ERROR"]
+    assert report["created"] == 2
+    assert errors == ["Username duplicado en el archivo (fila 1)", "El username ya está en uso"]
+
+
+def test_conflict_at_insert_time_only_fails_that_chunk(client, make_user, db, monkeypatch):
+    # Otro alta con el mismo email entre la validación y el INSERT
+    admin = make_user(role="ADMIN")
+    prefix, rows = _rows(("padre", None), ("hijo", "padre"), ("suelto", None))
+    monkeypatch.setattr(admin_users, "IMPORT_CHUNK_SIZE", 1)
+    plan = admin_users._plan_import
+
+    def plan_then_race(*args):
+        planned = plan(*args)
+        other = SessionLocal()
+        racer = models.User(name="x", email=rows[0]["email"], username=f"{prefix}_carrera",
+                            hashed_password="!", role="CLIENT")
+        other.add(racer)
+        other.flush()
+        link_new_users(other, [racer.id])
+        other.commit()
+        other.close()
+        return planned
+
+    monkeypatch.setattr(admin_users, "_plan_import", plan_then_race)
+
+    result = _by_username(_import(client, admin, rows).json(), prefix)
+
+    assert result["padre"]["error"] == "Conflicto de email/username al insertar"
+    assert result["hijo"]["error"] == "El padre no se pudo crear"
+    assert result["suelto"]["status"] == "CREATED"
+    assert db.get(models.User, result["suelto"]["id"]) is not None
+
+
+def test_failure_after_a_chunk_leaves_nothing_behind(client, make_user, db, monkeypatch):
+    admin = make_user(role="ADMIN")
+    prefix, rows = _rows(("uno", None), ("dos", None), ("tres", None))
+    monkeypatch.setattr(admin_users, "IMPORT_CHUNK_SIZE", 1)
+    calls = itertools.count(1)
+    link = admin_users.link_new_users
+
+    def link_then_crash(session, ids):
+        if next(calls) == 2:
+            raise RuntimeError("caída a mitad de la importación")
+        link(session, ids)
+
+    monkeypatch.setattr(admin_users, "link_new_users", link_then_crash)
+
+    with pytest.raises(RuntimeError):
+        _import(client, admin, rows)
+
+    assert db.query(models.User).filter(models.User.username.like(f"{prefix}_%")).count() == 0
@@ -0,0 +1,32 @@
+# Autenticación: vida del token de acceso y guards por rol (app/api/auth.py).
+
+from datetime import datetime
+
+from jose import jwt
+
+from app import models
+from app.api.auth import ALGORITHM, SECRET_KEY, create_access_token
+from app.core.cache import invalidate_user
+from app.core.config import get_settings
+
+
+def test_access_token_lifetime_comes_from_settings():
+    minutes = get_settings().ACCESS_TOKEN_EXPIRE_MINUTES
+    before = datetime.utcnow().timestamp()
+
+    claims = jwt.decode(create_access_token({"id": 1}), SECRET_KEY, algorithms=[ALGORITHM])
+
+    assert minutes == 30
+    assert abs(claims["exp"] - (before + minutes * 60)) < 5
+
+
+def test_demoted_admin_loses_access_with_a_live_token(client, make_user, auth_headers, db):
+    admin = make_user(role="ADMIN")
+    headers = auth_headers(admin)
+    assert client.get("/api/v1/withdrawals/pending", headers=headers).status_code == 200
+
+    db.get(models.User, admin.id).role = "CLIENT"
+    db.commit()
+    invalidate_user(admin.id)
+
+    assert client.get("/api/v1/withdrawals/pending", headers=headers).status_code == 403
@@ -0,0 +1,50 @@
+# Acreditación masiva (POST /wallet/add-funds/batch): un UPDATE + un INSERT, todo o nada.
+
+from app import models
+
+
+def _batch(client, headers, credits):
+    return client.post("/api/v1/wallet/add-funds/batch", json={"credits": credits}, headers=headers)
+
+
+def test_batch_credits_every_user_with_running_balances(client, make_user, auth_headers, db):
+    admin, ana, beto = make_user(role="ADMIN"), make_user(balance=10.0), make_user()
+
+    r = _batch(client, auth_headers(admin), [
+        {"userId": ana.id, "amount": 5.0, "note": "Promo"},
+        {"userId": beto.id, "amount": 7.5},
+        {"userId": ana.id, "amount": 2.5, "note": "Comisión"},  # repetido: se suma
+    ])
+
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert (body["credited"], body["total"]) == (3, 15.0)
+    assert {b["userId"]: b["balance"] for b in body["balances"]} == {ana.id: 17.5, beto.id: 7.5}
+    db.expire_all()
+    assert db.get(models.User, ana.id).balance == 17.5
+    history = (
+        db.query(models.WalletTransaction)
+        .filter(models.WalletTransaction.user_id == ana.id, models.WalletTransaction.note != "Saldo inicial")
+        .order_by(models.WalletTransaction.id)
+        .all()
+    )
+    assert [(tx.amount, tx.balance_after, tx.note) for tx in history] == [(5.0, 15.0, "Promo"), (2.5, 17.5, "Comisión")]
+
+
+def test_unknown_user_rolls_back_the_whole_batch(client, make_user, auth_headers, db):
+    admin, user = make_user(role="ADMIN"), make_user()
+
+    r = _batch(client, auth_headers(admin), [{"userId": user.id, "amount": 5.0}, {"userId": 999999, "amount": 1.0}])
+
+    assert r.status_code == 404
+    db.expire_all()
+    assert db.get(models.User, user.id).balance == 0.0
+    assert db.query(models.WalletTransaction).filter_by(user_id=user.id).count() == 0
+
+
+def test_batch_rejects_non_positive_amounts_and_non_admins(client, make_user, auth_headers):
+    admin, user = make_user(role="ADMIN"), make_user()
+
+    assert _batch(client, auth_headers(admin), [{"userId": user.id, "amount": 0}]).status_code == 400
+    assert _batch(client, auth_headers(admin), []).status_code == 400
+    assert _batch(client, auth_headers(user), [{"userId": user.id, "amount": 5.0}]).status_code == 403
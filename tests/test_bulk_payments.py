@@ -0,0 +1,60 @@
+# Aprobación / rechazo masivo de reportes de pago (POST /payments/bulk): solo se toman
+# los PENDING y los depósitos van en un solo lote (ledger.post_batch).
+
+from app import models
+
+
+def _report(client, headers, amount):
+    r = client.post("/api/v1/payments", data={"method": "USD", "amount": str(amount)}, headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+def _bulk(client, headers, ids, decision):
+    r = client.post("/api/v1/payments/bulk", json={"ids": ids, "decision": decision}, headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def test_bulk_approve_credits_each_user_once(client, make_user, auth_headers, db):
+    admin, ana, beto = make_user(role="ADMIN"), make_user(), make_user()
+    first, second = _report(client, auth_headers(ana), 10.0), _report(client, auth_headers(ana), 5.0)
+    third = _report(client, auth_headers(beto), 20.0)
+
+    body = _bulk(client, auth_headers(admin), [first, second, third, first], "APPROVE")
+
+    assert (body["processed"], body["skipped"]) == (3, 0)
+    assert [(r["id"], r["status"], r["credited_usd"]) for r in body["results"]] == [
+        (first, "APPROVED", 10.0), (second, "APPROVED", 5.0), (third, "APPROVED", 20.0),
+    ]
+    db.expire_all()
+    assert (db.get(models.User, ana.id).balance, db.get(models.User, beto.id).balance) == (15.0, 20.0)
+    deposits = db.query(models.WalletTransaction).filter_by(user_id=ana.id, type="DEPOSIT").order_by(models.WalletTransaction.id).all()
+    assert [(tx.amount, tx.balance_after, tx.note) for tx in deposits] == [
+        (10.0, 10.0, f"Recarga Aprobada (#{first})"), (5.0, 15.0, f"Recarga Aprobada (#{second})"),
+    ]
+    assert {db.get(models.PaymentReport, i).approved_by for i in (first, second, third)} == {admin.id}
+
+
+def test_bulk_skips_processed_and_unknown_reports(client, make_user, auth_headers, db):
+    admin, user = make_user(role="ADMIN"), make_user()
+    headers = auth_headers(admin)
+    done, pending = _report(client, auth_headers(user), 8.0), _report(client, auth_headers(user), 3.0)
+    _bulk(client, headers, [done], "REJECT")
+
+    body = _bulk(client, headers, [done, pending, 999999], "APPROVE")
+
+    assert (body["processed"], body["skipped"]) == (1, 2)
+    assert [(r["id"], r["status"]) for r in body["results"]] == [
+        (done, "ALREADY_PROCESSED"), (pending, "APPROVED"), (999999, "NOT_FOUND"),
+    ]
+    assert body["results"][0]["detail"] == "Estado actual: REJECTED"
+    db.expire_all()
+    assert db.get(models.User, user.id).balance == 3.0  # el rechazado no acredita
+
+
+def test_bulk_decision_requires_an_admin(client, make_user, auth_headers):
+    user = make_user()
+    report_id = _report(client, auth_headers(user), 1.0)
+    r = client.post("/api/v1/payments/bulk", json={"ids": [report_id], "decision": "APPROVE"}, headers=auth_headers(user))
+    assert r.status_code == 403
@@ -0,0 +1,62 @@
+# Checkout de carrito (POST /orders/checkout): precios de la BD, líneas OrderItem y un
+# solo descuento de la wallet.
+
+from app import models
+
+
+def _product(db, price, cost=None, active=True):
+    product = models.Product(name=f"Producto {price}", price=price, cost=cost, active=active)
+    db.add(product)
+    db.commit()
+    return product
+
+
+def _checkout(client, user, items):
+    return client.post("/api/v1/orders/checkout", json={"user_id": user.id, "items": items})
+
+
+def test_checkout_prices_lines_and_charges_once(client, make_user, db):
+    user = make_user(balance=100.0)
+    pantalla, bateria = _product(db, 12.5, cost=8.0), _product(db, 4.25)
+
+    r = _checkout(client, user, [
+        {"product_id": pantalla.id, "quantity": 2},
+        {"product_id": bateria.id, "quantity": 1},
+        {"product_id": pantalla.id, "quantity": 1},  # misma línea: se suma
+    ])
+
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert (body["total_amount"], body["cost_amount"]) == (41.75, 24.0)
+    items = db.query(models.OrderItem).filter_by(order_id=body["id"]).order_by(models.OrderItem.product_id).all()
+    assert [(i.product_id, i.quantity, i.unit_price, i.unit_cost, i.line_total) for i in items] == [
+        (pantalla.id, 3, 12.5, 8.0, 37.5),
+        (bateria.id, 1, 4.25, 0.0, 4.25),
+    ]
+    purchases = db.query(models.WalletTransaction).filter_by(user_id=user.id, type="PURCHASE").all()
+    assert [tx.amount for tx in purchases] == [-41.75]
+    db.expire_all()
+    assert db.get(models.User, user.id).balance == 58.25
+
+
+def test_inactive_product_is_rejected(client, make_user, db):
+    user = make_user(balance=100.0)
+    retirado = _product(db, 5.0, active=False)
+
+    r = _checkout(client, user, [{"product_id": retirado.id, "quantity": 1}])
+
+    assert r.status_code == 400
+    assert str(retirado.id) in r.json()["detail"]
+    assert db.query(models.Order).filter_by(user_id=user.id).count() == 0
+
+
+def test_insufficient_balance_creates_nothing(client, make_user, db):
+    user = make_user(balance=10.0)
+    caro = _product(db, 30.0)
+
+    r = _checkout(client, user, [{"product_id": caro.id, "quantity": 1}])
+
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Saldo insuficiente en la wallet"
+    assert db.query(models.Order).filter_by(user_id=user.id).count() == 0
+    assert db.query(models.OrderItem).join(models.Order).filter(models.Order.user_id == user.id).count() == 0
@@ -0,0 +1,81 @@
+# Exportación CSV / NDJSON de transacciones (GET /transactions/export).
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import update
+
+from app import models
+from app.api.transactions import EXPORT_COLUMNS
+from app.core.ledger import post_entry
+
+STAMPS = [
+    datetime(2026, 9, 30, 23, 59, 59),
+    datetime(2026, 10, 1, 0, 0, 0),  # justo en el corte: pertenece a octubre
+    datetime(2026, 10, 15, 12, 0, 0),
+]
+
+
+def _stamped_movements(db, user):
+    """Un depósito por fecha de STAMPS (las filas del feed con esa created_at)."""
+    for stamp in STAMPS:
+        _, tx = post_entry(db, user.id, 10.0, "DEPOSIT", f"Depósito {stamp:%Y-%m-%d %H:%M}")
+        db.execute(
+            update(models.ActivityFeed)
+            .where(models.ActivityFeed.source == "wallet", models.ActivityFeed.source_id == tx.id)
+            .values(created_at=stamp)
+        )
+    db.commit()
+
+
+def _export(client, headers, **params):
+    r = client.get("/api/v1/transactions/export", params=params, headers=headers)
+    assert r.status_code == 200, r.text
+    return r
+
+
+def test_csv_export_has_header_rows_and_filters(client, make_user, auth_headers, db):
+    admin, user = make_user(role="ADMIN"), make_user()
+    _stamped_movements(db, user)
+
+    r = _export(client, auth_headers(admin), user_id=user.id, source="wallet", format="csv")
+
+    assert r.headers["content-type"].startswith("text/csv")
+    assert "attachment" in r.headers["content-disposition"]
+    reader = csv.DictReader(io.StringIO(r.text))
+    rows = list(reader)
+    assert reader.fieldnames == EXPORT_COLUMNS
+    assert len(rows) == 3
+    assert {row["user_id"] for row in rows} == {str(user.id)}
+    assert [row["created_at"][:10] for row in rows] == ["2026-09-30", "2026-10-01", "2026-10-15"]
+
+
+def test_date_to_is_exclusive(client, make_user, auth_headers, db):
+    admin, user = make_user(role="ADMIN"), make_user()
+    _stamped_movements(db, user)
+    headers = auth_headers(admin)
+
+    september = _export(client, headers, user_id=user.id, date_from="2026-09-01T00:00:00", date_to="2026-10-01T00:00:00")
+    october = _export(client, headers, user_id=user.id, date_from="2026-10-01T00:00:00", date_to="2026-11-01T00:00:00")
+
+    assert len(list(csv.DictReader(io.StringIO(september.text)))) == 1
+    assert len(list(csv.DictReader(io.StringIO(october.text)))) == 2
+
+
+def test_ndjson_export_and_source_filter(client, make_user, auth_headers, db):
+    admin, user = make_user(role="ADMIN"), make_user(balance=50.0)
+    client.post("/api/v1/orders", json={"user_id": user.id, "total_amount": 5.0})
+    headers = auth_headers(admin)
+
+    everything = [json.loads(line) for line in _export(client, headers, user_id=user.id, format="ndjson").text.splitlines()]
+    orders = [json.loads(line) for line in _export(client, headers, user_id=user.id, source="order", format="ndjson").text.splitlines()]
+
+    assert sorted(row["source"] for row in everything) == ["order", "wallet", "wallet"]
+    assert [(row["source"], row["amount"]) for row in orders] == [("order", 5.0)]
+    assert set(orders[0]) == set(EXPORT_COLUMNS)
+
+
+def test_export_requires_an_admin(client, make_user, auth_headers):
+    assert client.get("/api/v1/transactions/export", headers=auth_headers(make_user())).status_code == 403
@@ -0,0 +1,96 @@
+# Closure table de la jerarquía (app/core/hierarchy.py): después de mover un subárbol
+# user_closure sigue siendo exactamente la clausura de users.parent_id.
+
+from typing import Dict, Optional, Set, Tuple
+
+from app import models
+
+
+def _closure(db) -> Set[Tuple[int, int, int]]:
+    db.expire_all()
+    return {(r.ancestor_id, r.descendant_id, r.depth) for r in db.query(models.UserClosure).all()}
+
+
+def _expected_closure(db) -> Set[Tuple[int, int, int]]:
+    """La clausura calculada a mano desde parent_id (todos los usuarios de la BD)."""
+    parents: Dict[int, Optional[int]] = dict(db.query(models.User.id, models.User.parent_id).all())
+    pairs = set()
+    for user_id in parents:
+        node, depth = user_id, 0
+        while node is not None:
+            pairs.add((node, user_id, depth))
+            node, depth = parents[node], depth + 1
+    return pairs
+
+
+def _move(client, actor, user, parent_id):
+    return client.put(
+        f"/api/v1/admin/users/{user.id}", params={"actor_id": actor.id}, json={"parent_id": parent_id}
+    )
+
+
+def test_reparent_moves_the_whole_subtree(client, make_user, db):
+    admin = make_user(role="ADMIN")
+    dist_a = make_user(role="DISTRIBUTOR")
+    dist_b = make_user(role="DISTRIBUTOR")
+    reseller = make_user(role="RESELLER", parent_id=dist_a.id)
+    taquilla = make_user(role="TAQUILLA", parent_id=reseller.id)
+    cliente = make_user(role="CLIENT", parent_id=taquilla.id)
+    assert _closure(db) == _expected_closure(db)
+
+    r = _move(client, admin, reseller, dist_b.id)
+
+    assert r.status_code == 200, r.text
+    closure = _closure(db)
+    assert closure == _expected_closure(db)
+    assert (dist_b.id, cliente.id, 3) in closure
+    assert not any(anc == dist_a.id and desc != dist_a.id for anc, desc, _ in closure)
+
+
+def test_reparent_to_root_and_back(client, make_user, db):
+    admin = make_user(role="ADMIN")
+    dist = make_user(role="DISTRIBUTOR")
+    reseller = make_user(role="RESELLER", parent_id=dist.id)
+    make_user(role="CLIENT", parent_id=reseller.id)
+
+    assert _move(client, admin, reseller, None).status_code == 200
+    assert _closure(db) == _expected_closure(db)
+
+    assert _move(client, admin, reseller, dist.id).status_code == 200
+    assert _closure(db) == _expected_closure(db)
+
+
+def test_reparent_under_own_descendant_is_rejected(client, make_user, db):
+    admin = make_user(role="ADMIN")
+    dist = make_user(role="DISTRIBUTOR")
+    reseller = make_user(role="RESELLER", parent_id=dist.id)
+    taquilla = make_user(role="TAQUILLA", parent_id=reseller.id)
+    before = _closure(db)
+
+    r = _move(client, admin, dist, taquilla.id)
+
+    assert r.status_code == 400
+    assert _closure(db) == before
+    db.refresh(dist)
+    assert dist.parent_id is None
+
+
+def test_network_totals_follow_the_move(client, make_user, auth_headers, db):
+    admin = make_user(role="ADMIN")
+    dist_a = make_user(role="DISTRIBUTOR")
+    dist_b = make_user(role="DISTRIBUTOR")
+    reseller = make_user(role="RESELLER", balance=10.0, parent_id=dist_a.id)
+    make_user(role="CLIENT", balance=5.0, parent_id=reseller.id)
+    headers = auth_headers(admin)
+
+    def network(root):
+        r = client.get("/api/v1/reports/network", params={"user_id": root.id}, headers=headers)
+        assert r.status_code == 200, r.text
+        return r.json()
+
+    assert (network(dist_a)["users"], network(dist_a)["balance"]) == (3, 15.0)
+
+    assert _move(client, admin, reseller, dist_b.id).status_code == 200
+
+    assert (network(dist_a)["users"], network(dist_a)["balance"]) == (1, 0.0)
+    assert (network(dist_b)["users"], network(dist_b)["balance"]) == (3, 15.0)
@@ -0,0 +1,78 @@
+# Idempotency-Key (app/core/idempotency.py): un reintento con la misma llave
+# devuelve la respuesta original sin mover dinero otra vez.
+
+from app import models
+from app.core.ledger import post_entry
+
+
+def _wallet_rows(db, user_id, tx_type):
+    return db.query(models.WalletTransaction).filter(
+        models.WalletTransaction.user_id == user_id, models.WalletTransaction.type == tx_type
+    ).count()
+
+
+def test_withdraw_replay_returns_original_response(client, make_user, auth_headers, db):
+    user = make_user(balance=100.0)
+    headers = {**auth_headers(user), "Idempotency-Key": "retiro-1"}
+    payload = {"amount": 30.0, "bank_info": "Banco 0102"}
+
+    first = client.post("/api/v1/wallet/withdraw", json=payload, headers=headers)
+    replay = client.post("/api/v1/wallet/withdraw", json=payload, headers=headers)
+
+    assert first.status_code == replay.status_code == 200
+    assert replay.json() == first.json() == {"message": "Retiro solicitado correctamente", "new_balance": 70.0}
+    db.expire_all()
+    assert db.get(models.User, user.id).balance == 70.0
+    assert _wallet_rows(db, user.id, "WITHDRAW_REQUEST") == 1
+
+
+def test_same_key_with_other_payload_is_rejected(client, make_user, auth_headers, db):
+    user = make_user(balance=100.0)
+    headers = {**auth_headers(user), "Idempotency-Key": "retiro-2"}
+
+    assert client.post("/api/v1/wallet/withdraw", json={"amount": 10.0, "bank_info": "X"}, headers=headers).status_code == 200
+    r = client.post("/api/v1/wallet/withdraw", json={"amount": 50.0, "bank_info": "X"}, headers=headers)
+
+    assert r.status_code == 422
+    db.expire_all()
+    assert db.get(models.User, user.id).balance == 90.0
+
+
+def test_keys_are_scoped_per_user(client, make_user, auth_headers, db):
+    alice, bob = make_user(balance=40.0), make_user(balance=40.0)
+    payload = {"amount": 15.0, "bank_info": "X"}
+
+    for user in (alice, bob):
+        r = client.post("/api/v1/wallet/withdraw", json=payload, headers={**auth_headers(user), "Idempotency-Key": "misma"})
+        assert r.json()["new_balance"] == 25.0
+
+    assert _wallet_rows(db, alice.id, "WITHDRAW_REQUEST") == _wallet_rows(db, bob.id, "WITHDRAW_REQUEST") == 1
+
+
+def test_order_replay_does_not_charge_twice(client, make_user, db):
+    user = make_user(balance=50.0)
+    headers = {"Idempotency-Key": "orden-1"}
+    payload = {"user_id": user.id, "total_amount": 20.0, "note": "Casco"}
+
+    first = client.post("/api/v1/orders", json=payload, headers=headers)
+    replay = client.post("/api/v1/orders", json=payload, headers=headers)
+
+    assert first.status_code == replay.status_code == 200
+    assert replay.json()["id"] == first.json()["id"]
+    db.expire_all()
+    assert db.query(models.Order).filter(models.Order.user_id == user.id).count() == 1
+    assert db.get(models.User, user.id).balance == 30.0
+
+
+def test_failed_request_releases_the_key(client, make_user, auth_headers, db):
+    # El 400 hace rollback también de la llave: el cliente puede reintentar con saldo
+    user = make_user(balance=5.0)
+    headers = {**auth_headers(user), "Idempotency-Key": "retiro-3"}
+    payload = {"amount": 20.0, "bank_info": "X"}
+
+    assert client.post("/api/v1/wallet/withdraw", json=payload, headers=headers).status_code == 400
+    post_entry(db, user.id, 20.0, "DEPOSIT", "Recarga")
+    r = client.post("/api/v1/wallet/withdraw", json=payload, headers=headers)
+
+    assert r.status_code == 200
+    assert r.json()["new_balance"] == 5.0
@@ -0,0 +1,78 @@
+# Motor de asientos (app/core/ledger.py): el UPDATE condicionado no deja el saldo
+# negativo aunque muchas compras lleguen a la vez.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from sqlalchemy import func
+
+from app import models
+from app.core.database import SessionLocal
+from app.core.ledger import post_entry
+
+
+def test_concurrent_debits_never_overdraw(make_user, db):
+    user = make_user(balance=50.0)
+    user_id = user.id
+    attempts = 10
+    barrier = threading.Barrier(attempts)
+
+    def spend() -> bool:
+        session = SessionLocal()
+        try:
+            barrier.wait()
+            post_entry(session, user_id, -10.0, "PURCHASE", "Compra concurrente")
+            return True
+        except HTTPException as exc:
+            assert exc.status_code == 400
+            return False
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(max_workers=attempts) as pool:
+        results = list(pool.map(lambda _: spend(), range(attempts)))
+
+    assert results.count(True) == 5
+
+    db.expire_all()
+    assert db.get(models.User, user_id).balance == 0.0
+    purchases = (
+        db.query(func.count(), func.min(models.WalletTransaction.balance_after))
+        .filter(models.WalletTransaction.user_id == user_id, models.WalletTransaction.type == "PURCHASE")
+        .one()
+    )
+    assert purchases == (5, 0.0)
+
+
+def test_running_balance_matches_history(make_user, db):
+    user = make_user(balance=20.0)
+    post_entry(db, user.id, -5.0, "PURCHASE", "A")
+    post_entry(db, user.id, 7.5, "DEPOSIT", "B")
+
+    rows = (
+        db.query(models.WalletTransaction)
+        .filter(models.WalletTransaction.user_id == user.id)
+        .order_by(models.WalletTransaction.id)
+        .all()
+    )
+    running = 0.0
+    for tx in rows:
+        running += tx.amount
+        assert tx.balance_after == running
+    db.refresh(user)
+    assert user.balance == running == 22.5
+
+
+def test_order_over_balance_is_rejected_without_side_effects(client, make_user, db):
+    user = make_user(balance=10.0)
+
+    r = client.post("/api/v1/orders", json={"user_id": user.id, "total_amount": 25.0})
+    assert r.status_code == 400
+
+    db.expire_all()
+    assert db.get(models.User, user.id).balance == 10.0
+    assert db.query(models.Order).filter(models.Order.user_id == user.id).count() == 0
+    assert db.query(models.WalletTransaction).filter(
+        models.WalletTransaction.user_id == user.id, models.WalletTransaction.type == "PURCHASE"
+    ).count() == 0
@@ -0,0 +1,8 @@
+# Arranque de la app (lifespan en app/main.py): los handlers del outbox quedan registrados.
+
+from app.core import fulfillment, images, outbox
+
+
+def test_startup_registers_the_outbox_handlers(client):
+    assert outbox._handlers["order.paid"] is fulfillment.fulfill_paid_order
+    assert outbox._handlers["payment.proof_uploaded"] is images.build_proof_derivatives
@@ -0,0 +1,155 @@
+# Paginación keyset (app/core/pagination.py): recorrer las páginas devuelve cada fila
+# una sola vez, en orden (created_at desc, id desc), aunque lleguen filas nuevas.
+
+from contextlib import contextmanager
+
+from sqlalchemy import event, text
+
+from app.core.database import engine, ensure_sqlite_timestamps
+from app.core.ledger import post_entry
+
+
+def _deposits(db, user, count):
+    for i in range(count):
+        post_entry(db, user.id, 1.0 + i, "DEPOSIT", f"Depósito {i}")
+
+
+def _walk_wallet(client, headers, limit):
+    ids, cursor = [], None
+    while True:
+        params = {"limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        r = client.get("/api/v1/wallet/me", params=params, headers=headers)
+        assert r.status_code == 200, r.text
+        body = r.json()
+        ids.extend(tx["id"] for tx in body["history"])
+        cursor = body["next_cursor"]
+        if not cursor:
+            return ids
+
+
+def test_wallet_history_pages_cover_every_row_once(client, make_user, auth_headers, db):
+    # Todas en el mismo segundo: el desempate por id es lo que mantiene el orden
+    user = make_user()
+    _deposits(db, user, 7)
+
+    ids = _walk_wallet(client, auth_headers(user), limit=3)
+
+    assert len(ids) == 7
+    assert ids == sorted(ids, reverse=True)
+
+
+def test_cursor_is_stable_when_rows_arrive_between_pages(client, make_user, auth_headers, db):
+    user = make_user()
+    headers = auth_headers(user)
+    _deposits(db, user, 5)
+
+    first = client.get("/api/v1/wallet/me", params={"limit": 2}, headers=headers).json()
+    post_entry(db, user.id, 99.0, "DEPOSIT", "Llega entre páginas")
+    rest = client.get(
+        "/api/v1/wallet/me", params={"limit": 50, "cursor": first["next_cursor"]}, headers=headers
+    ).json()
+
+    seen = [tx["id"] for tx in first["history"] + rest["history"]]
+    assert len(seen) == len(set(seen)) == 5
+    assert rest["next_cursor"] is None
+
+
+def test_transactions_cursor_travels_in_header(client, make_user, auth_headers, db):
+    user = make_user()
+    headers = auth_headers(user)
+    _deposits(db, user, 5)
+
+    ids, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        r = client.get("/api/v1/transactions", params=params, headers=headers)
+        assert r.status_code == 200, r.text
+        ids.extend(row["id"] for row in r.json())
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert len(ids) == len(set(ids)) == 5
+
+
+def test_invalid_cursor_is_rejected(client, make_user, auth_headers):
+    user = make_user()
+    r = client.get("/api/v1/wallet/me", params={"cursor": "no-es-un-cursor"}, headers=auth_headers(user))
+    assert r.status_code == 400
+
+
+@contextmanager
+def _captured_selects(table):
+    """SQL + parámetros de los SELECT paginados sobre `table` que corran dentro del bloque."""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith("SELECT") and f"FROM {table}" in statement and "ORDER BY" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+
+def _query_plan(statement, parameters):
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+    return " | ".join(row[-1] for row in rows)
+
+
+def test_deep_pages_use_the_index(client, make_user, auth_headers, db):
+    user = make_user()
+    headers = auth_headers(user)
+    _deposits(db, user, 5)
+    cursor = client.get("/api/v1/wallet/me", params={"limit": 2}, headers=headers).json()["next_cursor"]
+
+    with _captured_selects("wallet_transactions") as statements:
+        r = client.get("/api/v1/wallet/me", params={"limit": 2, "cursor": cursor}, headers=headers)
+    assert r.status_code == 200
+
+    plan = _query_plan(*statements[-1])
+    assert "USING INDEX ix_wallet_tx_user_created_id" in plan or "USING COVERING INDEX ix_wallet_tx_user_created_id" in plan
+    assert "created_at<?" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_feed_pages_use_the_index(client, make_user, auth_headers, db):
+    user = make_user()
+    headers = auth_headers(user)
+    _deposits(db, user, 3)
+    cursor = client.get("/api/v1/transactions", params={"limit": 1}, headers=headers).headers["X-Next-Cursor"]
+
+    with _captured_selects("activity_feed") as statements:
+        client.get("/api/v1/transactions", params={"limit": 1, "cursor": cursor}, headers=headers)
+
+    plan = _query_plan(*statements[-1])
+    assert "ix_activity_feed_user_created_id" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_every_timestamp_shares_one_text_format(make_user, db):
+    # Filas de server_default (now()) y de datetime de Python: mismo largo -> orden de texto correcto
+    user = make_user()
+    post_entry(db, user.id, 1.0, "DEPOSIT", "server_default")
+    stored = db.execute(text(
+        "SELECT DISTINCT length(created_at) FROM wallet_transactions UNION "
+        "SELECT DISTINCT length(created_at) FROM activity_feed"
+    )).scalars().all()
+    assert stored == [26]
+
+
+def test_legacy_timestamps_are_normalized(make_user, db):
+    user = make_user()
+    _, tx = post_entry(db, user.id, 1.0, "DEPOSIT", "Fila vieja")
+    db.execute(text("UPDATE wallet_transactions SET created_at = '2025-01-02 03:04:05' WHERE id = :id"), {"id": tx.id})
+    db.commit()
+
+    ensure_sqlite_timestamps()
+
+    value = db.execute(text("SELECT created_at FROM wallet_transactions WHERE id = :id"), {"id": tx.id}).scalar()
+    assert value == "2025-01-02 03:04:05.000000"
@@ -0,0 +1,54 @@
+# Contadores por estado de los reportes de pago (GET /payments/stats) y su reparación
+# (POST /payments/stats/rebuild, solo admin).
+
+from sqlalchemy import func, update
+
+from app import models
+
+
+def _stats(client, headers):
+    r = client.get("/api/v1/payments/stats", headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()["counts"]
+
+
+def _report(client, headers):
+    r = client.post("/api/v1/payments", data={"method": "USD", "amount": "4"}, headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+def _actual_counts(db):
+    rows = db.query(models.PaymentReport.status, func.count(models.PaymentReport.id)).group_by(models.PaymentReport.status)
+    return {"PENDING": 0, "APPROVED": 0, "REJECTED": 0, **dict(rows.all())}
+
+
+def test_counters_follow_each_status_change(client, make_user, auth_headers):
+    admin, user = make_user(role="ADMIN"), make_user()
+    headers, user_headers = auth_headers(admin), auth_headers(user)
+    before = _stats(client, headers)
+
+    approved, rejected, _ = _report(client, user_headers), _report(client, user_headers), _report(client, user_headers)
+    assert client.post(f"/api/v1/payments/{approved}/approve", headers=headers).status_code == 200
+    assert client.post(f"/api/v1/payments/{rejected}/reject", headers=headers).status_code == 200
+
+    after = _stats(client, headers)
+    assert {k: after[k] - before[k] for k in after} == {"PENDING": 1, "APPROVED": 1, "REJECTED": 1}
+
+
+def test_rebuild_is_an_admin_post_that_fixes_drift(client, make_user, auth_headers, db):
+    admin, user = make_user(role="ADMIN"), make_user()
+    headers = auth_headers(admin)
+    _report(client, auth_headers(user))
+    db.execute(update(models.PaymentStatusCount).where(models.PaymentStatusCount.status == "PENDING").values(count=999))
+    db.commit()
+
+    assert _stats(client, headers)["PENDING"] == 999  # el GET solo lee
+    assert client.get("/api/v1/payments/stats/rebuild", headers=headers).status_code == 405
+    assert client.post("/api/v1/payments/stats/rebuild", headers=auth_headers(user)).status_code == 403
+
+    r = client.post("/api/v1/payments/stats/rebuild", headers=headers)
+
+    assert r.status_code == 200, r.text
+    assert r.json()["counts"] == _actual_counts(db)
+    assert _stats(client, headers) == _actual_counts(db)
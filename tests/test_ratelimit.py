@@ -0,0 +1,79 @@
+# Limitador de login (app/core/ratelimit.py): IP del cliente detrás de proxys y
+# devolución del token cuando el login es correcto.
+
+import pytest
+
+from app.core import ratelimit
+from app.core.ratelimit import MemoryBucketStore, SQLiteBucketStore, client_ip
+
+FORWARDED = {"x-forwarded-for": "6.6.6.6, 203.0.113.7, 10.0.0.2"}
+
+
+@pytest.fixture
+def proxy_settings(monkeypatch):
+    def _set(header="x-forwarded-for", hops=1, trusted=""):
+        monkeypatch.setattr(ratelimit.settings, "CLIENT_IP_HEADER", header)
+        monkeypatch.setattr(ratelimit.settings, "TRUSTED_PROXY_HOPS", hops)
+        monkeypatch.setattr(ratelimit.settings, "TRUSTED_PROXIES", trusted)
+    return _set
+
+
+def test_header_is_ignored_by_default():
+    assert client_ip(FORWARDED, "198.51.100.9") == "198.51.100.9"
+
+
+def test_one_hop_takes_the_rightmost_entry(proxy_settings):
+    proxy_settings(hops=1)
+    assert client_ip(FORWARDED, "10.0.0.1") == "10.0.0.2"
+
+
+def test_two_hops_skip_the_inner_proxy(proxy_settings):
+    # La entrada de la izquierda (6.6.6.6) la escribió el cliente: nunca se usa
+    proxy_settings(hops=2)
+    assert client_ip(FORWARDED, "10.0.0.1") == "203.0.113.7"
+
+
+def test_header_only_counts_from_a_trusted_proxy(proxy_settings):
+    proxy_settings(hops=2, trusted="10.0.0.0/8, 192.0.2.1")
+    assert client_ip(FORWARDED, "10.9.9.9") == "203.0.113.7"
+    assert client_ip(FORWARDED, "192.0.2.1") == "203.0.113.7"
+    assert client_ip(FORWARDED, "198.51.100.9") == "198.51.100.9"
+
+
+def test_missing_header_falls_back_to_the_peer(proxy_settings):
+    proxy_settings()
+    assert client_ip({}, "198.51.100.9") == "198.51.100.9"
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda tmp_path: MemoryBucketStore(),
+    lambda tmp_path: SQLiteBucketStore(str(tmp_path / "buckets.db")),
+], ids=["memory", "sqlite"])
+def test_refund_returns_the_token(make_store, tmp_path):
+    store = make_store(tmp_path)
+    assert store.take("user:x", 1, 0.0) == (True, 0.0)
+    assert store.take("user:x", 1, 0.0)[0] is False
+
+    store.refund("user:x", 1)
+
+    assert store.take("user:x", 1, 0.0)[0] is True
+    store.refund("user:x", 1)
+    store.refund("user:x", 1)  # nunca pasa de la capacidad
+    assert store.take("user:x", 1, 0.0)[0] is True
+    assert store.take("user:x", 1, 0.0)[0] is False
+
+
+def test_successful_logins_do_not_drain_the_bucket(client):
+    burst = ratelimit.settings.LOGIN_THROTTLE_USER_BURST
+    r = client.post("/api/v1/auth/register", json={
+        "name": "Throttle", "email": "throttle@example.com", "password": "pw123456", "username": "throttle",
+    })
+    assert r.status_code == 200, r.text
+
+    good = {"username": "throttle", "password": "pw123456"}
+    for _ in range(burst + 2):
+        assert client.post("/api/v1/auth/login", json=good).status_code == 200
+
+    bad = {"username": "throttle", "password": "equivocada"}
+    statuses = [client.post("/api/v1/auth/login", json=bad).status_code for _ in range(burst + 1)]
+    assert statuses == [401] * burst + [429]
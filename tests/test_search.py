@@ -0,0 +1,59 @@
+# Búsqueda de texto en GET /transactions/all (app/core/search.py): FTS5 desde 3
+# caracteres, LIKE escapado para términos cortos y resaltado con <mark>.
+
+from sqlalchemy import update
+
+from app import models
+from app.core.ledger import post_entry
+from app.core.search import FTS_MIN_CHARS, highlight_matches
+
+
+def _search(client, headers, q, user):
+    r = client.get("/api/v1/transactions/all", params={"q": q, "limit": 200}, headers=headers)
+    assert r.status_code == 200, r.text
+    return [row for row in r.json() if row["user_id"] == user.id]
+
+
+def test_fts_finds_substrings_without_case(client, make_user, auth_headers, db):
+    admin, user = make_user(role="ADMIN"), make_user()
+    post_entry(db, user.id, 5.0, "DEPOSIT", "Repuesto PISTON delantero")
+    post_entry(db, user.id, 6.0, "DEPOSIT", "Cadena trasera")
+
+    rows = _search(client, auth_headers(admin), "piston", user)
+
+    assert len("piston") >= FTS_MIN_CHARS
+    assert [row["note"] for row in rows] == ["Repuesto PISTON delantero"]
+    assert rows[0]["highlights"] == {"note": "Repuesto <mark>PISTON</mark> delantero"}
+
+
+def test_fts_index_follows_updates(client, make_user, auth_headers, db):
+    admin, user = make_user(role="ADMIN"), make_user()
+    _, tx = post_entry(db, user.id, 5.0, "DEPOSIT", "Nota vieja carburador")
+    db.execute(
+        update(models.ActivityFeed)
+        .where(models.ActivityFeed.source == "wallet", models.ActivityFeed.source_id == tx.id)
+        .values(note="Nota nueva embrague")
+    )
+    db.commit()
+    headers = auth_headers(admin)
+
+    assert _search(client, headers, "carburador", user) == []
+    assert [row["id"] for row in _search(client, headers, "embrague", user)] == [tx.id]
+
+
+def test_short_terms_use_an_escaped_like(client, make_user, auth_headers, db):
+    admin, user = make_user(role="ADMIN"), make_user()
+    post_entry(db, user.id, 5.0, "DEPOSIT", "Bono 9% extra")
+    post_entry(db, user.id, 6.0, "DEPOSIT", "Bono 95 extra")
+    headers = auth_headers(admin)
+
+    assert [row["note"] for row in _search(client, headers, "9%", user)] == ["Bono 9% extra"]
+    assert {row["note"] for row in _search(client, headers, "9", user)} == {"Bono 9% extra", "Bono 95 extra"}
+
+
+def test_highlight_escapes_html_and_marks_every_match():
+    values = {"note": "<b>Order</b> y order", "type": "deposit", "username": None}
+
+    assert highlight_matches(values, "order") == {
+        "note": "&lt;b&gt;<mark>Order</mark>&lt;/b&gt; y <mark>order</mark>",
+    }
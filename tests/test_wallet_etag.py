@@ -0,0 +1,62 @@
+# GET condicional de /wallet/me (ETag / If-None-Match -> 304).
+
+from app.core.ledger import post_entry
+
+
+def _get(client, headers, etag=None, **params):
+    extra = {"If-None-Match": etag} if etag else {}
+    return client.get("/api/v1/wallet/me", params=params, headers={**headers, **extra})
+
+
+def test_unchanged_wallet_answers_304(client, make_user, auth_headers):
+    user = make_user(balance=12.0)
+    headers = auth_headers(user)
+
+    first = _get(client, headers)
+    etag = first.headers["ETag"]
+    again = _get(client, headers, etag)
+
+    assert first.status_code == 200
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == etag
+    # Comparación débil y lista de candidatos
+    assert _get(client, headers, f'"otro", {etag.removeprefix("W/")}').status_code == 304
+
+
+def test_new_movement_changes_the_etag(client, make_user, auth_headers, db):
+    user = make_user(balance=12.0)
+    headers = auth_headers(user)
+    etag = _get(client, headers).headers["ETag"]
+
+    post_entry(db, user.id, 3.0, "DEPOSIT", "Recarga")
+    r = _get(client, headers, etag)
+
+    assert r.status_code == 200
+    assert r.headers["ETag"] != etag
+    assert r.json()["balance"] == 15.0
+
+
+def test_page_is_part_of_the_etag(client, make_user, auth_headers):
+    user = make_user(balance=12.0)
+    headers = auth_headers(user)
+    etag = _get(client, headers, limit=50).headers["ETag"]
+
+    assert _get(client, headers, etag, limit=10).status_code == 200
+
+
+def test_withdrawal_approval_changes_the_etag(client, make_user, auth_headers, db):
+    # Aprobar no cambia saldo ni último movimiento, pero el historial sí cambia
+    user, admin = make_user(balance=40.0), make_user(role="ADMIN")
+    headers = auth_headers(user)
+    client.post("/api/v1/wallet/withdraw", json={"amount": 10.0, "bank_info": "X"}, headers=headers)
+    before = _get(client, headers)
+    tx_id = before.json()["history"][0]["id"]
+
+    r = client.post(f"/api/v1/withdrawals/{tx_id}/approve", headers=auth_headers(admin))
+    assert r.status_code == 200, r.text
+    after = _get(client, headers, before.headers["ETag"])
+
+    assert after.status_code == 200
+    assert after.json()["balance"] == before.json()["balance"]
+    assert after.json()["history"][0]["type"] == "WITHDRAW"